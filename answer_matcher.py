@@ -0,0 +1,185 @@
+import functools
+import unicodedata
+
+# Транслитерация кириллицы в латиницу: ответы "Гарри Поттер" и "garri potter" сводятся к одному ключу
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'ё': 'e', 'і': 'i', 'ї': 'i', 'є': 'e', 'ў': 'u'
+})
+
+# Сколько опечаток допускается в зависимости от длины ключа ответа
+_TYPO_LIMITS = ((4, 0), (8, 1))
+_MAX_TYPOS = 2
+
+# Сколько разных ключей ответа нормализуется заранее и хранится в кэше
+MATCHER_CACHE_SIZE = 4096
+
+
+def normalize(text):
+    """
+    Приводит ответ к ключу для сравнения
+
+    Регистр и ё/е не различаются, знаки препинания, символы и пробелы удаляются,
+    кириллица транслитерируется: "Человек-паук!" и "chelovek pauk" дают один ключ.
+    """
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return ''.join(
+        char for char in text.translate(_TRANSLIT)
+        if unicodedata.category(char)[0] in ('L', 'N')
+    )
+
+
+def typo_limit(length):
+    """Сколько правок допускается для ключа такой длины"""
+    for max_length, limit in _TYPO_LIMITS:
+        if length <= max_length:
+            return limit
+    return _MAX_TYPOS
+
+
+def _segment_bounds(length, limit):
+    """Границы limit + 1 частей ключа: при limit правках хотя бы одна часть остается нетронутой"""
+    parts = limit + 1
+    return [length * part // parts for part in range(parts + 1)]
+
+
+def _char_mask(key):
+    """Битовая маска символов ключа для быстрого отсева непохожих ответов"""
+    mask = 0
+    for char in key:
+        mask |= 1 << (ord(char) & 63)
+    return mask
+
+
+def bounded_distance(a, b, limit):
+    """
+    Расстояние Левенштейна между a и b, если оно не больше limit, иначе limit + 1
+
+    Считается только полоса шириной 2 * limit + 1 вокруг диагонали, и расчет
+    прекращается, как только вся строка полосы превышает limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    beyond = limit + 1
+    previous = [j if j <= limit else beyond for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        start, end = max(1, i - limit), min(len(b), i + limit)
+        current = [beyond] * (len(b) + 1)
+        current[0] = i if i <= limit else beyond
+        row_min = current[0] if start == 1 else beyond
+        char = a[i - 1]
+        for j in range(start, end + 1):
+            cost = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost <= limit else beyond
+            if current[j] < row_min:
+                row_min = current[j]
+        if row_min > limit:
+            return beyond
+        previous = current
+    return previous[len(b)]
+
+
+class AnswerMatcher:
+    """
+    Проверка ответа по заранее построенному индексу допустимых вариантов
+
+    Варианты (text, value) нормализуются один раз при создании. Ответ игрока сначала
+    ищется в словаре точных ключей. Для поиска с опечатками каждый ключ с допуском limit
+    делится на limit + 1 частей: если правок не больше limit, одна из частей встречается
+    в ответе без изменений со сдвигом не больше limit. По индексу частей находятся
+    немногие кандидаты, они отсеиваются по набору символов, и только для оставшихся
+    считается расстояние. Время проверки почти не зависит от числа вариантов.
+    """
+
+    __slots__ = ('_exact', '_segments')
+
+    def __init__(self, aliases, fuzzy=True):
+        self._exact = {}
+        self._segments = {}
+        for text, value in aliases:
+            key = normalize(text)
+            if not key:
+                continue
+            self._exact.setdefault(key, value)
+            limit = typo_limit(len(key))
+            if not fuzzy or not limit:
+                continue
+            entry = (key, _char_mask(key), value)
+            bounds = _segment_bounds(len(key), limit)
+            for part in range(limit + 1):
+                segment = key[bounds[part]:bounds[part + 1]]
+                self._segments.setdefault((len(key), part, segment), []).append(entry)
+
+    def _candidates(self, key):
+        candidates = set()
+        for length in range(max(1, len(key) - _MAX_TYPOS), len(key) + _MAX_TYPOS + 1):
+            limit = typo_limit(length)
+            if abs(length - len(key)) > limit:
+                continue
+            bounds = _segment_bounds(length, limit)
+            for part in range(limit + 1):
+                start, size = bounds[part], bounds[part + 1] - bounds[part]
+                for position in range(max(0, start - limit), min(len(key) - size, start + limit) + 1):
+                    candidates.update(self._segments.get((length, part, key[position:position + size]), ()))
+        return candidates
+
+    def match(self, text):
+        """Значение подходящего варианта или None, если ответ не подходит или подходит к разным вариантам"""
+        key = normalize(text)
+        if not key:
+            return None
+        if key in self._exact:
+            return self._exact[key]
+
+        mask = _char_mask(key)
+        best_distance, best_values = None, set()
+        for alias_key, alias_mask, value in self._candidates(key):
+            limit = typo_limit(len(alias_key))
+            # Каждая правка меняет не больше двух символов из набора
+            if bin(mask ^ alias_mask).count('1') > 2 * limit:
+                continue
+            distance = bounded_distance(key, alias_key, limit)
+            if distance > limit:
+                continue
+            if best_distance is None or distance < best_distance:
+                best_distance, best_values = distance, {value}
+            elif distance == best_distance:
+                best_values.add(value)
+
+        return next(iter(best_values)) if len(best_values) == 1 else None
+
+
+@functools.lru_cache(maxsize=MATCHER_CACHE_SIZE)
+def answer_matcher(answer, aliases=()):
+    """Проверка ответа загадки: match() возвращает answer для правильного ответа и его вариантов"""
+    return AnswerMatcher([(answer, answer)] + [(alias, answer) for alias in aliases])
+
+
+@functools.lru_cache(maxsize=MATCHER_CACHE_SIZE)
+def option_matcher(options):
+    """Проверка ответа викторины: match() возвращает индекс варианта по номеру (с 1) или по тексту"""
+    numbers = AnswerMatcher([(str(index + 1), index) for index in range(len(options))], fuzzy=False)
+    texts = AnswerMatcher([(option, index) for index, option in enumerate(options)])
+    return _OptionMatcher(numbers, texts)
+
+
+class _OptionMatcher:
+    __slots__ = ('numbers', 'texts')
+
+    def __init__(self, numbers, texts):
+        self.numbers = numbers
+        self.texts = texts
+
+    def match(self, text):
+        # Номер варианта важнее текста: при вариантах "7", "8", "9", "10" ответ "2" - это второй вариант
+        index = self.numbers.match(text)
+        return index if index is not None else self.texts.match(text)
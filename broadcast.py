@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+import aiohttp
+from aiogram.utils import exceptions
+
+from config import BROADCAST_RATE, BROADCAST_CHAT_RATE, BROADCAST_CHAT_BURST, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых в чат писать бесполезно: бота заблокировали, удалили из чата или чата нет
+BLOCKED_ERRORS = (exceptions.Unauthorized, exceptions.ChatNotFound)
+
+# Временные ошибки, которые имеет смысл повторить с задержкой
+TRANSIENT_ERRORS = (exceptions.NetworkError, exceptions.RestartingTelegram, aiohttp.ClientError, asyncio.TimeoutError)
+
+# Сколько ограничителей чатов держать в памяти; давно не использованные и уже восполнившиеся удаляются
+CHAT_BUCKETS_LIMIT = 10000
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate событий в секунду с запасом capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = self.capacity
+        self._updated = None
+        self._lock = None
+
+    async def acquire(self):
+        """Ждет, пока появится свободный токен, и забирает его"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def is_idle(self, now):
+        """Никто не ждет токен и запас полностью восстановлен: такой ограничитель не отличается от нового"""
+        if self._lock is not None and self._lock.locked():
+            return False
+        return self._updated is None or self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+
+# Лимиты общие для всех рассылок: ограничения Telegram действуют на бота целиком
+_global_bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+_chat_buckets = OrderedDict()
+
+
+def _chat_bucket(chat_id):
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = _chat_buckets[chat_id] = TokenBucket(BROADCAST_CHAT_RATE, BROADCAST_CHAT_BURST)
+        _evict_idle_buckets()
+    else:
+        _chat_buckets.move_to_end(chat_id)
+    return bucket
+
+
+def _evict_idle_buckets():
+    """Удаляет давно не использованные ограничители сверх CHAT_BUCKETS_LIMIT, если их запас уже восстановился"""
+    now = asyncio.get_running_loop().time()
+    while len(_chat_buckets) > CHAT_BUCKETS_LIMIT:
+        chat_id, bucket = next(iter(_chat_buckets.items()))
+        if not bucket.is_idle(now):
+            break
+        del _chat_buckets[chat_id]
+
+
+class BroadcastResult:
+    """Итоги рассылки: сколько сообщений доставлено, сколько не удалось отправить и в скольких чатах бот заблокирован"""
+
+    def __init__(self):
+        self.delivered = 0
+        self.failed = 0
+        self.blocked = 0
+        self.blocked_chats = set()
+        # Чаты, перенесенные в супергруппы во время рассылки: старый ID -> новый ID
+        self.migrated_chats = {}
+
+    def __repr__(self):
+        return f"доставлено: {self.delivered}, ошибок: {self.failed}, заблокировано: {self.blocked}"
+
+
+class Broadcaster:
+    """
+    Параллельная рассылка по чатам с общим и початовым ограничением частоты.
+
+    Каждый элемент items обрабатывается корутиной worker(broadcaster, item), которая
+    отправляет сообщения через broadcaster.send_message. Учитываются RetryAfter от Telegram,
+    временные ошибки повторяются с экспоненциальной задержкой.
+    """
+
+    def __init__(self, bot, concurrency=BROADCAST_CONCURRENCY, max_retries=BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.result = BroadcastResult()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        """
+        Отправляет сообщение с учетом лимитов и повторов
+
+        Если чат перенесен в супергруппу, сообщение отправляется по новому ID, а перенос
+        записывается в result.migrated_chats. Заблокированный чат попадает в
+        result.blocked_chats и под исходным, и под новым ID.
+
+        Returns:
+            types.Message: отправленное сообщение или None, если доставить не удалось
+        """
+        requested_chat_id = chat_id
+        chat_id = self.result.migrated_chats.get(chat_id, chat_id)
+        attempt = 0
+        while True:
+            await _chat_bucket(chat_id).acquire()
+            await _global_bucket.acquire()
+            try:
+                message = await self.bot.send_message(chat_id, text, **kwargs)
+                self.result.delivered += 1
+                return message
+            except exceptions.RetryAfter as e:
+                # Telegram сам говорит, сколько ждать; это не считается неудачной попыткой
+                logger.warning(f"Превышен лимит отправки в чат {chat_id}, ждем {e.timeout} с")
+                await asyncio.sleep(e.timeout)
+            except exceptions.MigrateToChat as e:
+                # Группа стала супергруппой, сообщение нужно отправить по новому ID
+                logger.info(f"Чат {chat_id} перенесен в {e.migrate_to_chat_id}")
+                self.result.migrated_chats[requested_chat_id] = e.migrate_to_chat_id
+                chat_id = e.migrate_to_chat_id
+            except BLOCKED_ERRORS as e:
+                logger.warning(f"Бот не может писать в чат {chat_id}: {e}")
+                self.result.blocked += 1
+                self.result.blocked_chats.update((requested_chat_id, chat_id))
+                return None
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Не удалось отправить сообщение в чат {chat_id} после {attempt} попыток: {e}")
+                    self.result.failed += 1
+                    return None
+                delay = 2 ** (attempt - 1)
+                logger.warning(f"Временная ошибка при отправке в чат {chat_id}: {e}. Повтор через {delay} с")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
+                self.result.failed += 1
+                return None
+
+    async def run(self, items, worker):
+        """Обрабатывает все элементы параллельно и возвращает BroadcastResult"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(item):
+            async with semaphore:
+                try:
+                    await worker(self, item)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке рассылки для {item}: {e}")
+
+        await asyncio.gather(*(process(item) for item in items))
+        return self.result
@@ -0,0 +1,175 @@
+import datetime
+import logging
+import re
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import DEFAULT_CHAT_TIMEZONE, DAILY_TOPIC_HOUR, WEEKLY_REPORT_DAY, SCHEDULER_MISFIRE_GRACE
+from database import db
+
+logger = logging.getLogger(__name__)
+
+_OFFSET_RE = re.compile(r'^(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d{2}))?$', re.IGNORECASE)
+
+_timezones = {}
+
+
+def parse_timezone(name):
+    """
+    Возвращает часовой пояс по имени из базы IANA (Asia/Almaty) или по смещению (UTC+6, +05:30)
+
+    Raises:
+        ValueError: если часовой пояс не распознан
+    """
+    name = (name or '').strip()
+    if name in _timezones:
+        return _timezones[name]
+
+    match = _OFFSET_RE.match(name)
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes or 0))
+        if offset > datetime.timedelta(hours=14):
+            raise ValueError(f"Недопустимое смещение часового пояса: {name}")
+        tz = datetime.timezone(-offset if sign == '-' else offset, name)
+    elif name.upper() in ('UTC', 'GMT'):
+        tz = datetime.timezone.utc
+    else:
+        try:
+            tz = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Неизвестный часовой пояс: {name}")
+
+    _timezones[name] = tz
+    return tz
+
+
+class ChatSchedule:
+    """Настройки расписания чата с подставленными значениями по умолчанию"""
+
+    __slots__ = ('chat_id', 'timezone', 'tz', 'daily_topic_hour', 'report_day', 'quiet_start', 'quiet_end')
+
+    def __init__(self, chat_id, settings):
+        self.chat_id = chat_id
+        self.timezone = settings.get('timezone') or DEFAULT_CHAT_TIMEZONE
+        try:
+            self.tz = parse_timezone(self.timezone)
+        except ValueError as e:
+            logger.error(f"Чат {chat_id}: {e}, используется часовой пояс по умолчанию")
+            self.timezone = DEFAULT_CHAT_TIMEZONE
+            self.tz = parse_timezone(self.timezone)
+        self.daily_topic_hour = _default(settings.get('daily_topic_hour'), DAILY_TOPIC_HOUR)
+        self.report_day = _default(settings.get('report_day'), WEEKLY_REPORT_DAY)
+        self.quiet_start = settings.get('quiet_start')
+        self.quiet_end = settings.get('quiet_end')
+
+    def is_quiet(self, local_time):
+        """Попадает ли местное время в тихие часы чата (промежуток может переходить через полночь)"""
+        if self.quiet_start is None or self.quiet_end is None or self.quiet_start == self.quiet_end:
+            return False
+        if self.quiet_start < self.quiet_end:
+            return self.quiet_start <= local_time.hour < self.quiet_end
+        return local_time.hour >= self.quiet_start or local_time.hour < self.quiet_end
+
+
+def _default(value, default):
+    return default if value is None else value
+
+
+async def load_schedules():
+    """Загружает настройки расписания всех групповых чатов"""
+    settings = await db.get_chat_settings()
+    return [ChatSchedule(chat_id, chat_settings) for chat_id, chat_settings in settings.items()]
+
+
+def timezone_buckets(schedules, moment):
+    """
+    Группирует чаты по часовым поясам
+
+    Returns:
+        list: [(местное время moment, [ChatSchedule, ...]), ...] - по одной группе на часовой пояс
+    """
+    buckets = {}
+    for schedule in schedules:
+        bucket = buckets.get(schedule.timezone)
+        if bucket is None:
+            bucket = buckets[schedule.timezone] = (moment.astimezone(schedule.tz), [])
+        bucket[1].append(schedule)
+    return list(buckets.values())
+
+
+async def due_chats(moment, is_due, respect_quiet_hours=True):
+    """
+    Выбирает чаты, для которых задача должна выполниться в момент moment
+
+    Args:
+        moment: время запуска задачи (с часовым поясом)
+        is_due: функция (ChatSchedule, местное время) -> bool
+        respect_quiet_hours: пропускать чаты, у которых сейчас тихие часы
+
+    Returns:
+        list: [(местное время, [chat_id, ...]), ...] - непустые группы по часовым поясам
+    """
+    result = []
+    for local_time, schedules in timezone_buckets(await load_schedules(), moment):
+        chat_ids = [
+            schedule.chat_id for schedule in schedules
+            if is_due(schedule, local_time) and not (respect_quiet_hours and schedule.is_quiet(local_time))
+        ]
+        if chat_ids:
+            result.append((local_time, chat_ids))
+    return result
+
+
+def last_daily(local_time, hour):
+    """Последнее наступившее к local_time время hour:00 по местному времени"""
+    send_time = local_time.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if send_time > local_time:
+        send_time -= datetime.timedelta(days=1)
+    return send_time
+
+
+def last_weekly(local_time, weekday, hour):
+    """Последнее наступившее к local_time время hour:00 в день недели weekday (0 - понедельник)"""
+    send_time = last_daily(local_time, hour)
+    return send_time - datetime.timedelta(days=(send_time.weekday() - weekday) % 7)
+
+
+async def pending_chats(job, moment, send_time, period_key, respect_quiet_hours=True, grace=SCHEDULER_MISFIRE_GRACE):
+    """
+    Выбирает чаты, для которых период задачи job наступил, но еще не выполнен
+
+    В отличие от due_chats время не обязано совпадать с часом отправки: если бот не работал
+    в момент отправки, чат попадает в выборку при следующем запуске, пока не начнется
+    новый период. Чат без истории выполнения догоняется только в пределах grace секунд.
+    После отправки периоды отмечаются через mark_chats_done.
+
+    Args:
+        job: имя задачи в таблице chat_job_runs
+        moment: время запуска задачи (с часовым поясом)
+        send_time: функция (ChatSchedule, местное время) -> последнее наступившее время отправки
+        period_key: функция (время отправки) -> идентификатор периода (run_id)
+        respect_quiet_hours: откладывать чаты, у которых сейчас тихие часы
+
+    Returns:
+        list: [(run_id, [chat_id, ...]), ...] - непустые группы по периодам
+    """
+    runs = await db.get_chat_job_runs(job)
+    result = {}
+    for local_time, schedules in timezone_buckets(await load_schedules(), moment):
+        for schedule in schedules:
+            due_at = send_time(schedule, local_time)
+            run_id = period_key(due_at)
+            last_run = runs.get(schedule.chat_id)
+            if last_run == run_id:
+                continue
+            if last_run is None and (local_time - due_at).total_seconds() > grace:
+                continue
+            if respect_quiet_hours and schedule.is_quiet(local_time):
+                continue
+            result.setdefault(run_id, []).append(schedule.chat_id)
+    return list(result.items())
+
+
+async def mark_chats_done(job, run_id, chat_ids):
+    """Отмечает период run_id задачи job выполненным для чатов"""
+    await db.save_chat_job_runs(job, run_id, chat_ids)
@@ -11,6 +11,30 @@ BOT_TOKEN = TOKEN  # Для обратной совместимости
 # Имя пользователя бота (без @)
 BOT_USERNAME = os.getenv('BOT_USERNAME', 'your_bot_username')
 
+# Способ получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Сколько обработчиков обновлений работает параллельно; обновления одного чата всегда попадают к одному и тому же
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))
+
+# Настройки хранилища состояний FSM (игры, создание событий)
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))  # Через сколько секунд без изменений состояние считается брошенным и удаляется
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))  # Сколько состояний держать в памяти (вытесняются давно не использованные)
+FSM_FLUSH_INTERVAL_MS = int(os.getenv('FSM_FLUSH_INTERVAL_MS', '1000'))  # Изменения состояний за этот интервал записываются в базу одной транзакцией
+
+# Адрес Bot API; для тестов можно указать локальную заглушку, например http://127.0.0.1:8081/bot{token}/{method}
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+
+# Настройки режима webhook
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '')  # Публичный адрес бота, например https://bot.example.com:8443
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')  # Путь, на который Telegram присылает обновления
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SSL_CERT = os.getenv('WEBHOOK_SSL_CERT', '')  # Сертификат для HTTPS без прокси; самоподписанный загружается в Telegram
+WEBHOOK_SSL_KEY = os.getenv('WEBHOOK_SSL_KEY', '')  # Закрытый ключ сертификата
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')  # Адрес, на котором слушает веб-сервер
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8443'))  # Порт веб-сервера
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # Сколько соединений Telegram может открыть одновременно
+
 # Список ID администраторов (может быть пустым)
 ADMIN_ID = [
     1323242332,  # Основной администратор
@@ -26,6 +50,23 @@ ADMIN_IDS = ADMIN_ID  # Важно: это ссылка на тот же спи
 
 # Настройки базы данных
 DB_PATH = os.getenv('DB_PATH', 'activity_bot.db')
+DB_POOL_READERS = int(os.getenv('DB_POOL_READERS', '3'))  # Количество соединений на чтение в пуле
+
+# Настройки пакетной записи активности
+ACTIVITY_FLUSH_ROWS = int(os.getenv('ACTIVITY_FLUSH_ROWS', '100'))  # Записать пакет при накоплении стольких записей
+ACTIVITY_FLUSH_INTERVAL_MS = int(os.getenv('ACTIVITY_FLUSH_INTERVAL_MS', '500'))  # Максимальная задержка записи пакета в миллисекундах
+ACTIVITY_CRASH_SAFE = os.getenv('ACTIVITY_CRASH_SAFE', '0') == '1'  # Ждать фиксации пакета перед ответом (без потери данных при падении)
+ACTIVITY_CACHE_SIZE = int(os.getenv('ACTIVITY_CACHE_SIZE', '50000'))  # Сколько пользователей и чатов держать в памяти (итоги, известные профили)
+
+# Настройки хранилища SQLite, применяются к каждому соединению с базой
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),  # WAL: чтение не блокирует запись и наоборот
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),  # В режиме WAL NORMAL безопасен и не делает fsync на каждую транзакцию
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-16000')),  # Отрицательное значение задает размер кэша в КиБ
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', '134217728')),  # Размер отображаемой в память части файла в байтах
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),  # Сколько миллисекунд ждать снятия блокировки
+}
+SQLITE_CHECKPOINT_INTERVAL = int(os.getenv('SQLITE_CHECKPOINT_INTERVAL', '300'))  # Период принудительного checkpoint журнала WAL в секундах
 
 # Настройки системы активности
 POINTS_PER_MESSAGE = 1.0  # Базовое количество баллов за сообщение
@@ -33,15 +74,45 @@ POINTS_PER_REPLY = 1.5    # Баллы за ответ на сообщение
 MEDIA_BONUS = 0.7         # Бонус за отправку медиа
 LONG_MESSAGE_BONUS = 0.5  # Бонус за длинное сообщение (>100 символов)
 
+# Наборы контента: загадки, вопросы, темы дня, шутки и факты в файлах JSONL
+CONTENT_DIR = os.getenv('CONTENT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content'))
+CONTENT_RELOAD_INTERVAL = int(os.getenv('CONTENT_RELOAD_INTERVAL', '60'))  # Как часто (в секундах) проверять, изменились ли файлы контента
+
 # Настройки игр
 EMOJI_GAME_POINTS = 5.0   # Баллы за правильный ответ в игре эмодзи
 QUIZ_GAME_POINTS = 3.0    # Баллы за правильный ответ в викторине
+GAME_ROUND_TIMEOUT = int(os.getenv('GAME_ROUND_TIMEOUT', '300'))  # Через сколько секунд без правильного ответа раунд игры закрывается и ответ раскрывается
+GAME_USER_COOLDOWN = int(os.getenv('GAME_USER_COOLDOWN', '3600'))  # Сколько секунд игрок ждет перед запуском новой игры в том же чате
+GAME_COOLDOWN_PERSIST = os.getenv('GAME_COOLDOWN_PERSIST', '1') == '1'  # Сохранять ограничения в базе, чтобы они переживали перезапуск
 
 # Настройки периодических задач
 INACTIVE_USER_DAYS = 7    # Количество дней для определения неактивного пользователя
 REPORT_INTERVAL_DAYS = 7  # Интервал между отчетами об активности в днях
-DAILY_TOPIC_HOUR = 10     # Час для отправки ежедневной темы (по UTC)
-ACTIVE_USER_HOUR = 20     # Час для объявления самого активного пользователя (по UTC)
+DAILY_TOPIC_HOUR = 12     # Час для отправки ежедневной темы (по местному времени чата, можно изменить для чата)
+ACTIVE_USER_HOUR = 20     # Час для объявления самого активного пользователя (по местному времени чата)
+WEEKLY_REPORT_DAY = 0     # День недели еженедельного отчета (0 - понедельник, можно изменить для чата)
+WEEKLY_REPORT_HOUR = 9    # Час отправки еженедельного отчета (по местному времени чата)
+INACTIVE_CHECK_HOUR = 10  # Час проверки неактивных пользователей (по местному времени чата)
+RANDOM_QUESTION_HOURS = (10, 19)  # Вопрос дня отправляется в случайное время в этом промежутке часов
+
+# Настройки массовых рассылок по чатам
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))  # Общий лимит сообщений в секунду (ограничение Telegram ~30/с)
+BROADCAST_CHAT_RATE = float(os.getenv('BROADCAST_CHAT_RATE', '0.33'))  # Лимит сообщений в секунду в один чат (в группах ~20 в минуту)
+BROADCAST_CHAT_BURST = int(os.getenv('BROADCAST_CHAT_BURST', '3'))  # Сколько сообщений подряд можно отправить в чат без ожидания
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))  # Сколько чатов обрабатывается одновременно
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))  # Повторы при временных ошибках сети и Telegram
+
+# Настройки очереди исходящих сообщений
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))  # Сколько сообщений диспетчер берет из очереди за раз
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))  # Как часто проверять очередь без новых сообщений (в секундах)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))  # После стольких неудачных попыток сообщение помечается как failed
+OUTBOX_RETRY_DELAY = int(os.getenv('OUTBOX_RETRY_DELAY', '60'))  # Базовая задержка повторной отправки в секундах (удваивается с каждой попыткой)
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '7'))  # Сколько дней хранить обработанные сообщения
+
+# Настройки планировщика регулярных задач
+SCHEDULER_UTC_OFFSET_HOURS = int(os.getenv('SCHEDULER_UTC_OFFSET_HOURS', '6'))  # Часовой пояс расписания (по умолчанию Астана, UTC+6)
+SCHEDULER_MISFIRE_GRACE = int(os.getenv('SCHEDULER_MISFIRE_GRACE', '3600'))  # Запуск, пропущенный не раньше стольких секунд назад, выполняется после старта
+DEFAULT_CHAT_TIMEZONE = os.getenv('DEFAULT_CHAT_TIMEZONE', 'UTC+6')  # Часовой пояс чатов без своих настроек: имя из базы IANA или смещение вида UTC+6
 
 # Настройки челленджей
 CHALLENGE_DURATION_DAYS = 3  # Продолжительность одного челленджа в днях
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import random
+import time
+
+from config import CONTENT_DIR, CONTENT_RELOAD_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Поля элементов, по которым строятся индексы для выборки
+FACET_FIELDS = ('category', 'difficulty')
+
+
+class ContentView:
+    """Последовательность элементов набора по списку их номеров"""
+
+    __slots__ = ('_items', '_indexes')
+
+    def __init__(self, items, indexes):
+        self._items = items
+        self._indexes = indexes
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def __getitem__(self, position):
+        return self._items[self._indexes[position]]
+
+
+class ContentPack:
+    """
+    Набор контента (загадки, вопросы, шутки) из файла JSONL в CONTENT_DIR.
+
+    Каждая строка файла - JSON-объект с уникальным полем id и необязательными полями
+    category и difficulty; пустые строки и строки, начинающиеся с #, пропускаются.
+    Файл читается при первом обращении, а не при импорте, и перечитывается, если
+    изменился (проверка не чаще раза в CONTENT_RELOAD_INTERVAL секунд). По id и по
+    значениям category и difficulty строятся индексы, поэтому поиск по id и случайный
+    выбор, в том числе среди элементов одной категории, не зависят от размера набора.
+    """
+
+    def __init__(self, name, required=(), directory=None):
+        self.name = name
+        self.required = tuple(required)
+        self.path = os.path.join(directory or CONTENT_DIR, f'{name}.jsonl')
+        # Увеличивается при каждой загрузке файла; по нему можно понять, что набор изменился
+        self.version = 0
+        self._items = None
+        self._by_id = {}
+        self._facets = {}
+        self._combined = {}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._items is not None and now - self._checked_at < CONTENT_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            if self._items is None:
+                logger.error(f"Не удалось открыть набор контента {self.name}: {e}")
+                self._items = []
+            return
+
+        if mtime != self._mtime:
+            self._load(mtime)
+
+    def _load(self, mtime):
+        items, by_id, facets = [], {}, {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except ValueError as e:
+                        logger.error(f"{self.path}:{line_number}: некорректный JSON: {e}")
+                        continue
+
+                    missing = [field for field in ('id',) + self.required if item.get(field) is None]
+                    if missing:
+                        logger.error(f"{self.path}:{line_number}: нет полей {', '.join(missing)}")
+                        continue
+                    if item['id'] in by_id:
+                        logger.error(f"{self.path}:{line_number}: повторяющийся id {item['id']}")
+                        continue
+
+                    index = len(items)
+                    items.append(item)
+                    by_id[item['id']] = index
+                    for field in FACET_FIELDS:
+                        value = item.get(field)
+                        if value is not None:
+                            facets.setdefault((field, value), []).append(index)
+        except OSError as e:
+            logger.error(f"Не удалось прочитать набор контента {self.name}: {e}")
+            if self._items is None:
+                self._items = []
+            return
+
+        # Новый набор подменяет старый целиком, уже выбранные элементы остаются валидными
+        self._items, self._by_id, self._facets, self._combined = items, by_id, facets, {}
+        self._mtime = mtime
+        self.version += 1
+        logger.info(f"Загружен набор контента {self.name}: {len(items)} элементов")
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._items)
+
+    def get(self, item_id):
+        """Возвращает элемент по id или None"""
+        self._ensure_loaded()
+        index = self._by_id.get(item_id)
+        return None if index is None else self._items[index]
+
+    def at(self, index):
+        """Возвращает элемент по номеру в наборе"""
+        self._ensure_loaded()
+        return self._items[index]
+
+    def indexes(self, category=None, difficulty=None):
+        """
+        Номера элементов с указанными категорией и сложностью (None - любые)
+
+        Возвращается общий список индекса, изменять его нельзя.
+        """
+        self._ensure_loaded()
+        if category is None and difficulty is None:
+            return range(len(self._items))
+        if difficulty is None:
+            return self._facets.get(('category', category), [])
+        if category is None:
+            return self._facets.get(('difficulty', difficulty), [])
+
+        key = (category, difficulty)
+        if key not in self._combined:
+            in_category = self._facets.get(('category', category), [])
+            in_difficulty = set(self._facets.get(('difficulty', difficulty), []))
+            self._combined[key] = [index for index in in_category if index in in_difficulty]
+        return self._combined[key]
+
+    def view(self, category=None, difficulty=None):
+        """
+        Элементы с указанными категорией и сложностью как последовательность без копирования
+
+        Представление ссылается на текущую загрузку набора и не меняется при перезагрузке файла.
+        """
+        indexes = self.indexes(category, difficulty)
+        return ContentView(self._items, indexes)
+
+    def items(self, category=None, difficulty=None):
+        """Элементы с указанными категорией и сложностью"""
+        return [self._items[index] for index in self.indexes(category, difficulty)]
+
+    def random(self, category=None, difficulty=None):
+        """Случайный элемент с указанными категорией и сложностью или None, если таких нет"""
+        indexes = self.indexes(category, difficulty)
+        if not indexes:
+            return None
+        return self._items[random.choice(indexes)]
+
+    def values(self, field):
+        """Все встречающиеся значения поля category или difficulty"""
+        self._ensure_loaded()
+        return sorted(value for facet_field, value in self._facets if facet_field == field)
+
+
+# Наборы контента бота
+emoji_riddles = ContentPack('emoji_riddles', required=('riddle', 'answer'))
+quiz_questions = ContentPack('quiz_questions', required=('question', 'options', 'correct'))
+daily_topics = ContentPack('daily_topics', required=('text',))
+random_questions = ContentPack('random_questions', required=('text',))
+fun_content = ContentPack('fun', required=('text', 'category'))
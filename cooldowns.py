@@ -0,0 +1,151 @@
+import asyncio
+import datetime
+import heapq
+import logging
+
+from config import GAME_USER_COOLDOWN, GAME_COOLDOWN_PERSIST
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд после запуска игры изменения записываются в базу
+FLUSH_DELAY = 1.0
+
+# Куча пересобирается, когда устаревших записей в ней становится больше актуальных
+COMPACT_MIN_SIZE = 64
+
+
+class Cooldown:
+    """Последний запуск игры пользователем в чате"""
+
+    __slots__ = ('chat_id', 'user_id', 'game_type', 'started_at', 'expires_at')
+
+    def __init__(self, chat_id, user_id, game_type, started_at, expires_at):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.game_type = game_type
+        self.started_at = started_at  # datetime в UTC
+        self.expires_at = expires_at
+
+    def seconds_left(self, now):
+        return max(0.0, (self.expires_at - now).total_seconds())
+
+
+class CooldownStore:
+    """
+    Ограничения на частоту запуска игр: один игрок в одном чате не чаще раза в cooldown секунд.
+
+    Записи лежат в словаре по (chat_id, user_id) и в куче по времени истечения, поэтому
+    истекшие записи удаляются с вершины кучи без обхода всего словаря, а в памяти остаются
+    только игроки, для которых ограничение еще действует. При persistent запуски сохраняются
+    в таблицу game_cooldowns и восстанавливаются после перезапуска бота.
+    """
+
+    def __init__(self, cooldown=GAME_USER_COOLDOWN, persistent=GAME_COOLDOWN_PERSIST):
+        self.cooldown = cooldown
+        self.persistent = persistent
+        self._entries = {}
+        self._heap = []  # (expires_at, chat_id, user_id); записи с другим expires_at устарели
+        self._pending = {}
+        self._flush_task = None
+
+    def __len__(self):
+        self.evict()
+        return len(self._entries)
+
+    @staticmethod
+    def now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def _push(self, entry):
+        heapq.heappush(self._heap, (entry.expires_at, entry.chat_id, entry.user_id))
+        if len(self._heap) > COMPACT_MIN_SIZE and len(self._heap) > 2 * len(self._entries):
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(entry.expires_at, entry.chat_id, entry.user_id) for entry in self._entries.values()]
+        heapq.heapify(self._heap)
+
+    def evict(self, now=None):
+        """Удаляет записи, у которых ограничение истекло"""
+        now = now or self.now()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, chat_id, user_id = heapq.heappop(self._heap)
+            entry = self._entries.get((chat_id, user_id))
+            if entry is not None and entry.expires_at == expires_at:
+                del self._entries[(chat_id, user_id)]
+
+    def get(self, chat_id, user_id):
+        """Возвращает действующее ограничение игрока в чате или None"""
+        now = self.now()
+        self.evict(now)
+        entry = self._entries.get((chat_id, user_id))
+        if entry is None or entry.expires_at <= now:
+            return None
+        return entry
+
+    def start(self, chat_id, user_id, game_type, started_at=None):
+        """Запоминает запуск игры; ограничение действует cooldown секунд"""
+        started_at = started_at or self.now()
+        entry = Cooldown(chat_id, user_id, game_type, started_at,
+                         started_at + datetime.timedelta(seconds=self.cooldown))
+        self._entries[(chat_id, user_id)] = entry
+        self._push(entry)
+
+        if self.persistent:
+            self._pending[(chat_id, user_id)] = entry
+            if self._flush_task is None:
+                self._flush_task = asyncio.ensure_future(self._flush_later())
+        return entry
+
+    def set_cooldown(self, cooldown):
+        """Меняет длительность ограничения, в том числе для уже запущенных игр"""
+        self.cooldown = cooldown
+        delta = datetime.timedelta(seconds=cooldown)
+        for entry in self._entries.values():
+            entry.expires_at = entry.started_at + delta
+        self._rebuild_heap()
+        self.evict()
+
+    async def load(self):
+        """Восстанавливает из базы ограничения, которые еще действуют"""
+        if not self.persistent:
+            return
+        since = self.now() - datetime.timedelta(seconds=self.cooldown)
+        for chat_id, user_id, game_type, started_at in await db.get_game_cooldowns(since):
+            current = self._entries.get((chat_id, user_id))
+            if current is None or current.started_at < started_at:
+                entry = Cooldown(chat_id, user_id, game_type, started_at,
+                                 started_at + datetime.timedelta(seconds=self.cooldown))
+                self._entries[(chat_id, user_id)] = entry
+                self._push(entry)
+        self.evict()
+        logger.info(f"Восстановлено ограничений на запуск игр: {len(self._entries)}")
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(FLUSH_DELAY)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Записывает новые запуски игр в базу и удаляет оттуда истекшие"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await db.save_game_cooldowns(
+                [(entry.chat_id, entry.user_id, entry.game_type, entry.started_at) for entry in pending.values()],
+                expired_before=self.now() - datetime.timedelta(seconds=self.cooldown)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении ограничений на запуск игр: {e}")
+            for key, entry in pending.items():
+                self._pending.setdefault(key, entry)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
@@ -1,211 +1,287 @@
 import aiosqlite
 import asyncio
+import bisect
+import contextvars
 import datetime
+import json
 import logging
-from config import DB_PATH
+import random
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from config import DB_PATH, DB_POOL_READERS, ACTIVITY_FLUSH_ROWS, ACTIVITY_FLUSH_INTERVAL_MS, ACTIVITY_CRASH_SAFE, ACTIVITY_CACHE_SIZE, SQLITE_CHECKPOINT_INTERVAL
+from migrations import apply_migrations, ACTIVITY_DAILY_BACKFILL
+from ranks import RANKS, seed_ranks
+from storage import apply_pragmas
 
 logger = logging.getLogger(__name__)
 
+# Счетчики по типам активности в суточной сводке activity_daily; неизвестные типы попадают в other_count
+DAILY_TYPE_COLUMNS = ('text_count', 'long_text_count', 'media_count', 'reply_count', 'question_count', 'game_count', 'other_count')
+DAILY_TYPE_INDEX = {
+    'text': 0,
+    'long_text': 1,
+    'media': 2,
+    'reply': 3,
+    'question_response': 4,
+    'emoji_game': 5,
+    'quiz': 5,
+}
+
+# Настройки расписания чата в таблице chat_settings
+CHAT_SETTINGS_COLUMNS = ('timezone', 'daily_topic_hour', 'report_day', 'quiet_start', 'quiet_end')
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: одно соединение на запись и несколько на чтение"""
+
+    def __init__(self, db_path, readers=DB_POOL_READERS):
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self._writer = None
+        self._write_lock = None
+        self._readers = None
+        self._connections = []
+        self._open_task = None
+        self._checkpoint_task = None
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def open(self):
+        """Открывает соединения пула (повторный вызов ничего не делает)"""
+        if self._open_task is None:
+            self._open_task = asyncio.ensure_future(self._open())
+        await self._open_task
+
+    async def _open(self):
+        # Блокировка и очередь создаются внутри работающего цикла событий
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        try:
+            writer = await self._connect()
+            for _ in range(self.readers_count):
+                self._readers.put_nowait(await self._connect())
+        except Exception:
+            await self._close_connections()
+            self._open_task = None
+            raise
+        self._writer = writer
+        logger.info(f"Пул соединений открыт: 1 на запись, {self.readers_count} на чтение")
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.db_path)
+        self._connections.append(conn)
+        await apply_pragmas(conn)
+        return conn
+
+    async def _close_connections(self):
+        for conn in self._connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии соединения с базой: {e}")
+        self._connections = []
+
+    async def close(self):
+        """Закрывает все соединения пула"""
+        if self._open_task is None:
+            return
+        try:
+            await self._open_task
+        except Exception:
+            pass
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+            try:
+                await self._checkpoint_task
+            except asyncio.CancelledError:
+                pass
+            self._checkpoint_task = None
+        if self._write_lock is not None:
+            # Дожидаемся завершения текущей записи и переносим журнал WAL в основной файл
+            async with self._write_lock:
+                await self._checkpoint('TRUNCATE')
+                await self._close_connections()
+        else:
+            await self._close_connections()
+        self._writer = None
+        self._readers = None
+        self._open_task = None
+        logger.info("Пул соединений с базой данных закрыт")
+
+    async def _checkpoint(self, mode):
+        if self._writer is None:
+            return
+        try:
+            cursor = await self._writer.execute(f'PRAGMA wal_checkpoint({mode})')
+            busy, log_pages, checkpointed = await cursor.fetchone()
+            logger.debug(f"Checkpoint WAL ({mode}): страниц в журнале {log_pages}, перенесено {checkpointed}, занято {busy}")
+        except Exception as e:
+            logger.error(f"Ошибка при checkpoint журнала WAL: {e}")
+
+    async def checkpoint(self, mode='TRUNCATE'):
+        """Переносит журнал WAL в основной файл базы и обрезает его"""
+        await self.open()
+        async with self._write_lock:
+            await self._checkpoint(mode)
+
+    async def _checkpoint_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.checkpoint()
+
+    def start_checkpoints(self, interval=SQLITE_CHECKPOINT_INTERVAL):
+        """Запускает фоновый checkpoint, чтобы журнал WAL не рос без ограничений"""
+        if self._checkpoint_task is None and interval > 0:
+            self._checkpoint_task = asyncio.ensure_future(self._checkpoint_loop(interval))
+
+    @asynccontextmanager
+    async def writer(self):
+        """Эксклюзивный доступ к соединению на запись; при ошибке транзакция откатывается"""
+        await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except Exception:
+                try:
+                    await self._writer.rollback()
+                except Exception as e:
+                    logger.error(f"Ошибка при откате транзакции: {e}")
+                raise
+
+    @asynccontextmanager
+    async def reader(self):
+        """Берет свободное соединение на чтение и возвращает его в пул после использования"""
+        await self.open()
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+
+# Открытая в текущей задаче транзакция; вложенные вызовы transaction() используют ее же
+_current_transaction = contextvars.ContextVar('current_transaction', default=None)
+
+
+class TransactionAborted(Exception):
+    """Вложенный блок транзакции завершился ошибкой, и вся транзакция откатывается"""
+
+
+class Transaction:
+    """
+    Единица работы: запросы составной операции на одном соединении на запись.
+    
+    Транзакция фиксируется одним commit при выходе из внешнего Database.transaction()
+    и откатывается целиком при ошибке. Изменения в памяти, которые должны совпадать
+    с базой, регистрируются через on_commit и on_rollback.
+    """
+    
+    __slots__ = ('conn', 'active', 'rollback_only', '_on_commit', '_on_rollback')
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.active = True
+        # Вложенный блок завершился ошибкой: зафиксировать такую транзакцию уже нельзя
+        self.rollback_only = False
+        self._on_commit = []
+        self._on_rollback = []
+    
+    async def execute(self, sql, parameters=None):
+        return await self.conn.execute(sql, parameters)
+    
+    async def executemany(self, sql, parameters):
+        return await self.conn.executemany(sql, parameters)
+    
+    def on_commit(self, callback):
+        """Вызывает callback() после успешной фиксации транзакции"""
+        self._on_commit.append(callback)
+    
+    def on_rollback(self, callback):
+        """Вызывает callback() после отката транзакции"""
+        self._on_rollback.append(callback)
+    
+    def _finish(self, committed):
+        self.active = False
+        for callback in self._on_commit if committed else reversed(self._on_rollback):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике завершения транзакции: {e}")
+
+
 class Database:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        
+        # Буфер пакетной записи активности и итоги пользователей в памяти
+        self._activity_buffer = []
+        self._rank_updates = {}
+        self._flush_waiters = []
+        # Итоги держатся для не более чем ACTIVITY_CACHE_SIZE пользователей, давно не писавшие вытесняются
+        self._user_points = OrderedDict()
+        self._user_ranks = {}
+        # Профили чатов и пользователей пишутся вместе с пакетом активности;
+        # уже записанные без изменений повторно не пишутся
+        self._pending_chats = {}
+        self._pending_users = {}
+        self._known_profiles = OrderedDict()
+        self._flush_pending = None
+        self._flush_full = None
+        self._flush_task = None
+        
+        # Ранги статичны, поэтому держим их в памяти и не обращаемся к базе при каждом сообщении
+        self._load_ranks(RANKS)
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Открывает транзакцию на соединении на запись или присоединяется к уже открытой
+        
+        Составные операции вызывают друг друга внутри одной транзакции: вложенный
+        transaction() не берет второе соединение и не фиксирует изменения сам,
+        commit выполняет только внешний. При ошибке откатывается вся транзакция, в том
+        числе если ошибку вложенного блока перехватил вызывающий код: тогда внешний блок
+        вместо commit выбрасывает TransactionAborted.
+        """
+        current = _current_transaction.get()
+        if current is not None and current.active:
+            try:
+                yield current
+            except Exception:
+                current.rollback_only = True
+                raise
+            return
+        
+        async with self.pool.writer() as conn:
+            tx = Transaction(conn)
+            token = _current_transaction.set(tx)
+            try:
+                yield tx
+                if tx.rollback_only:
+                    raise TransactionAborted("Вложенная операция завершилась ошибкой, транзакция откатывается")
+                await conn.commit()
+            except Exception:
+                tx._finish(committed=False)
+                raise
+            finally:
+                _current_transaction.reset(token)
+        tx._finish(committed=True)
         
     async def create_tables(self):
         """Создает необходимые таблицы, если они еще не существуют"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Таблица чатов
-                await db.execute(
-                    '''
-                CREATE TABLE IF NOT EXISTS chats (
-                    chat_id INTEGER PRIMARY KEY,
-                    title TEXT,
-                    joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            '''
-                )
+            async with self.pool.writer() as db:
+                # Схема создается и обновляется пронумерованными миграциями
+                version = await apply_migrations(db)
+                logger.debug(f"Версия схемы базы данных: {version}")
                 
-                # Таблица пользователей
-                await db.execute(
-                    '''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    current_rank TEXT DEFAULT "🔍 Искатель"
-                )
-            '''
-                )
+                # Ранги перезаписываются только при изменении списка в ranks.py
+                if await seed_ranks(db):
+                    logger.info("Таблица рангов обновлена")
                 
-                # Проверка наличия колонки current_rank и добавление ее, если отсутствует
-                try:
-                    # Проверяем PRAGMA для получения информации о столбцах
-                    cursor = await db.execute("PRAGMA table_info(users)")
-                    columns = await cursor.fetchall()
-                    column_names = [column[1] for column in columns]
-                    
-                    # Если колонки current_rank нет, добавляем ее
-                    if 'current_rank' not in column_names:
-                        logger.info("Добавление отсутствующей колонки current_rank в таблицу users")
-                        await db.execute('''
-                            ALTER TABLE users 
-                            ADD COLUMN current_rank TEXT DEFAULT "🔍 Искатель"
-                        ''')
-                        await db.commit()
-                except Exception as e:
-                    logger.error(f"Ошибка при проверке колонки current_rank: {e}")
-                
-                # Таблица активности
-                await db.execute(
-                    '''
-                CREATE TABLE IF NOT EXISTS activity (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    user_id INTEGER,
-                    message_type TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    points REAL DEFAULT 0,
-                    FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            '''
-                )
-                
-                # Таблица рангов
-                await db.execute(
-                    '''
-                CREATE TABLE IF NOT EXISTS ranks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE,
-                    min_points INTEGER,
-                    max_points INTEGER
-                )
-            '''
-                )
-                
-                # Добавляем новую таблицу для отслеживания вопросов дня
-                await db.execute(
-                    '''
-                CREATE TABLE IF NOT EXISTS daily_questions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    message_id INTEGER,
-                    question TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-                )
-            '''
-                )
-                
-                # Добавляем новую таблицу для отслеживания ответов на вопросы
-                await db.execute(
-                    '''
-                CREATE TABLE IF NOT EXISTS question_responses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question_id INTEGER,
-                    user_id INTEGER,
-                    points_awarded REAL DEFAULT 0,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (question_id) REFERENCES daily_questions (id),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            '''
-                )
-                
-                # Создаем/обновляем ранги
-                await db.execute('DELETE FROM ranks')
-                # Уровень 1: 0-99 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔍 Искатель', 0, 99))
-                # Уровень 2: 100-249 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('👣 Путник', 100, 249))
-                # Уровень 3: 250-499 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('📚 Ученик', 250, 499))
-                # Уровень 4: 500-749 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚔️ Воин чата', 500, 749))
-                # Уровень 5: 750-999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧙 Подмастерье', 750, 999))
-                # Уровень 6: 1000-1499 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🏹 Следопыт', 1000, 1499))
-                # Уровень 7: 1500-1999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🛡️ Защитник', 1500, 1999))
-                # Уровень 8: 2000-2499 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔮 Мистик', 2000, 2499))
-                # Уровень 9: 2500-2999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧠 Мудрец', 2500, 2999))
-                # Уровень 10: 3000-3499 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚡ Элементалист', 3000, 3499))
-                # Уровень 11: 3500-3999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌙 Ночной клинок', 3500, 3999))
-                # Уровень 12: 4000-4499 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌿 Хранитель рощи', 4000, 4499))
-                # Уровень 13: 4500-4999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⛏️ Мастер-кузнец', 4500, 4999))
-                # Уровень 14: 5000-5999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🐉 Укротитель драконов', 5000, 5999))
-                # Уровень 15: 6000-6999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧝 Древний эльф', 6000, 6999))
-                # Уровень 16: 7000-7999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌋 Повелитель огня', 7000, 7999))
-                # Уровень 17: 8000-8999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('❄️ Хозяин льда', 8000, 8999))
-                # Уровень 18: 9000-9999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌪️ Властелин бури', 9000, 9999))
-                # Уровень 19: 10000-11999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🏰 Командир крепости', 10000, 11999))
-                # Уровень 20: 12000-13999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('👑 Правитель провинции', 12000, 13999))
-                # Уровень 21: 14000-15999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('💎 Собиратель артефактов', 14000, 15999))
-                # Уровень 22: 16000-19999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌟 Звездный маг', 16000, 19999))
-                # Уровень 23: 20000-23999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔱 Морской владыка', 20000, 23999))
-                # Уровень 24: 24000-27999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚜️ Королевский рыцарь', 24000, 27999))
-                # Уровень 25: 28000-31999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧿 Хранитель тайн', 28000, 31999))
-                # Уровень 26: 32000-35999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌓 Повелитель теней', 32000, 35999))
-                # Уровень 27: 36000-39999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('☀️ Солнечный чемпион', 36000, 39999))
-                # Уровень 28: 40000-44999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🦅 Небесный страж', 40000, 44999))
-                # Уровень 29: 45000-49999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🦁 Воин света', 45000, 49999))
-                # Уровень 30: 50000-59999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🏆 Легендарный герой', 50000, 59999))
-                # Уровень 31: 60000-69999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('👁️ Всевидящий', 60000, 69999))
-                # Уровень 32: 70000-79999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('💫 Космический странник', 70000, 79999))
-                # Уровень 33: 80000-89999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌈 Хранитель миров', 80000, 89999))
-                # Уровень 34: 90000-99999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧚 Бессмертный архимаг', 90000, 99999))
-                # Уровень 35: 100000-124999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔥 Аватар феникса', 100000, 124999))
-                # Уровень 36: 125000-149999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌌 Повелитель вселенной', 125000, 149999))
-                # Уровень 37: 150000-199999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⭐ Астральный владыка', 150000, 199999))
-                # Уровень 38: 200000-249999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌠 Пожиратель звезд', 200000, 249999))
-                # Уровень 39: 250000-299999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚡ Хранитель вечности', 250000, 299999))
-                # Уровень 40: 300000-399999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('💫 Творец реальности', 300000, 399999))
-                # Уровень 41: 400000-499999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌞 Солнцеликий', 400000, 499999))
-                # Уровень 42: 500000-749999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌑 Лунный оракул', 500000, 749999))
-                # Уровень 43: 750000-999999 очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌀 Повелитель времени', 750000, 999999))
-                # Уровень 44: 1000000+ очков
-                await db.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('✨ Божественная сущность', 1000000, 1000000000))
-                
-                await db.commit()
                 logger.debug("Таблицы и ранги успешно созданы")
                 
         except Exception as e:
@@ -213,7 +289,7 @@ class Database:
     
     async def add_chat(self, chat_id, title):
         """Добавление нового чата в базу"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.writer() as db:
             await db.execute(
                 'INSERT OR IGNORE INTO chats (chat_id, title) VALUES (?, ?)',
                 (chat_id, title)
@@ -223,7 +299,7 @@ class Database:
     async def add_user(self, user_id, username, first_name, last_name):
         """Добавляет пользователя в базу или обновляет его данные"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 # Сначала проверяем, существует ли пользователь
                 cursor = await db.execute(
                     'SELECT user_id, current_rank FROM users WHERE user_id = ?',
@@ -255,71 +331,362 @@ class Database:
         except Exception as e:
             logger.error(f"Ошибка при добавлении пользователя {user_id}: {e}")
     
+    def queue_profile(self, chat_id, chat_title, user_id, username, first_name, last_name):
+        """
+        Ставит в буфер запись чата и профиля пользователя, как add_chat и add_user
+        
+        Запись идет вместе со следующим пакетом активности, без отдельной транзакции.
+        Если чат уже известен, а профиль пользователя не изменился, ничего не делается.
+        """
+        if ('chat', chat_id) in self._known_profiles:
+            self._known_profiles.move_to_end(('chat', chat_id))
+        else:
+            self._pending_chats.setdefault(chat_id, chat_title)
+        
+        profile = (username, first_name, last_name)
+        if self._known_profiles.get(('user', user_id)) == profile:
+            self._known_profiles.move_to_end(('user', user_id))
+        else:
+            self._pending_users[user_id] = profile
+            if self._flush_pending is not None:
+                self._flush_pending.set()
+    
+    def _remember_profiles(self, chats, users):
+        for chat_id, title in chats.items():
+            self._known_profiles[('chat', chat_id)] = title
+        for user_id, profile in users.items():
+            self._known_profiles[('user', user_id)] = profile
+        while len(self._known_profiles) > ACTIVITY_CACHE_SIZE:
+            self._known_profiles.popitem(last=False)
+    
+    def _trim_running_totals(self):
+        """Вытесняет итоги давно не писавших пользователей; итоги с незаписанной активностью остаются"""
+        excess = len(self._user_points) - ACTIVITY_CACHE_SIZE
+        if excess <= 0:
+            return
+        busy = {row[1] for row in self._activity_buffer}
+        busy.update(self._rank_updates)
+        evicted = []
+        for user_id in self._user_points:
+            if user_id not in busy:
+                evicted.append(user_id)
+                if len(evicted) >= excess:
+                    break
+        for user_id in evicted:
+            del self._user_points[user_id]
+            self._user_ranks.pop(user_id, None)
+    
     async def add_activity(self, chat_id, user_id, message_type, points):
-        """Добавляет запись об активности и проверяет ранг пользователя"""
+        """Ставит запись об активности в буфер и проверяет ранг пользователя по текущему итогу в памяти"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Добавляем активность
-                await db.execute(
-                    'INSERT INTO activity (chat_id, user_id, message_type, points) VALUES (?, ?, ?, ?)',
-                    (chat_id, user_id, message_type, points)
-                )
-                
-                # Получаем текущий ранг пользователя
-                cursor = await db.execute(
-                    'SELECT current_rank FROM users WHERE user_id = ?',
-                    (user_id,)
-                )
-                result = await cursor.fetchone()
-                current_rank = result[0] if result and result[0] else "🔍 Искатель"
-                
-                # Получаем общее количество очков пользователя
-                cursor = await db.execute(
-                    'SELECT SUM(points) FROM activity WHERE user_id = ?',
-                    (user_id,)
-                )
-                total_points = (await cursor.fetchone())[0] or 0
-                
-                # Определяем новый ранг на основе общего количества очков
-                cursor = await db.execute(
-                    'SELECT name FROM ranks WHERE ? BETWEEN min_points AND max_points',
-                    (total_points,)
-                )
-                new_rank_result = await cursor.fetchone()
-                new_rank = new_rank_result[0] if new_rank_result else "🔍 Искатель"
-                
-                # Если ранг изменился, обновляем его в базе
-                if current_rank != new_rank:
-                    await db.execute(
-                        'UPDATE users SET current_rank = ? WHERE user_id = ?',
-                        (new_rank, user_id)
-                    )
-                    await db.commit()
-                    
-                    # Возвращаем информацию о повышении ранга
-                    return {
-                        "is_rank_up": True,
-                        "old_rank": current_rank,
-                        "new_rank": new_rank,
-                        "total_points": total_points
-                    }
-                
-                await db.commit()
-                return {"is_rank_up": False}
+            current_points, current_rank = await self._get_running_totals(user_id)
+            total_points = current_points + points
+            self._user_points[user_id] = total_points
+            
+            # Определяем новый ранг на основе общего количества очков
+            new_rank = self.rank_for(total_points) or "🔍 Искатель"
+            
+            timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            self._activity_buffer.append((chat_id, user_id, message_type, points, timestamp))
+            
+            # Если ранг изменился, обновление попадет в базу вместе с пакетом активности
+            rank_info = {"is_rank_up": False}
+            if current_rank != new_rank:
+                self._user_ranks[user_id] = new_rank
+                self._rank_updates[user_id] = new_rank
+                rank_info = {
+                    "is_rank_up": True,
+                    "old_rank": current_rank,
+                    "new_rank": new_rank,
+                    "total_points": total_points
+                }
+            
+            await self._schedule_activity_flush()
+            return rank_info
         except Exception as e:
             logger.error(f"Ошибка при добавлении активности: {e}")
             return {"is_rank_up": False}
     
-    async def add_game_activity(self, chat_id, user_id, game_type, points):
-        """Записывает баллы за игровую активность (emoji_game, quiz)"""
+    async def _get_running_totals(self, user_id, db=None):
+        """
+        Возвращает текущий итог очков и ранг пользователя из памяти, при первом обращении читает их из базы
+        
+        Внутри транзакции чтение идет через нее (db), а не через соединение на чтение из пула.
+        """
+        if user_id in self._user_points:
+            self._user_points.move_to_end(user_id)
+            return self._user_points[user_id], self._user_ranks[user_id]
+        
+        query = '''
+            SELECT u.current_rank, t.points
+            FROM users u
+            LEFT JOIN user_totals t ON t.user_id = u.user_id
+            WHERE u.user_id = ?
+        '''
+        if db is not None:
+            cursor = await db.execute(query, (user_id,))
+            result = await cursor.fetchone()
+        else:
+            async with self.pool.reader() as conn:
+                cursor = await conn.execute(query, (user_id,))
+                result = await cursor.fetchone()
+        
+        # Пока шло чтение, другая корутина могла уже загрузить и изменить итог
+        current_rank = result[0] if result and result[0] else "🔍 Искатель"
+        points = result[1] if result and result[1] else 0
+        self._user_ranks.setdefault(user_id, current_rank)
+        return self._user_points.setdefault(user_id, points), self._user_ranks[user_id]
+    
+    async def _schedule_activity_flush(self):
+        """Будит фоновую запись буфера; без фоновой задачи записывает буфер сразу"""
+        if self._flush_task is None:
+            await self.flush_activity()
+            return
+        
+        self._flush_pending.set()
+        if len(self._activity_buffer) >= ACTIVITY_FLUSH_ROWS:
+            self._flush_full.set()
+        
+        if ACTIVITY_CRASH_SAFE:
+            # Возвращаемся только после фиксации пакета, в который попала запись
+            waiter = asyncio.get_running_loop().create_future()
+            self._flush_waiters.append(waiter)
+            await waiter
+    
+    async def flush_activity(self):
+        """Записывает накопленную активность одним пакетом в одной транзакции"""
+        if not (self._activity_buffer or self._rank_updates or self._flush_waiters
+                or self._pending_chats or self._pending_users):
+            return
+        
         try:
-            # Убедимся что чат и пользователь существуют в базе
-            await self.add_chat(chat_id, "Игровая активность")
-            await self.add_user(user_id, None, "Игрок", None)
+            async with self.transaction() as tx:
+                await self._flush_into(tx)
+        except Exception as e:
+            logger.error(f"Ошибка при записи пакета активности: {e}")
+    
+    async def _flush_into(self, tx):
+        """Переносит буфер активности в транзакцию tx; при ее откате пакет возвращается в буфер"""
+        # Буфер забирается под блокировкой записи, поэтому пакеты пишутся по очереди
+        batch, self._activity_buffer = self._activity_buffer, []
+        rank_updates, self._rank_updates = self._rank_updates, {}
+        waiters, self._flush_waiters = self._flush_waiters, []
+        chats, self._pending_chats = self._pending_chats, {}
+        users, self._pending_users = self._pending_users, {}
+        tx.on_rollback(lambda: self._restore_activity(batch, rank_updates, waiters, chats, users))
+        tx.on_commit(lambda: self._release_waiters(waiters))
+        tx.on_commit(lambda: self._remember_profiles(chats, users))
+        # После фиксации итоги в памяти для пользователей без незаписанной активности совпадают с базой
+        tx.on_commit(self._trim_running_totals)
+        
+        if chats:
+            await tx.executemany(
+                'INSERT OR IGNORE INTO chats (chat_id, title) VALUES (?, ?)',
+                list(chats.items())
+            )
+        if users:
+            await tx.executemany('''
+                INSERT INTO users (user_id, username, first_name, last_name, current_rank)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    current_rank = COALESCE(current_rank, excluded.current_rank)
+            ''', [(user_id, *profile, '🔍 Искатель') for user_id, profile in users.items()])
+        
+        if batch or rank_updates:
+            await self._write_activity(tx, batch, rank_updates)
+            logger.debug(f"Записан пакет активности: {len(batch)} записей")
+    
+    def _restore_activity(self, batch, rank_updates, waiters, chats, users):
+        """Возвращает незаписанный пакет в буфер, чтобы записать его при следующей попытке"""
+        self._activity_buffer[:0] = batch
+        for user_id, rank in rank_updates.items():
+            self._rank_updates.setdefault(user_id, rank)
+        for chat_id, title in chats.items():
+            self._pending_chats.setdefault(chat_id, title)
+        for user_id, profile in users.items():
+            self._pending_users.setdefault(user_id, profile)
+        self._flush_waiters[:0] = waiters
+        if self._flush_pending is not None:
+            self._flush_pending.set()
+    
+    @staticmethod
+    def _release_waiters(waiters):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+    
+    async def _write_activity(self, tx, batch, rank_updates):
+        """Записывает пакет активности и изменения рангов в открытой транзакции tx"""
+        # Сворачиваем пакет в приращения итогов
+        chat_totals = {}
+        user_totals = {}
+        daily = {}
+        for chat_id, user_id, message_type, points, timestamp in batch:
+            # messages, points и счетчики по типам за день
+            totals = daily.setdefault((chat_id, user_id, timestamp[:10]), [0, 0] + [0] * len(DAILY_TYPE_COLUMNS))
+            totals[0] += 1
+            totals[1] += points
+            totals[2 + DAILY_TYPE_INDEX.get(message_type, len(DAILY_TYPE_COLUMNS) - 1)] += 1
+            totals = chat_totals.setdefault((chat_id, user_id), [0, 0, timestamp])
+            totals[0] += points
+            totals[1] += 1
+            totals[2] = max(totals[2], timestamp)
+            totals = user_totals.setdefault(user_id, [0, 0, timestamp])
+            totals[0] += points
+            totals[1] += 1
+            totals[2] = max(totals[2], timestamp)
+        
+        await tx.executemany(
+            'INSERT INTO activity (chat_id, user_id, message_type, points, timestamp) VALUES (?, ?, ?, ?, ?)',
+            batch
+        )
+        await tx.executemany('''
+            INSERT INTO user_chat_totals (chat_id, user_id, points, messages, last_active)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                points = points + excluded.points,
+                messages = messages + excluded.messages,
+                last_active = MAX(COALESCE(last_active, ''), excluded.last_active)
+        ''', [(chat_id, user_id, *totals) for (chat_id, user_id), totals in chat_totals.items()])
+        await tx.executemany('''
+            INSERT INTO user_totals (user_id, points, messages, last_active)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                points = points + excluded.points,
+                messages = messages + excluded.messages,
+                last_active = MAX(COALESCE(last_active, ''), excluded.last_active)
+        ''', [(user_id, *totals) for user_id, totals in user_totals.items()])
+        await tx.executemany('''
+            INSERT INTO activity_daily (
+                chat_id, user_id, day, messages, points,
+                text_count, long_text_count, media_count, reply_count,
+                question_count, game_count, other_count
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id, day, user_id) DO UPDATE SET
+                messages = messages + excluded.messages,
+                points = points + excluded.points,
+                text_count = text_count + excluded.text_count,
+                long_text_count = long_text_count + excluded.long_text_count,
+                media_count = media_count + excluded.media_count,
+                reply_count = reply_count + excluded.reply_count,
+                question_count = question_count + excluded.question_count,
+                game_count = game_count + excluded.game_count,
+                other_count = other_count + excluded.other_count
+        ''', [(*key, *totals) for key, totals in daily.items()])
+        await tx.executemany(
+            'UPDATE users SET current_rank = ? WHERE user_id = ?',
+            [(rank, user_id) for user_id, rank in rank_updates.items()]
+        )
+    
+    async def _activity_flush_loop(self):
+        """Фоновая задача: сбрасывает буфер каждые ACTIVITY_FLUSH_INTERVAL_MS или при накоплении ACTIVITY_FLUSH_ROWS записей"""
+        interval = ACTIVITY_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await self._flush_pending.wait()
+            try:
+                await asyncio.wait_for(self._flush_full.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_pending.clear()
+            self._flush_full.clear()
+            try:
+                await self.flush_activity()
+            except Exception as e:
+                logger.error(f"Ошибка в фоновой записи активности: {e}")
+    
+    def start_activity_writer(self):
+        """Запускает фоновую пакетную запись активности"""
+        if self._flush_task is None:
+            self._flush_pending = asyncio.Event()
+            self._flush_full = asyncio.Event()
+            self._flush_task = asyncio.ensure_future(self._activity_flush_loop())
+    
+    async def stop_activity_writer(self):
+        """Останавливает фоновую запись и сбрасывает остаток буфера"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush_activity()
+    
+    async def award_points(self, chat_id, user_id, message_type, points,
+                           username=None, first_name=None, last_name=None, chat_title=None):
+        """
+        Начисляет баллы одной транзакцией, минуя буфер активности
+        
+        Чат и пользователь создаются, если их еще нет; у существующего пользователя
+        заполняются только пустые поля профиля. Запись активности, итоги, суточная
+        сводка и новый ранг фиксируются вместе одним commit.
+        
+        Returns:
+            dict: {"is_rank_up": bool, ...} как у add_activity
+        """
+        async with self.transaction() as tx:
+            await tx.execute(
+                'INSERT OR IGNORE INTO chats (chat_id, title) VALUES (?, ?)',
+                (chat_id, chat_title)
+            )
+            await tx.execute('''
+                INSERT INTO users (user_id, username, first_name, last_name, current_rank)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = COALESCE(username, excluded.username),
+                    first_name = COALESCE(first_name, excluded.first_name),
+                    last_name = COALESCE(last_name, excluded.last_name)
+            ''', (user_id, username, first_name, last_name, '🔍 Искатель'))
             
-            # Записываем активность и проверяем ранг
-            rank_info = await self.add_activity(chat_id, user_id, game_type, points)
-                
+            current_points, current_rank = await self._get_running_totals(user_id, tx)
+            total_points = current_points + points
+            new_rank = self.rank_for(total_points) or "🔍 Искатель"
+            
+            # Итог в памяти меняется сразу, чтобы не потерять параллельные начисления из буфера.
+            # Ранг из буфера устарел: в базу попадет новый ранг из этой транзакции
+            self._user_points[user_id] = total_points
+            self._user_ranks[user_id] = new_rank
+            pending_rank = self._rank_updates.pop(user_id, None)
+            tx.on_rollback(lambda: self._revert_award(user_id, points, current_rank, new_rank, pending_rank))
+            
+            timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            await self._write_activity(
+                tx,
+                [(chat_id, user_id, message_type, points, timestamp)],
+                {user_id: new_rank} if current_rank != new_rank or pending_rank else {}
+            )
+        
+        if current_rank == new_rank:
+            return {"is_rank_up": False}
+        return {
+            "is_rank_up": True,
+            "old_rank": current_rank,
+            "new_rank": new_rank,
+            "total_points": total_points
+        }
+    
+    def _revert_award(self, user_id, points, old_rank, new_rank, pending_rank):
+        """Отменяет в памяти начисление из откаченной транзакции"""
+        if user_id in self._user_points:
+            self._user_points[user_id] -= points
+        if self._user_ranks.get(user_id) == new_rank:
+            self._user_ranks[user_id] = old_rank
+        if pending_rank is not None:
+            self._rank_updates.setdefault(user_id, pending_rank)
+    
+    async def add_game_activity(self, chat_id, user_id, game_type, points,
+                                username=None, first_name=None, last_name=None):
+        """Записывает баллы за игровую активность (emoji_game, quiz)"""
+        try:
+            rank_info = await self.award_points(
+                chat_id, user_id, game_type, points,
+                username=username, first_name=first_name, last_name=last_name,
+                chat_title="Игровая активность"
+            )
             logger.info(f"Пользователю {user_id} начислено {points} баллов за игру {game_type} в чате {chat_id}")
             return True, rank_info
         except Exception as e:
@@ -328,82 +695,73 @@ class Database:
     
     async def get_user_stats(self, chat_id, user_id):
         """Получение статистики пользователя в конкретном чате"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем общее количество сообщений
-            cursor = await db.execute(
-                'SELECT COUNT(*) FROM activity WHERE chat_id = ? AND user_id = ?',
-                (chat_id, user_id)
-            )
-            total_messages = (await cursor.fetchone())[0]
-            
-            # Получаем общее количество очков
-            cursor = await db.execute(
-                'SELECT SUM(points) FROM activity WHERE chat_id = ? AND user_id = ?',
-                (chat_id, user_id)
-            )
-            total_points = (await cursor.fetchone())[0] or 0
-            
-            # Получаем текущий ранг
-            cursor = await db.execute(
-                'SELECT name FROM ranks WHERE ? BETWEEN min_points AND max_points',
-                (total_points,)
-            )
-            rank_result = await cursor.fetchone()
-            rank = rank_result[0] if rank_result else "Без ранга"
-            
-            # Получаем дату последней активности
+        await self.flush_activity()
+        async with self.pool.reader() as db:
+            # Получаем количество сообщений, очков и время последней активности из итогов
             cursor = await db.execute(
-                'SELECT MAX(timestamp) FROM activity WHERE chat_id = ? AND user_id = ?',
+                'SELECT messages, points, last_active FROM user_chat_totals WHERE chat_id = ? AND user_id = ?',
                 (chat_id, user_id)
             )
-            last_active = (await cursor.fetchone())[0]
+            totals = await cursor.fetchone()
+            total_messages, total_points, last_active = totals if totals else (0, 0, None)
+            total_points = total_points or 0
             
-            # Получаем информацию о следующем ранге
-            cursor = await db.execute(
-                'SELECT name, min_points FROM ranks WHERE min_points > ? ORDER BY min_points ASC LIMIT 1',
-                (total_points,)
-            )
-            next_rank_result = await cursor.fetchone()
-            if next_rank_result:
-                next_rank = {
-                    "name": next_rank_result[0],
-                    "min_points": next_rank_result[1],
-                    "points_left": next_rank_result[1] - total_points
-                }
-            else:
-                next_rank = None
-            
-            return {
-                "total_messages": total_messages,
-                "total_points": total_points,
-                "rank": rank,
-                "last_active": last_active,
-                "next_rank": next_rank
+        # Получаем текущий ранг
+        rank = self.rank_for(total_points) or "Без ранга"
+        
+        # Получаем информацию о следующем ранге
+        next_rank_result = self.next_rank_for(total_points)
+        if next_rank_result:
+            next_rank = {
+                "name": next_rank_result[0],
+                "min_points": next_rank_result[1],
+                "points_left": next_rank_result[1] - total_points
             }
+        else:
+            next_rank = None
+        
+        return {
+            "total_messages": total_messages,
+            "total_points": total_points,
+            "rank": rank,
+            "last_active": last_active,
+            "next_rank": next_rank
+        }
 
     async def get_rank_by_points(self, points):
         """Получает ранг по количеству очков"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                'SELECT name FROM ranks WHERE ? BETWEEN min_points AND max_points',
-                (points,)
-            )
-            rank_result = await cursor.fetchone()
-            return rank_result[0] if rank_result else "Без ранга"
+        return self.rank_for(points) or "Без ранга"
+    
+    def _load_ranks(self, rows):
+        """Загружает таблицу рангов в память, отсортированную по нижней границе очков"""
+        rows = sorted(rows, key=lambda row: row[1])
+        self._rank_names = [row[0] for row in rows]
+        self._rank_min_points = [row[1] for row in rows]
+    
+    def rank_for(self, points):
+        """Возвращает название ранга для количества очков или None, если очков меньше минимального ранга"""
+        index = bisect.bisect_right(self._rank_min_points, points) - 1
+        return self._rank_names[index] if index >= 0 else None
+    
+    def next_rank_for(self, points):
+        """Возвращает (название, min_points) следующего ранга или None для максимального ранга"""
+        index = bisect.bisect_right(self._rank_min_points, points)
+        if index < len(self._rank_names):
+            return self._rank_names[index], self._rank_min_points[index]
+        return None
     
     async def get_top_users(self, chat_id, limit=10):
         """Получение списка самых активных пользователей в чате"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            await self.flush_activity()
+            async with self.pool.reader() as db:
                 cursor = await db.execute('''
                     SELECT u.user_id, u.username, u.first_name, u.last_name, 
-                           SUM(a.points) as total_points, COUNT(a.id) as total_messages
-                    FROM users u
-                    INNER JOIN activity a ON u.user_id = a.user_id
-                    WHERE a.chat_id = ?
-                    GROUP BY u.user_id
-                    HAVING total_points > 0
-                    ORDER BY total_points DESC
+                           t.points as total_points, t.messages as total_messages
+                    FROM user_chat_totals t
+                    INNER JOIN users u ON u.user_id = t.user_id
+                    WHERE t.chat_id = ? AND t.points > 0
+                    ORDER BY t.points DESC
                     LIMIT ?
                 ''', (chat_id, limit))
                 
@@ -419,56 +777,64 @@ class Database:
         cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
         cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.reader() as db:
             # Получаем всех пользователей, которые когда-либо писали в этом чате
             cursor = await db.execute('''
-                SELECT DISTINCT u.user_id, u.username, u.first_name, u.last_name, MAX(a.timestamp) as last_active
-                FROM users u
-                JOIN activity a ON u.user_id = a.user_id
-                WHERE a.chat_id = ?
-                GROUP BY u.user_id
-                HAVING last_active < ?
-                ORDER BY last_active ASC
+                SELECT u.user_id, u.username, u.first_name, u.last_name, t.last_active
+                FROM user_chat_totals t
+                JOIN users u ON u.user_id = t.user_id
+                WHERE t.chat_id = ? AND t.last_active < ?
+                ORDER BY t.last_active ASC
             ''', (chat_id, cutoff_str))
             
             return await cursor.fetchall()
     
-    async def get_all_chats(self):
-        """Получение списка всех чатов, где был активен бот"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def get_all_chats(self, chat_ids=None):
+        """Получение списка всех чатов, где был активен бот (или только чатов из chat_ids)"""
+        async with self.pool.reader() as db:
             cursor = await db.execute('''
                 SELECT chat_id, title FROM chats
                 WHERE chat_id < 0  -- Только групповые чаты (ID < 0)
                 ORDER BY joined_date DESC
             ''')
             
-            return await cursor.fetchall()
+            chats = await cursor.fetchall()
+        
+        if chat_ids is not None:
+            chat_ids = set(chat_ids)
+            chats = [chat for chat in chats if chat[0] in chat_ids]
+        return chats
+    
+    def _period_start_day(self, days):
+        """Первый день (UTC) периода из последних days дней для запросов к суточной сводке"""
+        start_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+        return start_date.strftime('%Y-%m-%d')
     
     async def get_chat_activity_report(self, chat_id, days=7):
         """Получает отчет об активности чата за указанный период"""
-        start_date = datetime.datetime.now() - datetime.timedelta(days=days)
-        start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
+        await self.flush_activity()
+        start_day = self._period_start_day(days)
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.reader() as db:
             # Общее количество сообщений за период
             cursor = await db.execute('''
-                SELECT COUNT(*) as message_count, 
+                SELECT SUM(messages) as message_count,
                        SUM(points) as total_points,
                        COUNT(DISTINCT user_id) as active_users
-                FROM activity
-                WHERE chat_id = ? AND timestamp > ?
-            ''', (chat_id, start_date_str))
+                FROM activity_daily
+                WHERE chat_id = ? AND day >= ?
+            ''', (chat_id, start_day))
             
             activity_summary = await cursor.fetchone()
             
             # Количество сообщений по дням
             cursor = await db.execute('''
-                SELECT date(timestamp) as day, COUNT(*) as message_count
-                FROM activity
-                WHERE chat_id = ? AND timestamp > ?
+                SELECT day, SUM(messages) as message_count
+                FROM activity_daily
+                WHERE chat_id = ? AND day >= ?
                 GROUP BY day
                 ORDER BY day
-            ''', (chat_id, start_date_str))
+            ''', (chat_id, start_day))
             
             daily_activity = await cursor.fetchall()
             
@@ -479,29 +845,84 @@ class Database:
                 'daily_activity': daily_activity
             }
     
+    async def get_weekly_reports(self, days=7, top_limit=5, chat_ids=None):
+        """Получает отчеты об активности всех групповых чатов (или только чатов из chat_ids) за период одним запросом.
+        
+        Возвращает словарь {chat_id: отчет}, где отчет содержит те же поля, что и
+        get_chat_activity_report, а также top_users - лучших участников за период
+        в формате get_top_users.
+        """
+        await self.flush_activity()
+        start_day = self._period_start_day(days)
+        
+        if chat_ids is None:
+            chat_filter = 'SELECT chat_id FROM chats WHERE chat_id < 0'
+            params = (start_day,)
+        else:
+            # Список чатов передается одним параметром и разворачивается в SQLite, без лимита на число параметров
+            chat_filter = 'SELECT value FROM json_each(?) WHERE value < 0'
+            params = (json.dumps(list(chat_ids)), start_day)
+        
+        async with self.pool.reader() as db:
+            # Один проход по суточной сводке для всех нужных чатов сразу
+            cursor = await db.execute(f'''
+                SELECT d.chat_id, d.user_id, d.day, d.messages, d.points,
+                       u.username, u.first_name, u.last_name
+                FROM activity_daily d
+                LEFT JOIN users u ON u.user_id = d.user_id
+                WHERE d.chat_id IN ({chat_filter})
+                  AND d.day >= ?
+            ''', params)
+            rows = await cursor.fetchall()
+        
+        chats = {}
+        for chat_id, user_id, day, message_count, total_points, username, first_name, last_name in rows:
+            chat = chats.setdefault(chat_id, {'days': {}, 'users': {}})
+            chat['days'][day] = chat['days'].get(day, 0) + message_count
+            user = chat['users'].setdefault(user_id, [user_id, username, first_name, last_name, 0, 0])
+            user[4] += total_points or 0
+            user[5] += message_count
+        
+        reports = {}
+        for chat_id, chat in chats.items():
+            users = chat['users'].values()
+            top_users = sorted((user for user in users if user[4] > 0), key=lambda user: user[4], reverse=True)
+            reports[chat_id] = {
+                'message_count': sum(user[5] for user in users),
+                'total_points': sum(user[4] for user in users),
+                'active_users': len(chat['users']),
+                'daily_activity': sorted(chat['days'].items()),
+                'top_users': [tuple(user) for user in top_users[:top_limit]]
+            }
+        return reports
+    
     async def get_most_active_user_today(self, chat_id):
         """Получает самого активного пользователя за последние 24 часа"""
-        start_date = datetime.datetime.now() - datetime.timedelta(days=1)
-        start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
+        await self.flush_activity()
+        since = self._to_db_time(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1))
         
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем пользователя с наибольшим количеством баллов за сегодня
+        async with self.pool.reader() as db:
+            # Суточная сводка хранит дни по UTC и не дает ровно 24 часа, поэтому считаем по activity:
+            # индекс idx_activity_chat_time покрывает запрос, строки таблицы не читаются
             cursor = await db.execute('''
-                SELECT u.user_id, u.username, u.first_name, u.last_name, 
-                       COUNT(a.id) as message_count, SUM(a.points) as total_points
-                FROM activity a
+                SELECT u.user_id, u.username, u.first_name, u.last_name,
+                       a.message_count, a.total_points
+                FROM (
+                    SELECT user_id, COUNT(*) as message_count, SUM(points) as total_points
+                    FROM activity
+                    WHERE chat_id = ? AND timestamp >= ?
+                    GROUP BY user_id
+                ) a
                 JOIN users u ON a.user_id = u.user_id
-                WHERE a.chat_id = ? AND a.timestamp > ?
-                GROUP BY u.user_id
-                ORDER BY total_points DESC
+                ORDER BY a.total_points DESC
                 LIMIT 1
-            ''', (chat_id, start_date_str))
+            ''', (chat_id, since))
             
             result = await cursor.fetchone()
             
             if not result:
                 return None
-                
+            
             return {
                 'user_id': result[0],
                 'username': result[1],
@@ -511,10 +932,22 @@ class Database:
                 'total_points': result[5]
             }
     
+    async def rebuild_activity_daily(self):
+        """Заново строит суточную сводку activity_daily из истории активности"""
+        await self.flush_activity()
+        async with self.pool.writer() as db:
+            await db.execute('DELETE FROM activity_daily')
+            await db.execute(ACTIVITY_DAILY_BACKFILL.format(where='1'))
+            cursor = await db.execute('SELECT COUNT(*) FROM activity_daily')
+            rows = (await cursor.fetchone())[0]
+            await db.commit()
+        logger.info(f"Суточная сводка активности перестроена: {rows} строк")
+        return rows
+
     async def save_question_message_id(self, chat_id, message_id, question):
         """Сохраняет ID сообщения с вопросом дня для отслеживания ответов"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.writer() as db:
                 await db.execute(
                     'INSERT INTO daily_questions (chat_id, message_id, question) VALUES (?, ?, ?)',
                     (chat_id, message_id, question)
@@ -532,7 +965,7 @@ class Database:
             return None
             
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.reader() as db:
                 # Ищем вопрос дня с таким message_id
                 cursor = await db.execute(
                     'SELECT id, question FROM daily_questions WHERE chat_id = ? AND message_id = ?',
@@ -553,9 +986,9 @@ class Database:
     async def add_question_response(self, question_id, user_id, points=2.0):
         """Добавляет запись об ответе на вопрос дня и начисляет баллы"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.transaction() as tx:
                 # Проверяем, не отвечал ли уже этот пользователь на данный вопрос
-                cursor = await db.execute(
+                cursor = await tx.execute(
                     'SELECT id FROM question_responses WHERE question_id = ? AND user_id = ?',
                     (question_id, user_id)
                 )
@@ -565,31 +998,27 @@ class Database:
                     # Пользователь уже отвечал на этот вопрос
                     return False, 0
                 
-                # Добавляем запись об ответе
-                await db.execute(
-                    'INSERT INTO question_responses (question_id, user_id, points_awarded) VALUES (?, ?, ?)',
-                    (question_id, user_id, points)
-                )
-                
-                # Получаем информацию о чате
-                cursor = await db.execute(
+                # Получаем информацию о чате; без него ответ не записывается
+                cursor = await tx.execute(
                     'SELECT chat_id FROM daily_questions WHERE id = ?',
                     (question_id,)
                 )
                 chat_result = await cursor.fetchone()
                 
                 if not chat_result:
-                    await db.commit()
                     return False, 0
-                    
-                chat_id = chat_result[0]
                 
-                # Добавляем активность и баллы пользователю
-                rank_info = await self.add_activity(chat_id, user_id, "question_response", points)
+                # Добавляем запись об ответе
+                await tx.execute(
+                    'INSERT INTO question_responses (question_id, user_id, points_awarded) VALUES (?, ?, ?)',
+                    (question_id, user_id, points)
+                )
                 
-                await db.commit()
-                logger.info(f"Пользователь {user_id} получил {points} баллов за ответ на вопрос дня")
-                return True, points
+                # Баллы начисляются в той же транзакции и фиксируются вместе с ответом
+                await self.award_points(chat_result[0], user_id, "question_response", points)
+            
+            logger.info(f"Пользователь {user_id} получил {points} баллов за ответ на вопрос дня")
+            return True, points
                 
         except Exception as e:
             logger.error(f"Ошибка при добавлении ответа на вопрос: {e}")
@@ -598,7 +1027,7 @@ class Database:
     async def get_question_stats(self, chat_id, limit=5):
         """Получает статистику по вопросам дня в чате"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.reader() as db:
                 # Получаем последние вопросы и количество ответов на них
                 cursor = await db.execute('''
                     SELECT 
@@ -665,9 +1094,9 @@ class Database:
     async def get_last_activity_time(self, chat_id):
         """Получает время последней активности в чате"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.reader() as db:
                 cursor = await db.execute(
-                    'SELECT MAX(timestamp) FROM activity WHERE chat_id = ?',
+                    'SELECT MAX(last_active) FROM user_chat_totals WHERE chat_id = ?',
                     (chat_id,)
                 )
                 result = await cursor.fetchone()
@@ -679,13 +1108,13 @@ class Database:
     async def get_random_chat_users(self, chat_id, limit=5):
         """Получает случайных пользователей из чата"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.reader() as db:
                 # Получаем всех пользователей, которые писали в данном чате
                 cursor = await db.execute('''
-                    SELECT DISTINCT u.user_id, u.username, u.first_name, u.last_name
-                    FROM users u
-                    JOIN activity a ON u.user_id = a.user_id
-                    WHERE a.chat_id = ? AND u.username IS NOT NULL
+                    SELECT u.user_id, u.username, u.first_name, u.last_name
+                    FROM user_chat_totals t
+                    JOIN users u ON u.user_id = t.user_id
+                    WHERE t.chat_id = ? AND u.username IS NOT NULL
                     ORDER BY RANDOM()
                     LIMIT ?
                 ''', (chat_id, limit))
@@ -695,19 +1124,381 @@ class Database:
             logger.error(f"Ошибка при получении случайных пользователей: {e}")
             return []
 
+    async def enqueue_outbox(self, messages):
+        """
+        Ставит сообщения в очередь отправки одной транзакцией
+        
+        Args:
+            messages: список словарей с ключами idempotency_key, chat_id, text и необязательными
+                parse_mode, kind, payload. Сообщения с уже известным ключом пропускаются.
+        
+        Returns:
+            int: количество новых сообщений в очереди
+        """
+        rows = [
+            (
+                message['idempotency_key'],
+                message['chat_id'],
+                message['text'],
+                message.get('parse_mode'),
+                message.get('kind'),
+                json.dumps(message['payload'], ensure_ascii=False) if message.get('payload') is not None else None
+            )
+            for message in messages
+        ]
+        if not rows:
+            return 0
+        
+        async with self.pool.writer() as db:
+            before = db.total_changes
+            await db.executemany('''
+                INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, text, parse_mode, kind, payload)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            added = db.total_changes - before
+            await db.commit()
+        return added
+    
+    async def fetch_outbox_batch(self, limit):
+        """Возвращает готовые к отправке сообщения очереди в порядке постановки"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute('''
+                SELECT id, chat_id, text, parse_mode, kind, payload, attempts
+                FROM outbox
+                WHERE status = 'pending' AND not_before <= CURRENT_TIMESTAMP
+                ORDER BY id
+                LIMIT ?
+            ''', (limit,))
+            rows = await cursor.fetchall()
+        
+        return [
+            {
+                'id': row[0],
+                'chat_id': row[1],
+                'text': row[2],
+                'parse_mode': row[3],
+                'kind': row[4],
+                'payload': json.loads(row[5]) if row[5] else None,
+                'attempts': row[6]
+            }
+            for row in rows
+        ]
+    
+    async def complete_outbox_batch(self, sent, retry, failed, blocked):
+        """
+        Записывает результаты отправки пакета одной транзакцией
+        
+        Args:
+            sent: список (id, message_id) доставленных сообщений
+            retry: список (id, задержка в секундах, ошибка) для повторной попытки
+            failed: список (id, ошибка) сообщений, которые больше не пытаемся отправить
+            blocked: список id сообщений в чаты, куда бот не может писать
+        """
+        async with self.pool.writer() as db:
+            await db.executemany('''
+                UPDATE outbox SET status = 'sent', message_id = ?, sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                WHERE id = ?
+            ''', [(message_id, outbox_id) for outbox_id, message_id in sent])
+            # Откладываем и само сообщение, и следующие за ним в том же чате, чтобы не нарушить порядок
+            await db.executemany('''
+                UPDATE outbox SET
+                    attempts = attempts + (id = ?),
+                    last_error = CASE WHEN id = ? THEN ? ELSE last_error END,
+                    not_before = MAX(not_before, datetime(CURRENT_TIMESTAMP, '+' || ? || ' seconds'))
+                WHERE status = 'pending' AND chat_id = (SELECT chat_id FROM outbox WHERE id = ?) AND id >= ?
+            ''', [(outbox_id, outbox_id, error, int(delay), outbox_id, outbox_id) for outbox_id, delay, error in retry])
+            await db.executemany('''
+                UPDATE outbox SET status = 'failed', last_error = ?, attempts = attempts + 1
+                WHERE id = ?
+            ''', [(error, outbox_id) for outbox_id, error in failed])
+            await db.executemany('''
+                UPDATE outbox SET status = 'blocked', attempts = attempts + 1
+                WHERE id = ?
+            ''', [(outbox_id,) for outbox_id in blocked])
+            await db.commit()
+    
+    async def prune_outbox(self, days):
+        """Удаляет из очереди обработанные сообщения старше указанного количества дней"""
+        async with self.pool.writer() as db:
+            cursor = await db.execute('''
+                DELETE FROM outbox
+                WHERE status != 'pending' AND created_at < datetime(CURRENT_TIMESTAMP, ?)
+            ''', (f'-{days} days',))
+            await db.commit()
+            return cursor.rowcount
+    
+    async def migrate_chat(self, old_chat_id, new_chat_id):
+        """
+        Переносит чат на новый ID после преобразования группы в супергруппу
+        
+        Неотправленные сообщения очереди, настройки и состояние задач чата переходят
+        на новый ID, а старая запись чата удаляется, чтобы задачи больше не писали по
+        старому ID. История активности остается под старым ID.
+        """
+        async with self.transaction() as db:
+            await db.execute('''
+                INSERT OR IGNORE INTO chats (chat_id, title, joined_date)
+                SELECT ?, title, joined_date FROM chats WHERE chat_id = ?
+            ''', (new_chat_id, old_chat_id))
+            await db.execute('DELETE FROM chats WHERE chat_id = ?', (old_chat_id,))
+            await db.execute(
+                "UPDATE outbox SET chat_id = ? WHERE chat_id = ? AND status = 'pending'",
+                (new_chat_id, old_chat_id)
+            )
+            # Если у нового ID уже есть свои записи, они остаются, а записи старого удаляются
+            for table in ('chat_settings', 'chat_job_runs', 'content_cursors'):
+                await db.execute(f'UPDATE OR IGNORE {table} SET chat_id = ? WHERE chat_id = ?', (new_chat_id, old_chat_id))
+                await db.execute(f'DELETE FROM {table} WHERE chat_id = ?', (old_chat_id,))
+        logger.info(f"Чат {old_chat_id} перенесен в базе на новый ID {new_chat_id}")
+
+    @staticmethod
+    def _to_db_time(moment):
+        """Переводит время с часовым поясом в строку UTC, как CURRENT_TIMESTAMP в SQLite"""
+        return moment.astimezone(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S') if moment else None
+    
+    @staticmethod
+    def _from_db_time(value):
+        if not value:
+            return None
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+    
+    async def get_scheduled_jobs(self):
+        """Возвращает состояние регулярных задач: {name: {'last_run', 'next_run', 'status'}}"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute('SELECT name, last_run, next_run, status FROM scheduled_jobs')
+            rows = await cursor.fetchall()
+        
+        return {
+            name: {
+                'last_run': self._from_db_time(last_run),
+                'next_run': self._from_db_time(next_run),
+                'status': status
+            }
+            for name, last_run, next_run, status in rows
+        }
+    
+    async def save_job_schedule(self, schedule):
+        """Сохраняет время следующего запуска задач; schedule - список (name, next_run)"""
+        async with self.pool.writer() as db:
+            await db.executemany('''
+                INSERT INTO scheduled_jobs (name, next_run) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET next_run = excluded.next_run, updated_at = CURRENT_TIMESTAMP
+            ''', [(name, self._to_db_time(next_run)) for name, next_run in schedule])
+            await db.commit()
+    
+    async def start_job_run(self, name, fire_time):
+        """
+        Отмечает начало запуска задачи, если запуск за это время еще не выполнялся
+        
+        Returns:
+            bool: True, если запуск нужно выполнить; False, если он уже был
+        """
+        fire_time = self._to_db_time(fire_time)
+        async with self.pool.writer() as db:
+            await db.execute('INSERT OR IGNORE INTO scheduled_jobs (name) VALUES (?)', (name,))
+            # Повторный запуск того же времени после сбоя разрешен, только если прошлый не завершился
+            cursor = await db.execute('''
+                UPDATE scheduled_jobs
+                SET last_run = ?, status = 'running', last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE name = ? AND (last_run IS NULL OR last_run < ? OR (last_run = ? AND status = 'running'))
+            ''', (fire_time, name, fire_time, fire_time))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def finish_job_run(self, name, next_run, error=None):
+        """Отмечает завершение запуска задачи и сохраняет время следующего"""
+        async with self.pool.writer() as db:
+            await db.execute('''
+                UPDATE scheduled_jobs
+                SET status = ?, last_error = ?, next_run = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE name = ?
+            ''', ('failed' if error else 'done', error, self._to_db_time(next_run), name))
+            await db.commit()
+
+    async def get_chat_settings(self, chat_id=None):
+        """
+        Получает настройки расписания групповых чатов
+        
+        Returns:
+            dict: {chat_id: {'timezone', 'daily_topic_hour', 'report_day', 'quiet_start', 'quiet_end'}},
+                None в значении означает настройку по умолчанию
+        """
+        query = '''
+            SELECT c.chat_id, s.timezone, s.daily_topic_hour, s.report_day, s.quiet_start, s.quiet_end
+            FROM chats c
+            LEFT JOIN chat_settings s ON s.chat_id = c.chat_id
+            WHERE c.chat_id < 0
+        '''
+        params = ()
+        if chat_id is not None:
+            query += ' AND c.chat_id = ?'
+            params = (chat_id,)
+        
+        async with self.pool.reader() as db:
+            cursor = await db.execute(query, params)
+            rows = await cursor.fetchall()
+        
+        return {
+            row[0]: dict(zip(CHAT_SETTINGS_COLUMNS, row[1:]))
+            for row in rows
+        }
+    
+    async def update_chat_settings(self, chat_id, **settings):
+        """Изменяет настройки расписания чата; значение None возвращает настройку по умолчанию"""
+        unknown = set(settings) - set(CHAT_SETTINGS_COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные настройки чата: {', '.join(sorted(unknown))}")
+        if not settings:
+            return
+        
+        columns = list(settings)
+        async with self.pool.writer() as db:
+            await db.execute(f'''
+                INSERT INTO chat_settings (chat_id, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    {', '.join(f'{column} = excluded.{column}' for column in columns)},
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (chat_id, *settings.values()))
+            await db.commit()
+    
+    async def get_chat_job_runs(self, job):
+        """Последний выполненный период задачи job по чатам: {chat_id: run_id}"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute('SELECT chat_id, run_id FROM chat_job_runs WHERE job = ?', (job,))
+            return dict(await cursor.fetchall())
+    
+    async def save_chat_job_runs(self, job, run_id, chat_ids):
+        """Отмечает период run_id задачи job выполненным для чатов chat_ids"""
+        async with self.transaction() as tx:
+            await tx.executemany('''
+                INSERT INTO chat_job_runs (job, chat_id, run_id, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(job, chat_id) DO UPDATE SET
+                    run_id = excluded.run_id, updated_at = excluded.updated_at
+            ''', [(job, chat_id, run_id) for chat_id in chat_ids])
+    
+    async def get_game_cooldowns(self, since):
+        """Возвращает запуски игр не раньше since: список (chat_id, user_id, game_type, started_at)"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute('''
+                SELECT chat_id, user_id, game_type, started_at
+                FROM game_cooldowns
+                WHERE started_at >= ?
+            ''', (self._to_db_time(since),))
+            rows = await cursor.fetchall()
+        
+        return [
+            (chat_id, user_id, game_type, self._from_db_time(started_at))
+            for chat_id, user_id, game_type, started_at in rows
+        ]
+    
+    async def save_game_cooldowns(self, cooldowns, expired_before=None):
+        """
+        Сохраняет запуски игр одной транзакцией
+        
+        Args:
+            cooldowns: список (chat_id, user_id, game_type, started_at)
+            expired_before: если указано, удаляются запуски раньше этого времени
+        """
+        async with self.pool.writer() as db:
+            if cooldowns:
+                await db.executemany('''
+                    INSERT INTO game_cooldowns (chat_id, user_id, game_type, started_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                        game_type = excluded.game_type, started_at = excluded.started_at
+                ''', [
+                    (chat_id, user_id, game_type, self._to_db_time(started_at))
+                    for chat_id, user_id, game_type, started_at in cooldowns
+                ])
+            if expired_before is not None:
+                await db.execute(
+                    'DELETE FROM game_cooldowns WHERE started_at < ?',
+                    (self._to_db_time(expired_before),)
+                )
+            await db.commit()
+
+    async def take_content_positions(self, pool, chat_ids, size, new_seed=None):
+        """
+        Выдает чатам следующие позиции в перестановке набора контента pool
+        
+        Курсор чата сдвигается на одну позицию. Если круг пройден или размер набора
+        изменился, начинается новый круг с seed из new_seed(seed прошлого круга или None).
+        
+        Returns:
+            dict: {chat_id: (seed, position)}
+        """
+        chat_ids = set(chat_ids)
+        async with self.pool.writer() as db:
+            # Только курсоры нужных чатов, по первичному ключу (pool, chat_id), а не весь набор
+            cursor = await db.execute('''
+                SELECT chat_id, seed, position, size FROM content_cursors
+                WHERE pool = ? AND chat_id IN (SELECT value FROM json_each(?))
+            ''', (pool, json.dumps(list(chat_ids))))
+            current = {row[0]: row[1:] for row in await cursor.fetchall()}
+            
+            result = {}
+            for chat_id in chat_ids:
+                seed, position, cursor_size = current.get(chat_id, (None, None, None))
+                if seed is None or cursor_size != size or position >= size:
+                    previous = seed if cursor_size == size else None
+                    seed = new_seed(previous) if new_seed else random.getrandbits(62)
+                    position = 0
+                result[chat_id] = (seed, position)
+            
+            await db.executemany('''
+                INSERT INTO content_cursors (pool, chat_id, seed, position, size, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(pool, chat_id) DO UPDATE SET
+                    seed = excluded.seed, position = excluded.position,
+                    size = excluded.size, updated_at = excluded.updated_at
+            ''', [(pool, chat_id, seed, position + 1, size) for chat_id, (seed, position) in result.items()])
+            await db.commit()
+        
+        return result
+    
+    async def get_chat_users(self, chat_id):
+        """Получает всех пользователей, которые когда-либо писали в чате"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute('''
+                SELECT u.user_id, u.username, u.first_name, u.last_name 
+                FROM user_chat_totals t
+                JOIN users u ON u.user_id = t.user_id
+                WHERE t.chat_id = ?
+            ''', (chat_id,))
+            
+            return await cursor.fetchall()
+
+    def _forget_running_totals(self, user_id):
+        self._user_points.pop(user_id, None)
+        self._user_ranks.pop(user_id, None)
+        # Строка пользователя могла быть удалена, при следующем сообщении профиль запишется заново
+        self._known_profiles.pop(('user', user_id), None)
+    
     async def remove_user_from_chat(self, user_id, chat_id):
         """Removes a user from the activity tracking when they leave a chat"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.transaction() as db:
+                # Write buffered activity in the same transaction so it is removed together with the rest
+                await self._flush_into(db)
+                
                 # Delete user's activity in the specific chat
                 await db.execute(
                     'DELETE FROM activity WHERE user_id = ? AND chat_id = ?',
                     (user_id, chat_id)
                 )
+                await db.execute(
+                    'DELETE FROM user_chat_totals WHERE user_id = ? AND chat_id = ?',
+                    (user_id, chat_id)
+                )
+                await db.execute(
+                    'DELETE FROM activity_daily WHERE user_id = ? AND chat_id = ?',
+                    (user_id, chat_id)
+                )
                 
                 # Check if the user has activity in any other chats
                 cursor = await db.execute(
-                    'SELECT COUNT(*) FROM activity WHERE user_id = ?',
+                    'SELECT COUNT(*) FROM user_chat_totals WHERE user_id = ?',
                     (user_id,)
                 )
                 result = await cursor.fetchone()
@@ -715,16 +1506,29 @@ class Database:
                 
                 # If user has no activity in any chat, remove them from users table
                 if activities_in_other_chats == 0:
+                    await db.execute(
+                        'DELETE FROM user_totals WHERE user_id = ?',
+                        (user_id,)
+                    )
                     await db.execute(
                         'DELETE FROM users WHERE user_id = ?',
                         (user_id,)
                     )
                     logger.info(f"User {user_id} removed from database completely")
                 else:
+                    # Recalculate the global totals from the remaining chats
+                    await db.execute('''
+                        UPDATE user_totals SET
+                            points = (SELECT COALESCE(SUM(points), 0) FROM user_chat_totals WHERE user_id = ?),
+                            messages = (SELECT COALESCE(SUM(messages), 0) FROM user_chat_totals WHERE user_id = ?)
+                        WHERE user_id = ?
+                    ''', (user_id, user_id, user_id))
                     logger.info(f"User {user_id} removed from chat {chat_id} but kept in database")
                 
-                await db.commit()
-                return True
+                # The running totals changed, reload them from the database on next use
+                db.on_commit(lambda: self._forget_running_totals(user_id))
+            
+            return True
         except Exception as e:
             logger.error(f"Error removing user {user_id} from chat {chat_id}: {e}")
             return False
@@ -735,8 +1539,25 @@ db = Database()
 
 # Инициализация базы данных при запуске
 async def init_db():
+    await db.pool.open()
     await db.create_tables()
+    db.start_activity_writer()
+    db.pool.start_checkpoints()
+
+# Закрытие соединений с базой данных при остановке
+async def close_db():
+    await db.stop_activity_writer()
+    await db.pool.close()
 
 if __name__ == "__main__":
-    # Если файл запущен напрямую, создаем таблицы
-    asyncio.run(init_db()) 
\ No newline at end of file
+    # Если файл запущен напрямую, создаем таблицы.
+    # python database.py backfill - перестроить суточную сводку activity_daily из истории
+    import sys
+
+    async def _main():
+        await init_db()
+        if 'backfill' in sys.argv[1:]:
+            await db.rebuild_activity_daily()
+        await close_db()
+
+    asyncio.run(_main())
@@ -0,0 +1,243 @@
+import asyncio
+import copy
+import datetime
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from config import FSM_STATE_TTL, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL_MS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять из базы брошенные состояния (в секундах)
+CLEANUP_INTERVAL = 600
+
+
+class _StateEncoder(json.JSONEncoder):
+    """JSON с поддержкой дат: мастер создания события хранит в данных date и datetime"""
+
+    def default(self, value):
+        if isinstance(value, datetime.datetime):
+            return {'__datetime__': value.isoformat()}
+        if isinstance(value, datetime.date):
+            return {'__date__': value.isoformat()}
+        if isinstance(value, datetime.time):
+            return {'__time__': value.isoformat()}
+        return super().default(value)
+
+
+def _decode_object(value):
+    if len(value) == 1:
+        if '__datetime__' in value:
+            return datetime.datetime.fromisoformat(value['__datetime__'])
+        if '__date__' in value:
+            return datetime.date.fromisoformat(value['__date__'])
+        if '__time__' in value:
+            return datetime.time.fromisoformat(value['__time__'])
+    return value
+
+
+def _dumps(value):
+    return json.dumps(value, cls=_StateEncoder, ensure_ascii=False) if value else None
+
+
+def _loads(value):
+    return json.loads(value, object_hook=_decode_object) if value else {}
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'bucket', 'touched')
+
+    def __init__(self, state=None, data=None, bucket=None, touched=None):
+        self.state = state
+        self.data = data or {}
+        self.bucket = bucket or {}
+        self.touched = time.monotonic() if touched is None else touched
+
+    def is_empty(self):
+        return self.state is None and not self.data and not self.bucket
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в SQLite (таблица fsm_state).
+
+    Состояния переживают перезапуск бота. В памяти держится не больше max_entries
+    последних использованных записей (включая отсутствие состояния, чтобы не читать базу
+    на каждое сообщение), изменения копятся и записываются одной транзакцией раз в
+    flush_interval. Состояние, которое не менялось дольше ttl, считается брошенным и удаляется.
+    """
+
+    def __init__(self, ttl=FSM_STATE_TTL, max_entries=FSM_CACHE_SIZE, flush_interval_ms=FSM_FLUSH_INTERVAL_MS):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.flush_interval = flush_interval_ms / 1000
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._flush_task = None
+        self._last_cleanup = time.monotonic()
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    def _expired(self, record):
+        return self.ttl and time.monotonic() - record.touched > self.ttl
+
+    def _remember(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        # Вытесненные записи с несохраненными изменениями остаются в _dirty до записи в базу
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _get_record(self, chat, user):
+        key = self._key(chat, user)
+        record = self._cache.get(key) or self._dirty.get(key)
+        if record is None:
+            record = await self._load(key)
+            # Пока шло чтение, запись могла появиться в памяти
+            record = self._cache.get(key) or self._dirty.get(key) or record
+
+        if self._expired(record) and not record.is_empty():
+            logger.info(f"Состояние FSM пользователя {key[1]} в чате {key[0]} истекло")
+            record = _Record()
+            self._mark_dirty(key, record)
+
+        self._remember(key, record)
+        return key, record
+
+    async def _load(self, key):
+        async with db.pool.reader() as conn:
+            cursor = await conn.execute('''
+                SELECT state, data, bucket, (julianday('now') - julianday(updated_at)) * 86400
+                FROM fsm_state
+                WHERE chat_id = ? AND user_id = ?
+            ''', key)
+            row = await cursor.fetchone()
+
+        if row is None:
+            return _Record()
+        state, data, bucket, age = row
+        return _Record(state, _loads(data), _loads(bucket), time.monotonic() - (age or 0))
+
+    def _mark_dirty(self, key, record):
+        record.touched = time.monotonic()
+        self._dirty[key] = record
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения состояний в базу одной транзакцией"""
+        if not self._dirty and time.monotonic() - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        dirty, self._dirty = self._dirty, {}
+
+        upserts = [
+            (chat_id, user_id, record.state, _dumps(record.data), _dumps(record.bucket))
+            for (chat_id, user_id), record in dirty.items() if not record.is_empty()
+        ]
+        deletes = [key for key, record in dirty.items() if record.is_empty()]
+        cleanup = self.ttl and time.monotonic() - self._last_cleanup >= CLEANUP_INTERVAL
+
+        try:
+            async with db.pool.writer() as conn:
+                if upserts:
+                    await conn.executemany('''
+                        INSERT INTO fsm_state (chat_id, user_id, state, data, bucket, updated_at)
+                        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                            state = excluded.state, data = excluded.data,
+                            bucket = excluded.bucket, updated_at = excluded.updated_at
+                    ''', upserts)
+                if deletes:
+                    await conn.executemany('DELETE FROM fsm_state WHERE chat_id = ? AND user_id = ?', deletes)
+                if cleanup:
+                    cursor = await conn.execute(
+                        "DELETE FROM fsm_state WHERE updated_at < datetime(CURRENT_TIMESTAMP, ?)",
+                        (f'-{self.ttl} seconds',)
+                    )
+                    if cursor.rowcount:
+                        logger.info(f"Удалено брошенных состояний FSM: {cursor.rowcount}")
+                await conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при записи состояний FSM, повтор при следующей записи: {e}")
+            # Более новые изменения, сделанные во время записи, не затираем
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            return
+
+        if cleanup:
+            self._last_cleanup = time.monotonic()
+            for key in [key for key, record in self._cache.items() if self._expired(record)]:
+                del self._cache[key]
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._dirty:
+            await self.flush()
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        key, record = await self._get_record(chat, user)
+        return record.state if record.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        key, record = await self._get_record(chat, user)
+        return copy.deepcopy(record.data)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, record = await self._get_record(chat, user)
+        record.state = self.resolve_state(state)
+        self._mark_dirty(key, record)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, record = await self._get_record(chat, user)
+        record.data = copy.deepcopy(data) if data else {}
+        self._mark_dirty(key, record)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, record = await self._get_record(chat, user)
+        # Как и MemoryStorage, храним копии: изменения объектов вызывающим кодом не попадают в состояние
+        record.data.update(copy.deepcopy(data) if data else {}, **copy.deepcopy(kwargs))
+        self._mark_dirty(key, record)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        key, record = await self._get_record(chat, user)
+        record.state = None
+        if with_data:
+            record.data = {}
+        self._mark_dirty(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        key, record = await self._get_record(chat, user)
+        return copy.deepcopy(record.bucket)
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, record = await self._get_record(chat, user)
+        record.bucket = copy.deepcopy(bucket) if bucket else {}
+        self._mark_dirty(key, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, record = await self._get_record(chat, user)
+        record.bucket.update(copy.deepcopy(bucket) if bucket else {}, **copy.deepcopy(kwargs))
+        self._mark_dirty(key, record)
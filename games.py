@@ -1,5 +1,5 @@
 import random
-from aiogram import types
+from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.utils.markdown import bold, text
@@ -7,7 +7,16 @@ import logging
 import traceback
 import datetime  # Добавляем импорт для работы с датами и временем
 import asyncio
-
+import functools
+import heapq
+import itertools
+import time
+
+from config import GAME_ROUND_TIMEOUT
+import content_store
+import shuffle_bag
+from answer_matcher import answer_matcher, option_matcher
+from cooldowns import CooldownStore
 from database import db  # Импортируем базу данных для начисления баллов
 
 logger = logging.getLogger(__name__)
@@ -16,89 +25,190 @@ logger = logging.getLogger(__name__)
 EMOJI_GAME_POINTS = 5
 QUIZ_GAME_POINTS = 3
 
-# Система отслеживания активных игр
-class GameTracker:
-    def __init__(self):
-        self.active_game = None  # Тип активной игры: "emoji" или "quiz"
-        self.game_chat_id = None  # ID чата, где идёт игра
-        self.game_starter_id = None  # ID пользователя, который начал игру
-        self.game_start_time = None  # Время начала игры
-        
-        # Система отслеживания времени последнего запуска игр пользователями
-        self.user_last_game = {}  # словарь {user_id: {'timestamp': datetime, 'game_type': str}}
-        # Время ограничения в минутах между запусками игр одним пользователем
-        self.cooldown_minutes = 60
-
-    def is_game_active(self):
-        """Проверяет, активна ли в данный момент какая-либо игра"""
-        return self.active_game is not None
-
-    def start_game(self, game_type, chat_id, user_id):
-        """Регистрирует начало новой игры"""
-        # Устанавливаем данные активной игры
-        self.active_game = game_type
-        self.game_chat_id = chat_id
-        self.game_starter_id = user_id
-        self.game_start_time = datetime.datetime.now()
-        
-        # Записываем время последнего запуска игры пользователем
-        self.user_last_game[user_id] = {
-            'timestamp': self.game_start_time,
-            'game_type': game_type
+# Игровая сессия одного чата
+class GameSession:
+    __slots__ = ('game_type', 'chat_id', 'starter_id', 'started_at', 'deadline',
+                 'question', 'answer', 'aliases', 'options', 'correct', 'matcher', 'attempts')
+
+    def __init__(self, game_type, chat_id, starter_id, question, answer, aliases=(), options=None, correct=None,
+                 timeout=GAME_ROUND_TIMEOUT, started_at=None, attempts=0):
+        self.game_type = game_type  # Тип игры: "emoji" или "quiz"
+        self.chat_id = chat_id
+        self.starter_id = starter_id  # ID пользователя, который начал игру
+        self.started_at = started_at or datetime.datetime.now(datetime.timezone.utc)
+        # Когда раунд закрывается без ответа (по time.monotonic)
+        elapsed = (datetime.datetime.now(datetime.timezone.utc) - self.started_at).total_seconds()
+        self.deadline = time.monotonic() + timeout - max(0.0, elapsed)
+        self.question = question  # Эмодзи-загадка или текст вопроса викторины
+        self.answer = answer  # Правильный ответ текстом
+        self.aliases = tuple(aliases)  # Другие допустимые ответы (только для загадки)
+        self.options = options  # Варианты ответа (только для викторины)
+        self.correct = correct  # Индекс правильного варианта (только для викторины)
+        # Проверка ответа из answer_matcher; индексы кэшируются, поэтому построение дешевое
+        if game_type == "quiz":
+            self.matcher = option_matcher(tuple(options))
+        else:
+            self.matcher = answer_matcher(answer, self.aliases)
+        self.attempts = attempts
+
+    def is_expired(self, now=None):
+        return self.deadline <= (time.monotonic() if now is None else now)
+
+    def to_data(self):
+        """Данные раунда для FSM: состояние игрока хранится в базе, и раунд переживает перезапуск бота"""
+        return {
+            'game_type': self.game_type,
+            'starter_id': self.starter_id,
+            'started_at': self.started_at,
+            'question': self.question,
+            'answer': self.answer,
+            'aliases': list(self.aliases),
+            'options': self.options,
+            'correct': self.correct,
+            'attempts': self.attempts,
         }
-        
-        logger.info(f"Запущена игра {game_type} в чате {chat_id} пользователем {user_id}")
 
-    def end_game(self):
-        """Завершает текущую игру"""
-        if self.active_game:
-            logger.info(f"Завершена игра {self.active_game} в чате {self.game_chat_id}")
-            self.active_game = None
-            self.game_chat_id = None
-            self.game_starter_id = None
-            self.game_start_time = None
+    @classmethod
+    def from_data(cls, chat_id, data, timeout=GAME_ROUND_TIMEOUT):
+        """Восстанавливает сессию из данных FSM или возвращает None, если данных раунда нет"""
+        if not data or data.get('game_type') not in ("emoji", "quiz"):
+            return None
+        return cls(
+            data['game_type'], chat_id, data['starter_id'], data['question'], data['answer'],
+            aliases=data.get('aliases') or (), options=data.get('options'), correct=data.get('correct'),
+            timeout=timeout, started_at=data['started_at'], attempts=data.get('attempts', 0)
+        )
+
 
-    def get_game_info(self):
-        """Возвращает информацию о текущей активной игре"""
-        if not self.is_game_active():
+# Система отслеживания активных игр: в каждом чате своя игра, чаты не мешают друг другу
+class GameTracker:
+    def __init__(self, round_timeout=GAME_ROUND_TIMEOUT):
+        # Сессии по ID чата
+        self.sessions = {}
+        self.round_timeout = round_timeout
+        # Общая для всех чатов куча сроков раундов: (deadline, номер, сессия);
+        # записи завершённых игр остаются в куче и пропускаются при извлечении
+        self._deadlines = []
+        self._sequence = itertools.count()
+        # GameTimeouts, который закрывает раунды по истечении срока
+        self.timeouts = None
+        
+        # Время последнего запуска игр пользователями в каждом чате (хранятся только действующие ограничения)
+        self.cooldowns = CooldownStore()
+
+    def get_session(self, chat_id):
+        """Возвращает активную игру чата или None"""
+        return self.sessions.get(chat_id)
+
+    def next_deadline(self):
+        """Ближайший срок раунда (по time.monotonic) или None, если игр нет"""
+        while self._deadlines and self.sessions.get(self._deadlines[0][2].chat_id) is not self._deadlines[0][2]:
+            heapq.heappop(self._deadlines)
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def pop_expired(self, now=None):
+        """
+        Извлекает из кучи раунды, срок которых истёк, и возвращает их сессии
+
+        Сами игры остаются активными: их завершает GameTimeouts.expire в очереди чата.
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            session = heapq.heappop(self._deadlines)[2]
+            if self.sessions.get(session.chat_id) is session:
+                expired.append(session)
+        return expired
+
+    def is_game_active(self, chat_id):
+        """Проверяет, идёт ли игра в чате"""
+        return self.get_session(chat_id) is not None
+
+    def _register(self, session):
+        self.sessions[session.chat_id] = session
+        heapq.heappush(self._deadlines, (session.deadline, next(self._sequence), session))
+        if self.timeouts is not None:
+            self.timeouts.wake()
+
+    def start_game(self, game_type, chat_id, user_id, question, answer, aliases=(), options=None, correct=None):
+        """Регистрирует начало новой игры в чате и возвращает её сессию"""
+        session = GameSession(game_type, chat_id, user_id, question, answer, aliases, options, correct, self.round_timeout)
+        self._register(session)
+        
+        # Записываем время последнего запуска игры пользователем в этом чате
+        self.cooldowns.start(chat_id, user_id, game_type)
+        
+        logger.info(f"Запущена игра {game_type} в чате {chat_id} пользователем {user_id}, активных игр: {len(self.sessions)}")
+        return session
+
+    async def resume_session(self, chat_id, game_type, state):
+        """
+        Возвращает игру чата, восстанавливая её из данных FSM игрока после перезапуска бота
+
+        Returns:
+            tuple: (сессия или None, True, если раунд нашелся, но его время уже вышло)
+        """
+        session = self.get_session(chat_id)
+        if session is None:
+            data = await state.get_data()
+            session = GameSession.from_data(chat_id, data.get('game'), self.round_timeout)
+            if session is None:
+                return None, False
+            if session.is_expired():
+                return session, True
+            if session.game_type == game_type:
+                logger.info(f"Игра {game_type} в чате {chat_id} восстановлена из состояния игрока")
+                self._register(session)
+        if session.game_type != game_type or session.starter_id != int(state.user):
+            return None, False
+        return session, False
+
+    def end_game(self, chat_id, starter_id=None):
+        """
+        Завершает игру в чате
+        
+        Если указан starter_id, игра завершается, только если её начал этот пользователь.
+        Возвращает завершённую сессию или None.
+        """
+        session = self.sessions.get(chat_id)
+        if session is None or (starter_id is not None and session.starter_id != starter_id):
+            return None
+        del self.sessions[chat_id]
+        logger.info(f"Завершена игра {session.game_type} в чате {chat_id}")
+        return session
+
+    def get_game_info(self, chat_id):
+        """Возвращает информацию об активной игре чата"""
+        session = self.get_session(chat_id)
+        if session is None:
             return "Нет активных игр"
         
-        game_duration = datetime.datetime.now() - self.game_start_time
+        game_duration = datetime.datetime.now(datetime.timezone.utc) - session.started_at
         minutes = int(game_duration.total_seconds() // 60)
         seconds = int(game_duration.total_seconds() % 60)
         
-        game_name = "Угадай по эмодзи" if self.active_game == "emoji" else "Викторина"
+        game_name = "Угадай по эмодзи" if session.game_type == "emoji" else "Викторина"
         
-        return f"Сейчас идёт игра: {game_name}\nЗапустил: ID {self.game_starter_id}\nВремя: {minutes} мин. {seconds} сек."
+        return f"Сейчас идёт игра: {game_name}\nЗапустил: ID {session.starter_id}\nВремя: {minutes} мин. {seconds} сек."
     
-    def can_user_start_game(self, user_id):
-        """Проверяет, может ли пользователь запустить игру (прошло ли достаточно времени)"""
-        if user_id not in self.user_last_game:
+    def can_user_start_game(self, chat_id, user_id):
+        """Проверяет, может ли пользователь запустить игру в чате (прошло ли достаточно времени)"""
+        cooldown = self.cooldowns.get(chat_id, user_id)
+        if cooldown is None:
             return True, None
-            
-        last_game = self.user_last_game[user_id]
-        now = datetime.datetime.now()
-        time_passed = now - last_game['timestamp']
         
-        # Рассчитываем, сколько времени осталось до возможности запуска
-        cooldown_seconds = self.cooldown_minutes * 60
-        seconds_passed = time_passed.total_seconds()
-        seconds_left = cooldown_seconds - seconds_passed
-        
-        if seconds_left <= 0:
-            return True, None
-            
         # Если время не прошло, форматируем оставшееся время
+        seconds_left = cooldown.seconds_left(self.cooldowns.now())
         minutes_left = int(seconds_left // 60)
         seconds_left = int(seconds_left % 60)
         
-        game_type = "Угадай по эмодзи" if last_game['game_type'] == "emoji" else "Викторина"
+        game_type = "Угадай по эмодзи" if cooldown.game_type == "emoji" else "Викторина"
         
         return False, {
             'minutes': minutes_left,
             'seconds': seconds_left,
             'game_type': game_type,
-            'timestamp': last_game['timestamp'].strftime('%H:%M:%S')
+            'timestamp': cooldown.started_at.astimezone().strftime('%H:%M:%S')
         }
 
 
@@ -113,230 +223,72 @@ class GameStates(StatesGroup):
 
 # Игра "Угадай по эмодзи"
 class EmojiGame:
-    def __init__(self):
-        # Словарь с эмодзи-загадками
-        self.emoji_riddles = {
-            "🧙‍♂️📓⚡🔮": "Гарри Поттер",
-            "🦁👑🌍": "Король Лев",
-            "👸❄️⛄": "Холодное сердце",
-            "👠🧚‍♀️🎃": "Золушка",
-            "🚢❄️💑": "Титаник",
-            "🕷️🕸️👨": "Человек-паук",
-            "🤖👽💥": "Трансформеры",
-            "🦖🏝️🚙": "Парк Юрского периода",
-            "🧸👦🍯": "Винни-Пух",
-            "👻👻🔫": "Охотники за привидениями",
-            # Новые фильмы
-            "👨‍👩‍👧📦🏠": "Вверх",
-            "🧠😢😡😄": "Головоломка",
-            "🤵🔫🕴️": "Джеймс Бонд",
-            "🔍🧩🕵️": "Шерлок Холмс",
-            "👑💍🧙‍♂️": "Властелин колец",
-            "🤖❤️🌎": "ВАЛЛ-И",
-            "🦇🃏🌃": "Бэтмен",
-            "🦕🦖🌋": "Мир Юрского периода",
-            "🧜‍♀️🐠🌊": "Русалочка",
-            "🔴⚔️👽": "Звездные войны",
-            # Игры
-            "🍄👨🐢": "Марио",
-            "⛏️🌳🧱": "Minecraft",
-            "🔫🎮🎖️": "Call of Duty",
-            "🚗🏎️💨": "Need for Speed",
-            "🏆⚽🎮": "FIFA",
-            "🧙‍♂️🐲👑": "Skyrim",
-            "🧟🔫🏙️": "Resident Evil",
-            "🗡️🛡️🐉": "Dark Souls",
-            "🤖🦾🤯": "Cyberpunk 2077",
-            "🏝️🏴‍☠️⚓": "Assassin's Creed: Black Flag",
-            # Мультфильмы и сериалы
-            "🟡👨‍👩‍👧‍👦🍩": "Симпсоны",
-            "👨‍🔬👦🔬": "Рик и Морти",
-            "🏰🐉👑": "Игра престолов",
-            "🧪👨‍🔬💊": "Во все тяжкие",
-            "👽👧🚲": "Очень странные дела",
-            "🤠🌵🐴": "Ковбой Бибоп",
-            "👑👸🏹": "Мерида",
-            "👨‍👩‍👧‍👦🏠👻": "Дом совы",
-            "🐼🥋🐯": "Кунг-фу Панда",
-            "🔥🌪️💧": "Аватар: Легенда об Аанге"
-        }
-        self.current_riddle = None
-        self.current_answer = None
-        
-    def get_random_riddle(self):
-        """Получить случайную эмодзи-загадку"""
-        try:
-            riddles_list = list(self.emoji_riddles.items())
-            if not riddles_list:
-                logger.error("Список загадок пуст!")
-                return "❓", "Ошибка"
-            
-            selected = random.choice(riddles_list)
-            self.current_riddle, self.current_answer = selected
-            logger.debug(f"Выбрана загадка: {self.current_riddle} -> {self.current_answer}")
-            return self.current_riddle
-        except Exception as e:
-            logger.exception(f"Ошибка при выборе загадки: {e}")
-            self.current_riddle = "❓"
-            self.current_answer = "Ошибка"
-            return self.current_riddle
+    def __init__(self, pack=None):
+        # Набор эмодзи-загадок (content/emoji_riddles.jsonl); загадка и ответ хранятся в сессии чата, а не здесь
+        self.pack = pack if pack is not None else content_store.emoji_riddles
+        
+    async def get_random_riddle(self, chat_id, category=None):
+        """
+        Получить для чата эмодзи-загадку без повторов
+        
+        Возвращает (загадка, ответ, другие допустимые ответы) или (None, None, ()).
+        """
+        item = await shuffle_bag.draw(chat_id, self.pack, category=category)
+        if item is None:
+            logger.error("Список загадок пуст!")
+            return None, None, ()
+        
+        riddle, answer = item["riddle"], item["answer"]
+        logger.debug(f"Выбрана загадка: {riddle} -> {answer}")
+        return riddle, answer, tuple(item.get("aliases", ()))
+    
+    def get_matcher(self, answer, aliases=()):
+        """Проверка ответа на загадку: без учёта регистра, знаков, раскладки письма и с допуском на опечатки"""
+        return answer_matcher(answer, tuple(aliases))
     
-    def check_answer(self, user_answer):
+    def check_answer(self, correct_answer, user_answer, aliases=()):
         """Проверить ответ пользователя"""
-        if not self.current_answer:
+        if not correct_answer:
             return False
         
-        # Приводим ответы к нижнему регистру для сравнения
-        return user_answer.lower() == self.current_answer.lower()
+        return self.get_matcher(correct_answer, aliases).match(user_answer) is not None
 
 
 # Викторина
 class QuizGame:
-    def __init__(self):
-        # Вопросы для викторины
-        self.questions = [
-            {
-                "question": "Какая страна является самой большой по площади?",
-                "options": ["Китай", "США", "Россия", "Канада"],
-                "correct": 2  # Россия (индекс 2)
-            },
-            {
-                "question": "Сколько планет в Солнечной системе?",
-                "options": ["7", "8", "9", "10"],
-                "correct": 1  # 8 (индекс 1)
-            },
-            {
-                "question": "Кто написал 'Войну и мир'?",
-                "options": ["Достоевский", "Толстой", "Чехов", "Пушкин"],
-                "correct": 1  # Толстой (индекс 1)
-            },
-            {
-                "question": "Какой элемент имеет символ 'O' в периодической таблице?",
-                "options": ["Олово", "Осмий", "Кислород", "Золото"],
-                "correct": 2  # Кислород (индекс 2)
-            },
-            {
-                "question": "Столица Японии?",
-                "options": ["Киото", "Осака", "Токио", "Сеул"],
-                "correct": 2  # Токио (индекс 2)
-            },
-            # Новые вопросы по истории
-            {
-                "question": "В каком году началась Вторая мировая война?",
-                "options": ["1937", "1939", "1941", "1945"],
-                "correct": 1  # 1939 (индекс 1)
-            },
-            {
-                "question": "Кто был первым президентом США?",
-                "options": ["Томас Джефферсон", "Джордж Вашингтон", "Авраам Линкольн", "Джон Адамс"],
-                "correct": 1  # Джордж Вашингтон (индекс 1)
-            },
-            # Вопросы по географии
-            {
-                "question": "Какая река самая длинная в мире?",
-                "options": ["Амазонка", "Нил", "Янцзы", "Миссисипи"],
-                "correct": 0  # Амазонка (индекс 0)
-            },
-            {
-                "question": "В какой стране находится Тадж-Махал?",
-                "options": ["Индия", "Пакистан", "Иран", "ОАЭ"],
-                "correct": 0  # Индия (индекс 0)
-            },
-            # Вопросы по науке
-            {
-                "question": "Какой газ наиболее распространен в атмосфере Земли?",
-                "options": ["Кислород", "Углекислый газ", "Азот", "Аргон"],
-                "correct": 2  # Азот (индекс 2)
-            },
-            {
-                "question": "Какое животное самое быстрое на суше?",
-                "options": ["Лев", "Гепард", "Антилопа", "Тигр"],
-                "correct": 1  # Гепард (индекс 1)
-            },
-            # Вопросы по искусству
-            {
-                "question": "Кто написал картину 'Звездная ночь'?",
-                "options": ["Клод Моне", "Пабло Пикассо", "Винсент Ван Гог", "Сальвадор Дали"],
-                "correct": 2  # Ван Гог (индекс 2)
-            },
-            {
-                "question": "Какой музыкальный инструмент имеет 88 клавиш?",
-                "options": ["Орган", "Фортепиано", "Аккордеон", "Синтезатор"],
-                "correct": 1  # Фортепиано (индекс 1)
-            },
-            # Вопросы по спорту
-            {
-                "question": "В каком городе прошли первые современные Олимпийские игры?",
-                "options": ["Париж", "Афины", "Лондон", "Рим"],
-                "correct": 1  # Афины (индекс 1)
-            },
-            {
-                "question": "Сколько игроков в команде по футболу?",
-                "options": ["10", "11", "12", "9"],
-                "correct": 1  # 11 (индекс 1)
-            },
-            # Вопросы по технологиям
-            {
-                "question": "Кто основал компанию Microsoft?",
-                "options": ["Стив Джобс", "Билл Гейтс", "Марк Цукерберг", "Илон Маск"],
-                "correct": 1  # Билл Гейтс (индекс 1)
-            },
-            {
-                "question": "В каком году был запущен первый iPhone?",
-                "options": ["2005", "2007", "2009", "2010"],
-                "correct": 1  # 2007 (индекс 1)
-            },
-            # Вопросы по кино
-            {
-                "question": "Какой фильм получил Оскар за лучший фильм в 2020 году?",
-                "options": ["1917", "Джокер", "Паразиты", "Однажды в Голливуде"],
-                "correct": 2  # Паразиты (индекс 2)
-            },
-            {
-                "question": "Кто сыграл Железного человека в киновселенной Marvel?",
-                "options": ["Крис Эванс", "Роберт Дауни-младший", "Крис Хемсворт", "Марк Руффало"],
-                "correct": 1  # Роберт Дауни-младший (индекс 1)
-            },
-            # Вопросы по еде
-            {
-                "question": "Какая страна является родиной пиццы?",
-                "options": ["Франция", "Испания", "Греция", "Италия"],
-                "correct": 3  # Италия (индекс 3)
-            },
-            {
-                "question": "Из чего делают традиционный васаби?",
-                "options": ["Из горчицы", "Из хрена", "Из зеленого перца", "Из имбиря"],
-                "correct": 1  # Из хрена (индекс 1)
-            }
-        ]
-        self.current_question = None
-        
-    def get_random_question(self):
-        """Получить случайный вопрос"""
-        self.current_question = random.choice(self.questions)
-        return self.current_question
+    def __init__(self, pack=None):
+        # Набор вопросов викторины (content/quiz_questions.jsonl)
+        self.pack = pack if pack is not None else content_store.quiz_questions
+        
+    async def get_random_question(self, chat_id, category=None):
+        """Получить для чата вопрос без повторов (вопрос хранится в сессии чата, а не здесь) или None"""
+        return await shuffle_bag.draw(chat_id, self.pack, category=category)
+    
+    def get_matcher(self, options):
+        """Распознавание варианта ответа по номеру или тексту (с допуском на опечатки)"""
+        return option_matcher(tuple(options))
     
-    def check_answer(self, option_index):
+    def check_answer(self, question, option_index):
         """Проверить ответ пользователя по индексу варианта"""
-        if not self.current_question:
+        if not question:
             return False
         
-        return option_index == self.current_question["correct"]
+        return option_index == question["correct"]
     
-    def get_formatted_question(self):
+    def get_formatted_question(self, question):
         """Получить отформатированный текст вопроса с вариантами ответов"""
-        if not self.current_question:
+        if not question:
             return "Ошибка: вопрос не выбран"
         
-        question_text = bold(self.current_question["question"]) + "\n\n"
+        question_text = bold(question["question"]) + "\n\n"
         
-        for i, option in enumerate(self.current_question["options"]):
+        for i, option in enumerate(question["options"]):
             question_text += f"{i+1}. {option}\n"
             
         return question_text
 
 
-# Создание экземпляров игр
+# Создание экземпляров игр (общие наборы загадок и вопросов, без состояния конкретной игры)
 emoji_game = EmojiGame()
 quiz_game = QuizGame()
 
@@ -371,18 +323,126 @@ async def safe_finish_state(state: FSMContext):
         except Exception as e2:
             logger.error(f"Критическая ошибка при сбросе состояния: {str(e2)}")
     
-    # Независимо от результата, сбрасываем текущие значения игр
+    # Независимо от результата, завершаем игру чата, если её начал этот пользователь
     try:
-        # Сбрасываем текущие значения игр для предотвращения багов при следующем запуске
-        emoji_game.current_riddle = None
-        emoji_game.current_answer = None
-        quiz_game.current_question = None
-        # Завершаем игру в трекере
-        game_tracker.end_game()
+        if state.chat is not None:
+            game_tracker.end_game(int(state.chat), starter_id=int(state.user) if state.user is not None else None)
     except Exception as e:
         logger.error(f"Ошибка при сбросе игровых данных: {str(e)}")
 
 
+
+def timeout_text(session):
+    """Сообщение о раунде, на который не ответили вовремя"""
+    if session.game_type == "emoji":
+        return (
+            f"⌛ Время вышло, загадку никто не отгадал!\n\n"
+            f"Загадка: {session.question}\n"
+            f"Правильный ответ: {session.answer}"
+        )
+    return (
+        f"⌛ Время вышло!\n\n"
+        f"Вопрос: {session.question}\n"
+        f"Правильный ответ: {session.answer}"
+    )
+
+
+async def resume_or_close(message, state, game_type):
+    """
+    Сессия игры, на которую отвечает игрок, или None, если раунда больше нет
+
+    Если раунда нет (например, его время вышло, пока бот был выключен), состояние игрока
+    сбрасывается, а сообщение обрабатывается как обычное и учитывается в активности.
+    """
+    session, expired = await game_tracker.resume_session(message.chat.id, game_type, state)
+    if session is not None and not expired:
+        return session
+
+    logger.warning(f"Игра пользователя {message.from_user.id} в чате {message.chat.id} не найдена, сбрасываем состояние")
+    await safe_finish_state(state)
+    if expired:
+        await message.answer(timeout_text(session))
+
+    # Отложенный импорт: handlers импортирует этот модуль
+    from handlers import process_message
+    await process_message(message)
+    return None
+
+
+# Закрытие раундов, на которые никто не ответил
+class GameTimeouts:
+    """
+    Закрывает раунды игр, на которые не ответили за round_timeout трекера.
+
+    Вместо отдельной спящей задачи на каждую игру одна фоновая задача ждёт ближайшего
+    срока из общей кучи трекера. По истечении срока ответ раскрывается в чате, состояние
+    игрока сбрасывается, и в чате можно сразу начать новую игру.
+
+    Если у диспетчера есть UpdateRouter, раунд закрывается в очереди обработчика чата,
+    поэтому завершение по времени не пересекается с обработкой ответа в том же чате.
+    """
+
+    def __init__(self, dispatcher, tracker=None):
+        self.dispatcher = dispatcher
+        self.tracker = tracker or game_tracker
+        self._task = None
+        self._wakeup = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+            self.tracker.timeouts = self
+
+    async def stop(self):
+        if self.tracker.timeouts is self:
+            self.tracker.timeouts = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            expired = self.tracker.pop_expired()
+            router = getattr(self.dispatcher, 'router', None)
+            if router is not None:
+                for session in expired:
+                    router.submit_call(session.chat_id, functools.partial(self.expire, session))
+            elif expired:
+                # Раунды, истёкшие одновременно в разных чатах, закрываются параллельно
+                await asyncio.gather(*(self.expire(session) for session in expired))
+
+            deadline = self.tracker.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def expire(self, session):
+        """Раскрывает ответ раунда, срок которого истёк, и сбрасывает состояние игрока"""
+        # Пока закрытие ждало очереди, раунд мог завершиться ответом или командой
+        if self.tracker.get_session(session.chat_id) is not session:
+            return
+        self.tracker.end_game(session.chat_id)
+        logger.info(f"Время игры {session.game_type} в чате {session.chat_id} истекло")
+        try:
+            await safe_finish_state(self.dispatcher.current_state(chat=session.chat_id, user=session.starter_id))
+            
+            await self.dispatcher.bot.send_message(session.chat_id, timeout_text(session))
+        except Exception as e:
+            logger.error(f"Ошибка при завершении игры по времени в чате {session.chat_id}: {e}")
+
+
 # Обработчик команды /emoji_game
 async def cmd_emoji_game(message: types.Message, state: FSMContext):
     try:
@@ -390,9 +450,9 @@ async def cmd_emoji_game(message: types.Message, state: FSMContext):
         chat_id = message.chat.id
         logger.info(f"Запущена команда emoji_game пользователем {user_id} в чате {chat_id}")
         
-        # Проверяем, не активна ли уже какая-то игра
-        if game_tracker.is_game_active():
-            game_info = game_tracker.get_game_info()
+        # Проверяем, не идёт ли уже игра в этом чате
+        if game_tracker.is_game_active(chat_id):
+            game_info = game_tracker.get_game_info(chat_id)
             await message.answer(
                 f"❌ В данный момент уже идёт игра!\n\n{game_info}\n\nПожалуйста, дождитесь завершения текущей игры.",
                 parse_mode=types.ParseMode.MARKDOWN
@@ -400,7 +460,7 @@ async def cmd_emoji_game(message: types.Message, state: FSMContext):
             return
         
         # Проверяем, прошло ли достаточно времени с момента последней игры пользователя
-        can_start, cooldown_info = game_tracker.can_user_start_game(user_id)
+        can_start, cooldown_info = game_tracker.can_user_start_game(chat_id, user_id)
         if not can_start:
             await message.answer(
                 f"⏳ Вы запускали игру слишком часто!\n\n"
@@ -417,16 +477,16 @@ async def cmd_emoji_game(message: types.Message, state: FSMContext):
             await safe_finish_state(state)
         
         # Получаем загадку и проверяем, что она корректна
-        riddle = emoji_game.get_random_riddle()
-        if not riddle or not emoji_game.current_answer:
+        riddle, answer, aliases = await emoji_game.get_random_riddle(chat_id)
+        if not riddle or not answer:
             logger.error("Не удалось получить корректную загадку")
             await message.answer("Произошла ошибка при генерации загадки. Попробуйте еще раз позже.")
             return
             
         logger.debug(f"Загадка получена: {riddle}")
         
-        # Регистрируем игру в трекере
-        game_tracker.start_game("emoji", chat_id, user_id)
+        # Регистрируем игру чата в трекере, загадка и ответ хранятся в сессии
+        session = game_tracker.start_game("emoji", chat_id, user_id, riddle, answer, aliases)
         
         # Формируем сообщение
         response_text = (
@@ -440,9 +500,9 @@ async def cmd_emoji_game(message: types.Message, state: FSMContext):
         await message.answer(response_text, parse_mode=types.ParseMode.MARKDOWN)
         logger.debug(f"Сообщение отправлено пользователю {user_id}")
         
-        # Устанавливаем состояние и данные
-        await state.update_data(attempts=0, riddle=riddle, answer=emoji_game.current_answer)
+        # Устанавливаем состояние: ответы игрока направляются в process_emoji_answer
         await GameStates.emoji_game.set()
+        await state.update_data(game=session.to_data())
         logger.info(f"Состояние GameStates.emoji_game установлено для пользователя {user_id}")
         
     except Exception as e:
@@ -459,28 +519,29 @@ async def process_emoji_answer(message: types.Message, state: FSMContext):
         chat_id = message.chat.id
         logger.info(f"Получен ответ от пользователя {user_id} в состоянии emoji_game: {message.text}")
         
-        user_answer = message.text
-        user_data = await state.get_data()
-        attempts = user_data.get('attempts', 0)
+        user_answer = message.text or ""
         
-        # Проверка, что загадка была корректно установлена
-        if not emoji_game.current_riddle or not emoji_game.current_answer:
-            logger.error(f"Текущая загадка не найдена, перезапускаем игру")
-            await message.answer("Произошла ошибка с текущей загадкой. Начните игру заново командой /emoji_game")
-            await safe_finish_state(state)
+        # Проверка, что игра этого пользователя в чате ещё идёт (после перезапуска она восстанавливается из FSM)
+        session = await resume_or_close(message, state, "emoji")
+        if session is None:
             return
+        attempts = session.attempts
         
         # Проверка ответа
-        if user_answer.lower() == emoji_game.current_answer.lower():
+        if session.matcher.match(user_answer) is not None:
             # Правильный ответ
             points = max(5.0 - attempts * 0.5, 1.0)  # Меньше баллов за больше попыток
-            success, rank_info = await db.add_game_activity(chat_id, user_id, 'emoji_game', points)
+            success, rank_info = await db.add_game_activity(
+                chat_id, user_id, 'emoji_game', points,
+                username=message.from_user.username, first_name=message.from_user.first_name,
+                last_name=message.from_user.last_name
+            )
             
             # Базовое сообщение об успехе
             response = (
                 f"🎯 Правильный ответ, {message.from_user.full_name}!\n\n"
-                f"Загадка: {emoji_game.current_riddle}\n"
-                f"Ответ: {emoji_game.current_answer}\n"
+                f"Загадка: {session.question}\n"
+                f"Ответ: {session.answer}\n"
                 f"Попыток использовано: {attempts + 1}\n"
                 f"Получено баллов: {points}"
             )
@@ -504,9 +565,7 @@ async def process_emoji_answer(message: types.Message, state: FSMContext):
                 
                 await message.answer(congrats_text, parse_mode="Markdown")
             
-            # Сбрасываем состояние и загадку
-            emoji_game.current_riddle = None
-            emoji_game.current_answer = None
+            # Сбрасываем состояние и завершаем игру чата
             await safe_finish_state(state)
             
             # С некоторой вероятностью запускаем новую игру
@@ -519,7 +578,8 @@ async def process_emoji_answer(message: types.Message, state: FSMContext):
             attempts += 1
             
             # Обновляем количество попыток
-            await state.update_data(attempts=attempts)
+            session.attempts = attempts
+            await state.update_data(game=session.to_data())
             
             # Разные ответы в зависимости от количества попыток
             if attempts < 3:
@@ -528,12 +588,16 @@ async def process_emoji_answer(message: types.Message, state: FSMContext):
                 # Если исчерпаны все попытки, показываем ответ
                 await message.answer(
                     f"⛔ Попытки закончились!\n\n"
-                    f"Загадка: {emoji_game.current_riddle}\n"
-                    f"Правильный ответ: {emoji_game.current_answer}"
+                    f"Загадка: {session.question}\n"
+                    f"Правильный ответ: {session.answer}"
                 )
                 
                 # Начисляем утешительный балл за участие
-                success, rank_info = await db.add_game_activity(chat_id, user_id, 'emoji_game', 0.5)
+                success, rank_info = await db.add_game_activity(
+                    chat_id, user_id, 'emoji_game', 0.5,
+                    username=message.from_user.username, first_name=message.from_user.first_name,
+                    last_name=message.from_user.last_name
+                )
                 
                 # Если произошло повышение ранга, отправляем поздравление
                 if success and rank_info and rank_info.get('is_rank_up'):
@@ -552,9 +616,7 @@ async def process_emoji_answer(message: types.Message, state: FSMContext):
                     
                     await message.answer(congrats_text, parse_mode="Markdown")
                 
-                # Сбрасываем состояние и загадку
-                emoji_game.current_riddle = None
-                emoji_game.current_answer = None
+                # Сбрасываем состояние и завершаем игру чата
                 await safe_finish_state(state)
                 
                 # С некоторой вероятностью запускаем новую игру
@@ -576,9 +638,9 @@ async def cmd_quiz(message: types.Message, state: FSMContext):
         chat_id = message.chat.id
         logger.info(f"Запущена команда quiz пользователем {user_id} в чате {chat_id}")
         
-        # Проверяем, не активна ли уже какая-то игра
-        if game_tracker.is_game_active():
-            game_info = game_tracker.get_game_info()
+        # Проверяем, не идёт ли уже игра в этом чате
+        if game_tracker.is_game_active(chat_id):
+            game_info = game_tracker.get_game_info(chat_id)
             await message.answer(
                 f"❌ В данный момент уже идёт игра!\n\n{game_info}\n\nПожалуйста, дождитесь завершения текущей игры.",
                 parse_mode=types.ParseMode.MARKDOWN
@@ -586,7 +648,7 @@ async def cmd_quiz(message: types.Message, state: FSMContext):
             return
         
         # Проверяем, прошло ли достаточно времени с момента последней игры пользователя
-        can_start, cooldown_info = game_tracker.can_user_start_game(user_id)
+        can_start, cooldown_info = game_tracker.can_user_start_game(chat_id, user_id)
         if not can_start:
             await message.answer(
                 f"⏳ Вы запускали игру слишком часто!\n\n"
@@ -603,29 +665,22 @@ async def cmd_quiz(message: types.Message, state: FSMContext):
             await safe_finish_state(state)
             
         # Получаем вопрос викторины и проверяем его корректность
-        question = quiz_game.get_random_question()
+        question = await quiz_game.get_random_question(chat_id)
         if not question:
             logger.error("Не удалось получить корректный вопрос")
             await message.answer("Произошла ошибка при генерации вопроса. Попробуйте еще раз позже.")
             return
         
-        # Регистрируем игру в трекере
-        game_tracker.start_game("quiz", chat_id, user_id)
-            
-        formatted_question = quiz_game.get_formatted_question()
-        
-        # Сохраняем данные вопроса в состоянии для восстановления при необходимости
-        # Важно: сохраняем правильный ответ в виде текста для последующей проверки
+        # Регистрируем игру чата в трекере, вопрос и варианты хранятся в сессии
+        # Важно: сохраняем правильный ответ в виде текста для вывода после игры
         correct_index = question["correct"]
         correct_answer = question["options"][correct_index]
-        
-        await state.update_data(
-            question=question["question"],
-            options=question["options"],
-            correct=question["correct"],
-            correct_answer=correct_answer,
-            attempts=0
+        session = game_tracker.start_game(
+            "quiz", chat_id, user_id, question["question"], correct_answer,
+            options=question["options"], correct=correct_index
         )
+            
+        formatted_question = quiz_game.get_formatted_question(question)
         
         await message.answer(
             f"🎮 *Викторина*\n\n{formatted_question}\n"
@@ -634,6 +689,7 @@ async def cmd_quiz(message: types.Message, state: FSMContext):
         )
         
         await GameStates.quiz_game.set()
+        await state.update_data(game=session.to_data())
         logger.info(f"Состояние GameStates.quiz_game установлено для пользователя {user_id}")
     except Exception as e:
         error_traceback = traceback.format_exc()
@@ -649,45 +705,23 @@ async def process_quiz_answer(message: types.Message, state: FSMContext):
         chat_id = message.chat.id
         logger.info(f"Получен ответ от пользователя {user_id} в состоянии quiz: {message.text}")
         
-        user_answer = message.text.strip()
-        user_data = await state.get_data()
-        question = user_data.get('question')
-        options = user_data.get('options', [])
-        correct = user_data.get('correct')
-        correct_answer = user_data.get('correct_answer')
-        attempts = user_data.get('attempts', 0)
-        
-        # Проверка что данные вопроса корректно установлены
-        if not question or not correct_answer or correct is None or not options:
-            logger.error(f"Данные вопроса некорректны, перезапускаем викторину")
-            await message.answer("Произошла ошибка с текущим вопросом. Начните викторину заново командой /quiz")
-            await safe_finish_state(state)
+        user_answer = (message.text or "").strip()
+        
+        # Проверка, что викторина этого пользователя в чате ещё идёт (после перезапуска она восстанавливается из FSM)
+        session = await resume_or_close(message, state, "quiz")
+        if session is None:
             return
+        question = session.question
+        options = session.options
+        correct = session.correct
+        correct_answer = session.answer
+        attempts = session.attempts
         
-        # Проверяем, является ли ответ числом от 1 до len(options)
-        is_valid_option = False
-        option_index = -1
-        
-        try:
-            # Проверяем, ввел ли пользователь число
-            if user_answer.isdigit():
-                option_index = int(user_answer) - 1  # Преобразуем в 0-индексированный
-                if 0 <= option_index < len(options):
-                    is_valid_option = True
-            
-            # Если ответ не число, проверяем, может быть пользователь ввел текст ответа
-            if not is_valid_option:
-                # Проверяем, не ввел ли пользователь сам ответ текстом
-                for i, option in enumerate(options):
-                    if user_answer.lower() == option.lower():
-                        option_index = i
-                        is_valid_option = True
-                        break
-        except:
-            is_valid_option = False
+        # Ответ - номер варианта от 1 до len(options) или текст варианта (индекс построен при начале игры)
+        option_index = session.matcher.match(user_answer)
         
         # Если ответ не является корректным вариантом
-        if not is_valid_option:
+        if option_index is None:
             await message.answer(f"❗ Пожалуйста, ответьте цифрой от 1 до {len(options)} или введите текст варианта ответа.")
             return
         
@@ -695,7 +729,11 @@ async def process_quiz_answer(message: types.Message, state: FSMContext):
         if option_index == correct:
             # Правильный ответ
             points = max(3.0 - attempts * 0.5, 1.0)  # Меньше баллов за больше попыток
-            success, rank_info = await db.add_game_activity(chat_id, user_id, 'quiz', points)
+            success, rank_info = await db.add_game_activity(
+                chat_id, user_id, 'quiz', points,
+                username=message.from_user.username, first_name=message.from_user.first_name,
+                last_name=message.from_user.last_name
+            )
             
             response = (
                 f"✅ Правильный ответ, {message.from_user.full_name}!\n\n"
@@ -737,7 +775,8 @@ async def process_quiz_answer(message: types.Message, state: FSMContext):
             attempts += 1
             
             # Обновляем количество попыток
-            await state.update_data(attempts=attempts)
+            session.attempts = attempts
+            await state.update_data(game=session.to_data())
             
             # Получаем текст выбранного (неправильного) варианта
             chosen_option = options[option_index]
@@ -755,7 +794,11 @@ async def process_quiz_answer(message: types.Message, state: FSMContext):
                 )
                 
                 # Начисляем утешительный балл за участие
-                success, rank_info = await db.add_game_activity(chat_id, user_id, 'quiz', 0.5)
+                success, rank_info = await db.add_game_activity(
+                    chat_id, user_id, 'quiz', 0.5,
+                    username=message.from_user.username, first_name=message.from_user.first_name,
+                    last_name=message.from_user.last_name
+                )
                 
                 # Если произошло повышение ранга, отправляем поздравление
                 if success and rank_info and rank_info.get('is_rank_up'):
@@ -806,7 +849,7 @@ async def cmd_set_cooldown(message: types.Message):
         command_args = message.get_args()
         if not command_args:
             await message.answer(
-                f"⚙️ Текущее ограничение: {game_tracker.cooldown_minutes} минут\n\n"
+                f"⚙️ Текущее ограничение: {game_tracker.cooldowns.cooldown // 60} минут\n\n"
                 f"Для изменения используйте формат: /set_cooldown [минуты]"
             )
             return
@@ -817,8 +860,8 @@ async def cmd_set_cooldown(message: types.Message):
                 await message.answer("❌ Ограничение не может быть меньше 1 минуты.")
                 return
                 
-            old_cooldown = game_tracker.cooldown_minutes
-            game_tracker.cooldown_minutes = minutes
+            old_cooldown = game_tracker.cooldowns.cooldown // 60
+            game_tracker.cooldowns.set_cooldown(minutes * 60)
             
             await message.answer(
                 f"✅ Ограничение успешно изменено!\n\n"
@@ -875,20 +918,23 @@ async def cmd_end_game(message: types.Message, state: FSMContext):
         user_id = message.from_user.id
         chat_id = message.chat.id
         
-        # Проверяем, есть ли активная игра
-        if not game_tracker.is_game_active():
+        # Проверяем, есть ли активная игра в этом чате
+        if not game_tracker.is_game_active(chat_id):
             await message.answer("В данный момент нет активных игр.")
             return
             
         # Получаем информацию о текущей игре
-        game_info = game_tracker.get_game_info()
+        game_info = game_tracker.get_game_info(chat_id)
         
         # Завершаем игру
-        game_type = game_tracker.active_game
-        game_tracker.end_game()
+        session = game_tracker.end_game(chat_id)
+        game_type = session.game_type
         
-        # Сбрасываем состояния
-        await safe_finish_state(state)
+        # Сбрасываем состояние игрока, начавшего игру (это может быть не автор команды)
+        if session.starter_id == user_id:
+            await safe_finish_state(state)
+        else:
+            await safe_finish_state(Dispatcher.get_current().current_state(chat=chat_id, user=session.starter_id))
         
         await message.answer(
             f"✅ Игра успешно завершена!\n\n"
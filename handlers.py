@@ -6,7 +6,6 @@ import logging
 import asyncio
 import random
 import traceback
-import aiosqlite
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher.filters import Text
@@ -21,6 +20,11 @@ from config import ADMIN_ID, DB_PATH, INACTIVITY_THRESHOLD_DAYS, POINTS_PER_MESS
 from database import Database, init_db, db
 from games import EmojiGame, QuizGame
 from jokes_facts import get_random_content
+import content_store
+import shuffle_bag
+from broadcast import Broadcaster
+from chat_schedule import ChatSchedule, parse_timezone
+from outbox import enqueue, on_sent, outbox_message
 
 # Проверка импорта модуля schedule
 try:
@@ -49,6 +53,13 @@ def set_bot(bot_instance):
     global bot
     bot = bot_instance
 
+
+def outbox_run_id(run_id):
+    """Идентификатор запуска рассылки для ключей очереди; ручной запуск всегда получает новый"""
+    if run_id is None:
+        return f"manual-{datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+    return run_id
+
 # Функция для удаления команд бота
 async def remove_bot_commands():
     """Удаляет все команды из меню бота"""
@@ -84,40 +95,6 @@ CHALLENGE_TEMPLATES = [
     "Кстати, у нас есть ежедневные челленджи. Напиши /challenge, чтобы узнать задание на сегодня."
 ]
 
-# Темы для ежедневного обсуждения
-DAILY_TOPICS = [
-    "🎮 **Игры**: Во что вы играли недавно? Какая игра вас приятно удивила?",
-    "🎵 **Музыка**: Поделитесь треком или исполнителем, который вы слушаете на повторе в последнее время.",
-    "📚 **Книги**: Какую книгу вы сейчас читаете или хотели бы начать читать?",
-    "🎬 **Кино**: Что из последнего просмотренного вас впечатлило, а что разочаровало?",
-    "🍕 **Еда**: Поделитесь своим любимым рецептом или местом, где вкусно готовят.",
-    "💡 **Лайфхаки**: Какой лайфхак вы узнали недавно и он действительно работает?",
-    "💪 **Достижения**: Чем вы гордитесь из того, что сделали на этой неделе?",
-    "🧠 **Знания**: Расскажите об интересном факте, который вы недавно узнали.",
-    "🔮 **Будущее**: Какую технологию будущего вы хотели бы увидеть уже сегодня?",
-    "🏞️ **Путешествия**: Поделитесь своим любимым местом, куда можно поехать на выходные.",
-    "🧩 **Хобби**: Какое хобби вы хотели бы попробовать, но ещё не решились?",
-    "🎭 **Развлечения**: Какой фильм/сериал, выходящий в ближайшее время, вы ждёте больше всего?",
-    "👾 **Технологии**: Какой гаджет изменил вашу жизнь к лучшему?",
-    "🧘 **Саморазвитие**: Поделитесь советом, как справляться со стрессом.",
-    "🎯 **Цели**: Какую цель вы хотите достичь в ближайшие 3 месяца?",
-    "🤔 **Философия**: Если бы вы могли дать один совет себе из прошлого, что бы это было?",
-    "🚀 **Мотивация**: Что вас мотивирует двигаться вперёд, когда всё идёт не по плану?",
-    "🎁 **Подарки**: Какой самый запоминающийся подарок вы получали или дарили?",
-    "👻 **Страхи**: Чего вы боялись в детстве, а сейчас это кажется забавным?",
-    "🎨 **Творчество**: Если бы вы могли мгновенно освоить любой творческий навык, что бы выбрали?",
-    "🏘️ **Дом**: Что для вас идеальный дом - место, дизайн, атмосфера?",
-    "📱 **Приложения**: Какое нестандартное приложение вы можете порекомендовать?",
-    "☕ **Утро**: Поделитесь своим утренним ритуалом, который помогает хорошо начать день.",
-    "🌙 **Вечер**: Как вы любите проводить вечер после тяжёлого дня?",
-    "🏆 **Успех**: Как для вас выглядит успешная жизнь?",
-    "🤝 **Отношения**: Какую черту характера вы цените в людях больше всего?",
-    "💭 **Мечты**: Если бы вы могли исполнить одно своё желание, что бы вы выбрали?",
-    "📺 **Шоу**: Какое ток-шоу, стрим или подкаст вы рекомендуете посмотреть/послушать?",
-    "🧪 **Эксперименты**: Какой смелый эксперимент со своей жизнью вы хотели бы провести?",
-    "🌍 **Мир**: Какое место на Земле вы мечтаете посетить больше всего и почему?"
-]
-
 # Звания дня для самых активных пользователей
 ACTIVE_USER_TITLES = [
     "🌟 Звезда чата",
@@ -137,60 +114,6 @@ ACTIVE_USER_TITLES = [
     "🔍 Внимательный наблюдатель"
 ]
 
-# Список вопросов дня
-RANDOM_QUESTIONS = [
-    "⁉️ Если бы вы могли изменить одно решение в своей жизни, что бы это было?",
-    "👥 Кто повлиял на вас больше всего и почему?",
-    "💰 Если бы у вас был неограниченный бюджет на один день, как бы вы его потратили?",
-    "🏝️ Куда бы вы отправились, если бы могли телепортироваться куда угодно прямо сейчас?",
-    "📚 Какая книга изменила ваше мировоззрение?",
-    "🧠 Верите ли вы в существование инопланетной жизни? Почему?",
-    "⚔️ Какая историческая эпоха вам интересна больше всего?",
-    "🍽️ Если бы вы могли есть только одно блюдо до конца жизни, что бы это было?",
-    "😱 Что вас пугает больше всего?",
-    "🤔 Считаете ли вы, что технологии делают нас ближе или отдаляют друг от друга?",
-    "🎯 Достигли ли вы того, чего хотели 5 лет назад?",
-    "🏢 Что бы вы изменили на своей работе, если бы могли?",
-    "👻 Верите ли вы в паранормальные явления? Почему?",
-    "🎭 Если бы ваша жизнь была фильмом, какой бы это был жанр?",
-    "🌍 Какую глобальную проблему вы бы решили, если бы могли?",
-    "🧩 Что для вас является самым сложным в общении с людьми?",
-    "🔮 Каким вы видите мир через 20 лет?",
-    "🚀 Какой была бы ваша сверхспособность, если бы вы могли выбрать любую?",
-    "💯 Что вы цените в других людях больше всего?",
-    "🧘‍♀️ Что помогает вам расслабиться после тяжелого дня?",
-    "👶 Что бы вы рассказали своему 10-летнему себе?",
-    "🌟 Кто ваш герой или кумир и почему?",
-    "🏆 Какое достижение заставило вас почувствовать наибольшую гордость?",
-    "💔 Как вы справляетесь с разочарованиями?",
-    "🎁 Лучше дарить подарки или получать их?",
-    "🚩 Что для вас является «красным флагом» в отношениях?",
-    "🕒 Если бы у вас была возможность замедлить или ускорить время, что бы вы выбрали?",
-    "💤 О чем вы мечтаете?",
-    "❓ Что вы никогда не сможете понять?",
-    "🔍 Что бы вы хотели узнать, прежде чем умереть?",
-    "🎵 Какая песня лучше всего описывает вашу жизнь?",
-    "🎪 Соревнование или сотрудничество — что вам ближе?",
-    "🍀 Верите ли вы в удачу или считаете, что всё зависит только от наших решений?",
-    "📱 Как бы вы выжили без интернета на месяц?",
-    "👑 Если бы вы правили страной, что бы вы изменили первым делом?",
-    "🧗‍♂️ Что было самым сложным испытанием в вашей жизни?",
-    "📆 Отдаете ли вы предпочтение планированию или спонтанности?",
-    "🎮 Какие три приложения/игры вы бы взяли на необитаемый остров?",
-    "🙊 Если бы вы могли быть любым животным, каким бы вы были и почему?",
-    "📱 Приносят ли социальные сети больше пользы или вреда?",
-    "🧠 Если бы человечество могло решить только одну проблему в следующие 5 лет, что бы вы выбрали?",
-    "🕵️ Какая тайна или загадка вас больше всего интригует?",
-    "👨‍👩‍👧‍👦 Что самое важное в семье?",
-    "🎓 Чему самому важному вы научились НЕ в школе?",
-    "🚶‍♂️ Какой жизненный совет вы бы дали людям, которые моложе вас на 10 лет?",
-    "👀 Что вам говорят о вас ваши друзья, но вы сами этого не замечаете?",
-    "🗣️ Какое слово или фраза вас раздражает больше всего?",
-    "💼 Если бы вы могли попробовать любую профессию на один день, что бы вы выбрали?",
-    "⚖️ Справедливость или милосердие — что важнее?",
-    "🧰 Какой навык вы хотели бы освоить, но ещё не нашли время?"
-]
-
 # Обработчик команды /start
 async def cmd_start(message: types.Message):
     user = message.from_user
@@ -312,7 +235,7 @@ async def cmd_top(message: types.Message):
         total_points, total_messages = user[4], user[5]
         
         # Получаем ранг пользователя
-        rank = await db.get_rank_by_points(total_points)
+        rank = db.rank_for(total_points) or "Без ранга"
         
         # Формируем имя пользователя
         if first_name:
@@ -367,7 +290,7 @@ async def cmd_challenge(message: types.Message):
 
 
 # Функция для проверки и отправки напоминаний неактивным пользователям
-async def check_inactive_users(bot):
+async def check_inactive_users(bot, chat_ids=None):
     """
     Проверяет наличие неактивных пользователей и тегает их в чате
     Возвращает общее количество отмеченных неактивных пользователей
@@ -378,88 +301,87 @@ async def check_inactive_users(bot):
         # Счетчик общего количества отмеченных неактивных пользователей
         total_inactive_marked = 0
         
-        # Получаем все известные боту чаты
-        chats = await db.get_all_chats()
+        # Получаем все известные боту чаты или только переданные в chat_ids
+        chats = await db.get_all_chats(chat_ids)
         
-        for chat_id, chat_title in chats:
+        async def remind_chat(broadcaster, chat):
+            nonlocal total_inactive_marked
+            chat_id, chat_title = chat
             try:
                 # Получаем список неактивных пользователей в данном чате
                 inactive_users = await db.get_inactive_users(chat_id, INACTIVITY_THRESHOLD_DAYS)
                 
                 if not inactive_users:
                     logger.info(f"В чате {chat_id} ({chat_title}) нет неактивных пользователей")
-                    continue
+                    return
                 
                 logger.info(f"Найдено {len(inactive_users)} неактивных пользователей в чате {chat_id} ({chat_title})")
                 
                 # Сначала отправляем сообщение в сам чат о количестве неактивных
-                try:
-                    await bot.send_message(
-                        chat_id,
-                        f"🔍 Обнаружено {len(inactive_users)} неактивных участников."
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
-                    continue
+                if not await broadcaster.send_message(
+                    chat_id,
+                    f"🔍 Обнаружено {len(inactive_users)} неактивных участников."
+                ):
+                    logger.error(f"Не удалось отправить сообщение в чат {chat_id}")
+                    return
                 
                 # Счетчик отмеченных неактивных пользователей в текущем чате
                 chat_inactive_marked = 0
                 
-                # Отправляем напоминания в чат, тегая каждого неактивного пользователя
+                # Отправляем напоминания в чат, тегая каждого неактивного пользователя.
+                # Частоту отправки в один чат ограничивает Broadcaster
                 for user_id, username, first_name, last_name, last_active in inactive_users:
-                    try:
-                        # Только если у пользователя есть юзернейм, его можно тегнуть
-                        if username:
-                            # Формируем обращение к пользователю
-                            user_tag = f"@{username}"
-                            
-                            # Выбираем случайный шаблон напоминания
-                            reminder_message = random.choice(REMINDER_TEMPLATES).format(chat_title=chat_title)
-                            
-                            # Добавляем случайное приглашение в игру или челлендж
-                            if random.random() < 0.5:
-                                reminder_message += "\n\n" + random.choice(GAME_INVITATION_TEMPLATES)
-                            else:
-                                reminder_message += "\n\n" + random.choice(CHALLENGE_TEMPLATES)
-                            
-                            # Отправляем напоминание в чат с тегом пользователя
-                            await bot.send_message(
-                                chat_id,
-                                f"{user_tag}, мы скучаем по тебе! {reminder_message}"
-                            )
-                            
-                            logger.info(f"Отправлено напоминание пользователю {user_id} ({username}) в чат {chat_id}")
-                            
-                            # Увеличиваем счетчики отмеченных пользователей
-                            chat_inactive_marked += 1
-                            total_inactive_marked += 1
-                            
-                            # Небольшая задержка между отправками, чтобы не нагружать API
-                            await asyncio.sleep(1)
-                        else:
-                            logger.warning(f"Пользователь {user_id} ({first_name}) не имеет username, невозможно тегнуть")
-                            
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке напоминания пользователю {user_id}: {e}")
+                    # Только если у пользователя есть юзернейм, его можно тегнуть
+                    if not username:
+                        logger.warning(f"Пользователь {user_id} ({first_name}) не имеет username, невозможно тегнуть")
+                        continue
+                    
+                    # Формируем обращение к пользователю
+                    user_tag = f"@{username}"
+                    
+                    # Выбираем случайный шаблон напоминания
+                    reminder_message = random.choice(REMINDER_TEMPLATES).format(chat_title=chat_title)
+                    
+                    # Добавляем случайное приглашение в игру или челлендж
+                    if random.random() < 0.5:
+                        reminder_message += "\n\n" + random.choice(GAME_INVITATION_TEMPLATES)
+                    else:
+                        reminder_message += "\n\n" + random.choice(CHALLENGE_TEMPLATES)
+                    
+                    # Отправляем напоминание в чат с тегом пользователя
+                    if await broadcaster.send_message(
+                        chat_id,
+                        f"{user_tag}, мы скучаем по тебе! {reminder_message}"
+                    ):
+                        logger.info(f"Отправлено напоминание пользователю {user_id} ({username}) в чат {chat_id}")
+                        
+                        # Увеличиваем счетчики отмеченных пользователей
+                        chat_inactive_marked += 1
+                        total_inactive_marked += 1
+                    elif chat_id in broadcaster.result.blocked_chats:
+                        # Бот больше не может писать в этот чат
+                        return
                 
                 # Отправляем сообщение в чат о завершении рассылки
-                try:
-                    if chat_inactive_marked > 0:
-                        await bot.send_message(
-                            chat_id,
-                            f"✅ Отмечено {chat_inactive_marked} неактивных участников."
-                        )
-                    else:
-                        await bot.send_message(
-                            chat_id,
-                            f"ℹ️ Ни один участник не был отмечен (у всех отсутствует username)."
-                        )
-                except Exception as e:
-                    logger.error(f"Не удалось отправить финальное сообщение в чат {chat_id}: {e}")
+                if chat_inactive_marked > 0:
+                    await broadcaster.send_message(
+                        chat_id,
+                        f"✅ Отмечено {chat_inactive_marked} неактивных участников."
+                    )
+                else:
+                    await broadcaster.send_message(
+                        chat_id,
+                        f"ℹ️ Ни один участник не был отмечен (у всех отсутствует username)."
+                    )
                     
             except Exception as e:
                 logger.error(f"Ошибка при обработке чата {chat_id}: {e}")
         
+        result = await Broadcaster(bot).run(chats, remind_chat)
+        for old_chat_id, new_chat_id in result.migrated_chats.items():
+            await db.migrate_chat(old_chat_id, new_chat_id)
+        
+        logger.info(f"Рассылка напоминаний завершена ({result})")
         logger.info(f"Проверка неактивных пользователей завершена. Всего отмечено: {total_inactive_marked}")
         return total_inactive_marked
         
@@ -510,9 +432,8 @@ async def process_message(message: types.Message):
         chat_id = message.chat.id
         chat_title = message.chat.title
         
-        # Регистрируем чат и пользователя
-        await db.add_chat(chat_id, chat_title)
-        await db.add_user(user_id, username, first_name, last_name)
+        # Регистрируем чат и пользователя: запись идет вместе с пакетом активности
+        db.queue_profile(chat_id, chat_title, user_id, username, first_name, last_name)
         
         # Определяем тип сообщения и начисляем баллы
         message_type = "text"
@@ -571,18 +492,23 @@ async def process_message(message: types.Message):
 
 
 # Функция для отправки еженедельного отчета об активности
-async def send_weekly_report(bot):
-    """Отправляет еженедельный отчет об активности в каждый чат"""
+async def send_weekly_report(bot, run_id=None, chat_ids=None):
+    """Ставит в очередь отправки еженедельный отчет об активности для каждого чата"""
     try:
         logger.info("Запуск отправки еженедельного отчета")
         
-        # Получаем все известные боту чаты
-        chats = await db.get_all_chats()
+        # Получаем все известные боту чаты или только переданные в chat_ids
+        chats = await db.get_all_chats(chat_ids)
         
+        # Отчеты за последние 7 дней сразу для всех чатов (или только для переданных)
+        reports = await db.get_weekly_reports(days=7, top_limit=5, chat_ids=chat_ids)
+        empty_report = {'message_count': 0, 'total_points': 0, 'active_users': 0, 'daily_activity': [], 'top_users': []}
+        run_id = outbox_run_id(run_id)
+        
+        messages = []
         for chat_id, chat_title in chats:
             try:
-                # Получаем отчет об активности за последние 7 дней
-                report = await db.get_chat_activity_report(chat_id, days=7)
+                report = reports.get(chat_id, empty_report)
                 
                 # Формируем текст отчета
                 report_text = f"📊 *Еженедельный отчет активности чата*\n\n"
@@ -596,8 +522,8 @@ async def send_weekly_report(bot):
                 for day, count in report['daily_activity']:
                     report_text += f"• {day}: {count} сообщений\n"
                 
-                # Получаем топ-5 активных участников
-                top_users = await db.get_top_users(chat_id, limit=5)
+                # Топ-5 активных участников за неделю
+                top_users = report['top_users']
                 
                 if top_users:
                     report_text += "\n🏆 *Самые активные участники недели:*\n"
@@ -606,19 +532,17 @@ async def send_weekly_report(bot):
                         name = username if username else (first_name + (" " + last_name if last_name else ""))
                         report_text += f"{i}. {name} - {points:.1f} баллов\n"
                 
-                # Отправляем отчет в чат
-                await bot.send_message(
-                    chat_id,
-                    report_text,
-                    parse_mode=types.ParseMode.MARKDOWN
-                )
-                
-                logger.info(f"Отправлен еженедельный отчет в чат {chat_id} ({chat_title})")
+                messages.append(outbox_message(
+                    f"weekly_report:{run_id}:{chat_id}", chat_id, report_text,
+                    parse_mode=types.ParseMode.MARKDOWN, kind='weekly_report'
+                ))
                 
             except Exception as e:
-                logger.error(f"Ошибка при отправке отчета в чат {chat_id}: {e}")
+                logger.error(f"Ошибка при формировании отчета для чата {chat_id}: {e}")
+        
+        added = await enqueue(messages)
         
-        logger.info("Отправка еженедельных отчетов завершена")
+        logger.info(f"Еженедельные отчеты поставлены в очередь отправки: {added}")
         
     except Exception as e:
         logger.error(f"Критическая ошибка при отправке еженедельных отчетов: {e}")
@@ -639,45 +563,38 @@ async def cmd_send_report(message: types.Message):
     from main import bot  # Импортируем бота из main.py
     await send_weekly_report(bot)
     
-    await message.answer("✅ Отчет успешно отправлен!")
+    await message.answer("✅ Отчет поставлен в очередь отправки!")
 
 
 # Функция для отправки ежедневной темы для обсуждения
-async def send_daily_topic(bot):
+async def send_daily_topic(bot, run_id=None, chat_ids=None):
     """
-    Отправляет ежедневную тему для обсуждения во все чаты
+    Ставит в очередь отправки ежедневную тему для обсуждения во все чаты
     """
     try:
         logger.info("Запуск отправки ежедневной темы для обсуждения")
         
-        # Получаем все известные боту чаты
-        chats = await db.get_all_chats()
-        
-        # Выбираем случайную тему из списка
-        daily_topic = random.choice(DAILY_TOPICS)
+        # Получаем все известные боту чаты или только переданные в chat_ids
+        chats = await db.get_all_chats(chat_ids)
         
-        # Формируем сообщение
-        message_text = f"💬 **Тема дня для обсуждения:**\n\n{daily_topic}\n\nПоделитесь своими мыслями в чате!"
+        # Каждому чату - следующая тема из набора content/daily_topics.jsonl, без повторов до конца набора
+        topics = await shuffle_bag.draw_many([chat_id for chat_id, chat_title in chats], content_store.daily_topics)
+        if chats and not topics:
+            logger.error("Набор тем для обсуждения пуст")
+            return
         
-        # Отправляем тему в каждый чат
-        for chat_id, chat_title in chats:
-            try:
-                # Отправляем сообщение в чат
-                await bot.send_message(
-                    chat_id,
-                    message_text,
-                    parse_mode=types.ParseMode.MARKDOWN
-                )
-                
-                logger.info(f"Тема дня отправлена в чат {chat_id} ({chat_title})")
-                
-                # Небольшая задержка между отправками
-                await asyncio.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при отправке темы дня в чат {chat_id}: {e}")
+        # Ставим тему в очередь для каждого чата
+        run_id = outbox_run_id(run_id)
+        added = await enqueue([
+            outbox_message(
+                f"daily_topic:{run_id}:{chat_id}", chat_id,
+                f"💬 **Тема дня для обсуждения:**\n\n{topic['text']}\n\nПоделитесь своими мыслями в чате!",
+                parse_mode=types.ParseMode.MARKDOWN, kind='daily_topic'
+            )
+            for chat_id, topic in topics.items()
+        ])
         
-        logger.info("Отправка ежедневной темы для обсуждения завершена")
+        logger.info(f"Ежедневная тема для обсуждения поставлена в очередь отправки: {added}")
         
     except Exception as e:
         logger.error(f"Критическая ошибка при отправке ежедневной темы: {e}")
@@ -698,21 +615,23 @@ async def cmd_send_daily_topic(message: types.Message):
     from main import bot  # Импортируем бота из main.py
     await send_daily_topic(bot)
     
-    await message.answer("✅ Тема для обсуждения успешно отправлена!")
+    await message.answer("✅ Тема для обсуждения поставлена в очередь отправки!")
 
 
 # Функция для определения и отправки звания дня самому активному пользователю
-async def send_active_user_of_the_day(bot):
+async def send_active_user_of_the_day(bot, run_id=None, chat_ids=None):
     """
     Определяет самого активного пользователя за последние 24 часа 
-    и отправляет уведомление в чат
+    и ставит уведомление для чата в очередь отправки
     """
     try:
         logger.info("Запуск определения самого активного пользователя дня")
         
-        # Получаем все известные боту чаты
-        chats = await db.get_all_chats()
+        # Получаем все известные боту чаты или только переданные в chat_ids
+        chats = await db.get_all_chats(chat_ids)
+        run_id = outbox_run_id(run_id)
         
+        messages = []
         for chat_id, chat_title in chats:
             try:
                 # Получаем самого активного пользователя
@@ -742,19 +661,17 @@ async def send_active_user_of_the_day(bot):
                     f"Поздравляем! Продолжайте в том же духе! 🎉"
                 )
                 
-                # Отправляем сообщение в чат
-                await bot.send_message(
-                    chat_id,
-                    message_text,
-                    parse_mode=types.ParseMode.MARKDOWN
-                )
-                
-                logger.info(f"Отправлено уведомление о самом активном пользователе дня в чат {chat_id}")
+                messages.append(outbox_message(
+                    f"active_user:{run_id}:{chat_id}", chat_id, message_text,
+                    parse_mode=types.ParseMode.MARKDOWN, kind='active_user'
+                ))
                 
             except Exception as e:
                 logger.error(f"Ошибка при обработке чата {chat_id}: {e}")
         
-        logger.info("Определение самого активного пользователя дня завершено")
+        added = await enqueue(messages)
+        
+        logger.info(f"Определение самого активного пользователя дня завершено, в очереди отправки: {added}")
         
     except Exception as e:
         logger.error(f"Критическая ошибка при определении самого активного пользователя: {e}")
@@ -775,7 +692,7 @@ async def cmd_active_user_of_day(message: types.Message):
     from main import bot  # Импортируем бота из main.py
     await send_active_user_of_the_day(bot)
     
-    await message.answer("✅ Информация о самом активном пользователе отправлена!")
+    await message.answer("✅ Информация о самом активном пользователе поставлена в очередь отправки!")
 
 
 # Обработчик команды /empty - для очистки списка команд бота
@@ -925,6 +842,71 @@ async def cmd_chat_info(message: types.Message):
         await message.answer("Произошла ошибка при получении информации о чате. Попробуйте позже.")
 
 
+# Названия дней недели для настроек расписания чата (0 - понедельник)
+WEEKDAY_NAMES = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"]
+
+# Команда /chat_settings - просмотр и изменение расписания рассылок в чате (только для админов)
+async def cmd_chat_settings(message: types.Message):
+    """
+    Показывает или изменяет настройки расписания чата:
+    /chat_settings timezone Asia/Almaty | topic_hour 12 | report_day 0 | quiet 23-8 | quiet off | reset
+    """
+    if message.from_user.id not in ADMIN_ID:
+        await message.answer("❌ Эта команда доступна только администраторам.")
+        return
+    
+    chat_id = message.chat.id
+    if chat_id >= 0:
+        await message.answer("❌ Настройки расписания доступны только в групповых чатах.")
+        return
+    
+    args = message.get_args().split()
+    try:
+        if args:
+            setting, value = args[0].lower(), " ".join(args[1:])
+            if setting == "timezone" and value:
+                parse_timezone(value)
+                await db.update_chat_settings(chat_id, timezone=value)
+            elif setting == "topic_hour" and value.isdigit() and 0 <= int(value) <= 23:
+                await db.update_chat_settings(chat_id, daily_topic_hour=int(value))
+            elif setting == "report_day" and value.isdigit() and 0 <= int(value) <= 6:
+                await db.update_chat_settings(chat_id, report_day=int(value))
+            elif setting == "quiet" and value == "off":
+                await db.update_chat_settings(chat_id, quiet_start=None, quiet_end=None)
+            elif setting == "quiet" and value:
+                quiet_start, quiet_end = (int(hour) for hour in value.split("-"))
+                if not (0 <= quiet_start <= 23 and 0 <= quiet_end <= 23):
+                    raise ValueError("часы должны быть от 0 до 23")
+                await db.update_chat_settings(chat_id, quiet_start=quiet_start, quiet_end=quiet_end)
+            elif setting == "reset":
+                await db.update_chat_settings(chat_id, timezone=None, daily_topic_hour=None, report_day=None,
+                                              quiet_start=None, quiet_end=None)
+            else:
+                await message.answer(
+                    "❌ Неверный формат команды. Используйте:\n"
+                    "/chat_settings timezone <Asia/Almaty или UTC+6>\n"
+                    "/chat_settings topic_hour <0-23>\n"
+                    "/chat_settings report_day <0-6, 0 - понедельник>\n"
+                    "/chat_settings quiet <начало-конец, например 23-8> или quiet off\n"
+                    "/chat_settings reset"
+                )
+                return
+    except ValueError as e:
+        await message.answer(f"❌ Неверное значение: {e}")
+        return
+    
+    settings = await db.get_chat_settings(chat_id)
+    schedule = ChatSchedule(chat_id, settings.get(chat_id, {}))
+    quiet = f"{schedule.quiet_start}:00-{schedule.quiet_end}:00" if schedule.quiet_start is not None else "нет"
+    await message.answer(
+        f"⚙️ Расписание чата:\n\n"
+        f"🌍 Часовой пояс: {schedule.timezone}\n"
+        f"💬 Тема дня: в {schedule.daily_topic_hour}:00\n"
+        f"📊 Еженедельный отчет: {WEEKDAY_NAMES[schedule.report_day]}\n"
+        f"🌙 Тихие часы: {quiet}"
+    )
+
+
 # Обработчик команды /admin - админ-панель
 async def cmd_admin(message: types.Message):
     """Показывает административные команды"""
@@ -945,6 +927,7 @@ async def cmd_admin(message: types.Message):
             f"/active_user_of_day - Объявить самого активного пользователя\n"
             f"/add_points - Начислить очки активности пользователю\n"
             f"/send_to_all - Отправить сообщение во все чаты\n"
+            f"/chat_settings - Часовой пояс и расписание рассылок чата\n"
         )
         
         await message.answer(admin_commands, parse_mode="Markdown")
@@ -1008,7 +991,8 @@ async def cmd_send_to_all(message: types.Message):
 async def get_activity_count(self, chat_id, user_id, activity_type):
     """Получает количество активностей определенного типа для пользователя"""
     try:
-        async with aiosqlite.connect(self.db_path) as db:
+        await self.flush_activity()
+        async with self.pool.reader() as db:
             cursor = await db.execute(
                 'SELECT COUNT(*) FROM activity WHERE chat_id = ? AND user_id = ? AND message_type = ?',
                 (chat_id, user_id, activity_type)
@@ -1027,9 +1011,10 @@ setattr(db.__class__, 'get_activity_count', get_activity_count)
 async def get_chat_user_count(self, chat_id):
     """Получает общее количество уникальных пользователей в чате"""
     try:
-        async with aiosqlite.connect(self.db_path) as db:
+        await self.flush_activity()
+        async with self.pool.reader() as db:
             cursor = await db.execute(
-                'SELECT COUNT(DISTINCT user_id) FROM activity WHERE chat_id = ?',
+                'SELECT COUNT(*) FROM user_chat_totals WHERE chat_id = ?',
                 (chat_id,)
             )
             result = await cursor.fetchone()
@@ -1086,6 +1071,7 @@ def register_handlers(dp):
     
     # Административные команды
     dp.register_message_handler(cmd_chat_info, commands=["chat_info"])
+    dp.register_message_handler(cmd_chat_settings, commands=["chat_settings"])
     dp.register_message_handler(cmd_admin, commands=["admin"])
     dp.register_message_handler(cmd_send_to_all, commands=["send_to_all"])
     dp.register_message_handler(cmd_remove_user, commands=["remove_user"])  # Added remove_user command registration
@@ -1115,52 +1101,45 @@ def register_handlers(dp):
     dp.register_message_handler(process_message)
 
 # Функция для отправки случайного вопроса дня
-async def send_random_question(bot):
-    """Отправляет случайный вопрос дня во все активные чаты"""
+async def send_random_question(bot, run_id=None, chat_ids=None):
+    """Ставит в очередь отправки случайный вопрос дня во все активные чаты"""
     try:
         logger.info("Запуск отправки случайного вопроса дня")
         
-        # Получаем все известные боту чаты
-        chats = await db.get_all_chats()
-        
-        # Выбираем случайный вопрос
-        question = random.choice(RANDOM_QUESTIONS)
-        
-        # Формируем сообщение
-        message_text = f"🎯 **Вопрос дня:**\n\n{question}\n\nПоделитесь своими мыслями в чате! 💭\n\n_За участие в обсуждении вы получите дополнительные баллы активности!_"
-        
-        # Счетчик успешных отправок
-        successful_sends = 0
-        
-        # Отправляем вопрос в каждый чат
-        for chat_id, chat_title in chats:
-            try:
-                # Отправляем сообщение в чат и сохраняем его ID
-                message = await bot.send_message(
-                    chat_id,
-                    message_text,
-                    parse_mode=types.ParseMode.MARKDOWN
-                )
-                
-                # Сохраняем ID сообщения с вопросом в базе данных для отслеживания ответов
-                await db.save_question_message_id(chat_id, message.message_id, question)
-                
-                logger.info(f"Вопрос дня отправлен в чат {chat_id} ({chat_title})")
-                successful_sends += 1
-                
-                # Небольшая задержка между отправками
-                await asyncio.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при отправке вопроса дня в чат {chat_id}: {e}")
+        # Получаем все известные боту чаты или только переданные в chat_ids
+        chats = await db.get_all_chats(chat_ids)
+        
+        # Каждому чату - следующий вопрос из набора content/random_questions.jsonl, без повторов до конца набора
+        questions = await shuffle_bag.draw_many([chat_id for chat_id, chat_title in chats], content_store.random_questions)
+        if chats and not questions:
+            logger.error("Набор вопросов дня пуст")
+            return 0
+        
+        # Ставим вопрос в очередь для каждого чата; ID сообщения сохранит обработчик после отправки
+        run_id = outbox_run_id(run_id)
+        added = await enqueue([
+            outbox_message(
+                f"daily_question:{run_id}:{chat_id}", chat_id,
+                f"🎯 **Вопрос дня:**\n\n{question['text']}\n\nПоделитесь своими мыслями в чате! 💭\n\n_За участие в обсуждении вы получите дополнительные баллы активности!_",
+                parse_mode=types.ParseMode.MARKDOWN, kind='daily_question', payload={'question': question['text']}
+            )
+            for chat_id, question in questions.items()
+        ])
         
-        logger.info(f"Отправка случайного вопроса дня завершена. Успешно отправлено в {successful_sends} чатов")
-        return successful_sends
+        logger.info(f"Случайный вопрос дня поставлен в очередь отправки: {added}")
+        return added
         
     except Exception as e:
         logger.error(f"Критическая ошибка при отправке случайного вопроса дня: {e}")
         return 0
 
+
+@on_sent('daily_question')
+async def save_daily_question_message(item, message):
+    """Сохраняет ID отправленного вопроса дня в базе данных для отслеживания ответов"""
+    await db.save_question_message_id(message.chat.id, message.message_id, item['payload']['question'])
+    logger.info(f"Вопрос дня отправлен в чат {item['chat_id']}")
+
 # Команда для ручной отправки случайного вопроса дня (только для админов)
 async def cmd_send_random_question(message: types.Message):
     user_id = message.from_user.id
@@ -1176,7 +1155,7 @@ async def cmd_send_random_question(message: types.Message):
     from main import bot  # Импортируем бота из main.py
     count = await send_random_question(bot)
     
-    await message.answer(f"✅ Случайный вопрос дня успешно отправлен в {count} чатов!")
+    await message.answer(f"✅ Случайный вопрос дня поставлен в очередь отправки для {count} чатов!")
 
 # Команда для просмотра статистики вопросов дня
 async def cmd_question_stats(message: types.Message):
@@ -1214,25 +1193,25 @@ async def cmd_question_stats(message: types.Message):
 # Обработчик команды /joke - получение случайной шутки
 async def cmd_joke(message: types.Message):
     """Отправляет случайную шутку"""
-    content = get_random_content("joke")
+    content = await get_random_content("joke", chat_id=message.chat.id)
     await message.answer(f"{content['emoji']} *Шутка:*\n\n{content['content']}", parse_mode="Markdown")
 
 # Обработчик команды /fact - получение случайного факта
 async def cmd_fact(message: types.Message):
     """Отправляет случайный интересный факт"""
-    content = get_random_content("fact")
+    content = await get_random_content("fact", chat_id=message.chat.id)
     await message.answer(f"{content['emoji']} *Интересный факт:*\n\n{content['content']}", parse_mode="Markdown")
 
 # Обработчик команды /tech_fact - получение случайного технического факта
 async def cmd_tech_fact(message: types.Message):
     """Отправляет случайный технический факт"""
-    content = get_random_content("tech")
+    content = await get_random_content("tech", chat_id=message.chat.id)
     await message.answer(f"{content['emoji']} *Технический факт:*\n\n{content['content']}", parse_mode="Markdown")
 
 # Обработчик команды /random_content - получение случайного контента (шутка или факт)
 async def cmd_random_content(message: types.Message):
     """Отправляет случайный контент - шутку или факт"""
-    content = get_random_content()
+    content = await get_random_content(chat_id=message.chat.id)
     
     if content['type'] == "joke":
         await message.answer(f"{content['emoji']} *Случайная шутка:*\n\n{content['content']}", parse_mode="Markdown")
@@ -1790,12 +1769,11 @@ async def send_event_notifications(bot):
                 
                 notification_text += f"\n👥 *Участники ({len(participants)}):*\n"
                 
-                # Отправляем основное уведомление сначала
-                await bot.send_message(
-                    event['chat_id'],
-                    notification_text,
-                    parse_mode="Markdown"
-                )
+                # Основное уведомление отправляется первым, сообщения одного чата уходят по порядку
+                messages = [outbox_message(
+                    f"event:{event['id']}:notice", event['chat_id'], notification_text,
+                    parse_mode="Markdown", kind='event_notification'
+                )]
                 
                 # Добавляем список участников с тегами отдельным сообщением
                 if participants:
@@ -1805,21 +1783,24 @@ async def send_event_notifications(bot):
                             mentions += f"@{participant['username']} "
                     
                     if mentions:
-                        # Отправляем упоминания отдельным сообщением без Markdown
-                        await bot.send_message(event['chat_id'], mentions)
+                        # Упоминания отдельным сообщением без Markdown
+                        messages.append(outbox_message(
+                            f"event:{event['id']}:mentions", event['chat_id'], mentions, kind='event_notification'
+                        ))
                 
-                # Отправляем информацию о командах отдельным сообщением
+                # Информация о командах отдельным сообщением
                 command_text = f"Чтобы посмотреть детали события, используйте команду /event\\_{event['id']}"
-                await bot.send_message(
-                    event['chat_id'],
-                    command_text,
-                    parse_mode="Markdown"
-                )
+                messages.append(outbox_message(
+                    f"event:{event['id']}:command", event['chat_id'], command_text,
+                    parse_mode="Markdown", kind='event_notification'
+                ))
                 
-                # Отмечаем, что уведомление отправлено
+                await enqueue(messages)
+                
+                # Отмечаем, что уведомление поставлено в очередь: повторная постановка по тем же ключам ничего не добавит
                 await schedule_manager.mark_notification_sent(event['id'])
                 
-                logger.info(f"Отправлено уведомление о событии ID {event['id']} в чат {event['chat_id']}")
+                logger.info(f"Уведомление о событии ID {event['id']} для чата {event['chat_id']} поставлено в очередь отправки")
                 
             except Exception as e:
                 logger.error(f"Ошибка при отправке уведомления о событии {event['id']}: {e}")
@@ -1829,20 +1810,6 @@ async def send_event_notifications(bot):
     except Exception as e:
         logger.error(f"Критическая ошибка при отправке уведомлений о событиях: {e}")
 
-# Функция планировщика для отправки уведомлений о предстоящих событиях
-async def schedule_event_notifications():
-    """Планировщик для регулярной проверки и отправки уведомлений о событиях"""
-    while True:
-        try:
-            # Проверяем и отправляем уведомления
-            await send_event_notifications(bot)
-            
-            # Проверяем каждые 30 минут
-            await asyncio.sleep(30 * 60)
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике уведомлений о событиях: {e}")
-            await asyncio.sleep(60)  # В случае ошибки ждем 1 минуту
-
 # Сообщения для стимуляции активности
 ACTIVITY_MESSAGES = [
     "Что-то тихо тут стало! Давайте немного пообщаемся? 💭",
@@ -1853,13 +1820,13 @@ ACTIVITY_MESSAGES = [
 ]
 
 # Функция для отправки приглашения случайным пользователям, когда чат неактивен
-async def invite_random_users_to_chat(bot):
+async def invite_random_users_to_chat(bot, chat_ids=None):
     """Приглашает случайных пользователей к общению, если в чате затишье"""
     try:
         logger.info("Проверка активности в чатах")
         
-        # Получаем все чаты
-        chats = await db.get_all_chats()
+        # Получаем все известные боту чаты или только переданные в chat_ids
+        chats = await db.get_all_chats(chat_ids)
         
         for chat_id, chat_title in chats:
             try:
@@ -1913,7 +1880,7 @@ async def invite_random_users_to_chat(bot):
                         await bot.send_message(chat_id, message)
                         
                         # Добавляем случайную шутку/факт как отдельное сообщение
-                        content = get_random_content()
+                        content = await get_random_content(chat_id=chat_id)
                         
                         if content['type'] == "joke":
                             content_message = f"{content['emoji']} *Шутка:*\n\n{content['content']}"
@@ -1991,19 +1958,10 @@ async def cmd_clean_inactive_users(message: types.Message):
     
     try:
         # Получаем список всех пользователей в базе для этого чата
-        async with aiosqlite.connect(DB_PATH) as conn:
-            conn.row_factory = aiosqlite.Row  # Используем Row для удобства доступа к полям
-            cursor = await conn.execute('''
-                SELECT DISTINCT u.user_id, u.username, u.first_name, u.last_name 
-                FROM users u
-                JOIN activity a ON u.user_id = a.user_id
-                WHERE a.chat_id = ?
-            ''', (chat_id,))
-            
-            users = await cursor.fetchall()
-            
-            user_count = len(users)
-            await message.answer(f"📊 Найдено {user_count} пользователей в базе данных для этого чата.")
+        users = await db.get_chat_users(chat_id)
+        
+        user_count = len(users)
+        await message.answer(f"📊 Найдено {user_count} пользователей в базе данных для этого чата.")
         
         # Счетчики
         removed_count = 0
@@ -2015,9 +1973,7 @@ async def cmd_clean_inactive_users(message: types.Message):
         
         # Проверяем каждого пользователя
         for i, user_row in enumerate(users, 1):
-            current_user_id = user_row['user_id']
-            username = user_row['username']
-            first_name = user_row['first_name']
+            current_user_id, username, first_name, last_name = user_row
             
             # Обновляем статус каждые 5 пользователей
             if i % 5 == 0 or i == len(users):
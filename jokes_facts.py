@@ -1,131 +1,42 @@
 import random
 
-# Коллекция шуток
-JOKES = [
-    "Программист звонит в библиотеку:\n— Здравствуйте, скажите, у вас есть книги по Паскалю?\n— Нет, у нас только техническая литература.",
-    "Какие три самых распространенных программистских проблемы? Мы называем их ПНЧ: Писать, Называть, Числить.",
-    "Почему программисты путают Хэллоуин и Рождество? Потому что 31 OCT = 25 DEC.",
-    "Что говорит программист, когда видит огонь? Объект горит!",
-    "Жена программиста послала его в магазин:\n— Купи батон колбасы, и если будут яйца, возьми десять.\nПрограммист купил десять батонов колбасы.",
-    "Как объяснить программисту разницу между 'хорошо' и 'плохо'? В терминах 'true' и 'false'.",
-    "Почему Java-разработчики носят очки? Потому что они не видят Sharp.",
-    "Как называется программист, который не отвечает на вопросы? Отключенный.",
-    "Что такое оптимист? Программист, который думает, что его код будет работать. А пессимист - который думает так же.",
-    "Два SQL-запроса заходят в бар, подходят к столику и спрашивают: 'Можно к вам присоединиться?'",
-    "Было у отца три сына: старший умный был детина, средний был и так и сяк, младший полный был дурак... Угадайте, кого папа отправил на курсы программирования?",
-    "Какая разница между программистом и кошкой? Кошку еще можно заставить мыться.",
-    "Почему программисты любят тёмный режим? Чтобы окружающие не видели их слезы.",
-    "— Для эффективной работы нам нужно 8 новых программистов!\n— Я дам вам 4, а вы их просто будете использовать с двух сторон.",
-    "В чем сходство между программистами и волшебниками? Они оба сидят в темноте и произносят заклинания, которые никто не понимает.",
-    "Что такое 'поддержка кода с легаси'? Это когда код написал парень, которого уже нет в команде, но все его вспоминают каждый день.",
-    "Программист — это человек, который сначала долго думает, а потом пишет 'Hello, world!'.",
-    "Почему программисты предпочитают использовать клавиатуру вместо мыши? Потому что мышь — это лишний клик.",
-    "Если бы программисты строили дома, первый же дятел разрушил бы цивилизацию.",
-    "Сколько программистов нужно, чтобы вкрутить лампочку? Ни одного, это аппаратная проблема.",
-    "Программист уезжает в отпуск и оставляет записку: 'Если что-то сломается, перезагрузите сервер. Если не поможет, позвоните мне'. Через час звонок: 'Сервер перезагрузили, не помогло'. Программист: 'А что сломалось-то?' Коллега: 'Кофе-машина'.",
-    "Есть 10 типов людей: те, кто понимает двоичную систему, и те, кто нет.",
-    "Программирование похоже на секс: одна ошибка, и тебе придется поддерживать это всю оставшуюся жизнь.",
-    "Лучший способ ускорить компьютер — это выбросить его из окна девятого этажа.",
-    "Что общего у программиста и патологоанатома? Оба работают с тем, что уже не дышит."
-]
+import content_store
+import shuffle_bag
 
-# Коллекция интересных фактов
-FACTS = [
-    "Масса всех муравьев на Земле примерно равна массе всех людей.",
-    "В Антарктиде есть только один банкомат.",
-    "Кошки могут издавать около 100 различных звуков, в то время как собаки только около 10.",
-    "Мед не портится. Археологи нашли горшки с медом в гробницах египетских фараонов, которым более 3000 лет.",
-    "Облака могут весить более миллиона тонн.",
-    "Человеческое тело содержит столько же углерода, что и 900 карандашей.",
-    "Первым товаром, отсканированным по штрих-коду, была пачка жвачки Wrigley's.",
-    "Единственная пища, которая не портится — это мед.",
-    "Самая длинная икота длилась 68 лет.",
-    "Кошки спят 70% своей жизни.",
-    "Улитка может спать до трех лет.",
-    "В космосе нельзя плакать, так как слезы не стекают и остаются на лице.",
-    "Человек — единственное млекопитающее, которое не может дышать и глотать одновременно.",
-    "Зебры спят стоя.",
-    "У осьминога три сердца.",
-    "Верблюды могут выпить 113 литров воды за 13 минут.",
-    "У улиток около 25 000 зубов.",
-    "Змеи могут видеть даже после закрытия глаз.",
-    "Аромат яблок и бананов помогает похудеть.",
-    "Мозг страуса меньше его глаза.",
-    "Космонавты на МКС видят 16 рассветов и закатов за 24 часа.",
-    "Акулы существовали на Земле раньше, чем деревья.",
-    "Самый громкий звук, изданный животным, — это свист синего кита (188 децибел).",
-    "Кровь моллюсков голубого цвета.",
-    "Голубь может распознать на фотографии человека, которого когда-то видел.",
-    "Сумма чисел на рулетке казино (от 0 до 36) равна 666.",
-    "Температура молнии в пять раз выше температуры поверхности Солнца.",
-    "Арахис используется при производстве динамита.",
-    "Белые медведи могут бегать со скоростью 40 км/ч.",
-    "Жирафы могут чистить свои уши языком.",
-    "В среднем человек смеется 15 раз в день.",
-    "Отпечатки языка так же уникальны, как отпечатки пальцев.",
-    "Сердце синего кита настолько велико, что человек может проплыть по его артериям.",
-    "Самое высокое дерево в мире — секвойя по имени Гиперион, её высота более 115 метров.",
-    "Новорожденный кенгуру имеет размер всего около 2,5 см.",
-    "Пчелы могут распознавать человеческие лица.",
-    "Самая короткая война в истории длилась 38 минут (между Британией и Занзибаром в 1896 году).",
-    "Вомбаты — единственные животные, чьи экскременты имеют кубическую форму.",
-    "У коз прямоугольные зрачки.",
-    "Хамелеоны могут двигать глазами независимо друг от друга."
-]
+# Шутки, интересные и технические факты хранятся в content/fun.jsonl,
+# тип контента задается полем category: joke, fact или tech
+CONTENT_EMOJI = {
+    "joke": "😂",
+    "fact": "🧠",
+    "tech": "💻"
+}
 
-# Коллекция технических фактов
-TECH_FACTS = [
-    "Первый компьютерный баг (ошибка) был настоящим жуком - мотыльком, застрявшим в реле Марка II в 1947 году.",
-    "В 1956 году жесткий диск размером с пианино имел емкость всего 5 МБ.",
-    "Первый веб-сайт в мире до сих пор существует: http://info.cern.ch/.",
-    "Термин 'спам' происходит от скетча Монти Пайтона, где хор викингов постоянно повторяет слово 'spam'.",
-    "Изначально у японских смайликов были не горизонтальные, а вертикальные глаза: (^_^)",
-    "Сбой Y2K (проблема 2000 года) стоил миру около 300 миллиардов долларов на подготовку и исправление.",
-    "Компания Google каждый день обрабатывает около 3,5 миллиардов поисковых запросов.",
-    "Самый первый логотип Apple изображал Исаака Ньютона, сидящего под яблоней.",
-    "Первое видео на YouTube называлось 'Me at the zoo' и было загружено 23 апреля 2005 года.",
-    "В мире существует около 700 языков программирования.",
-    "Среднее время, которое пользователь проводит на веб-странице, составляет всего 54 секунды.",
-    "Каждый день создается около 2,5 квинтиллиона байт данных.",
-    "Название Bluetooth произошло от имени датского короля Харальда «Синезубого» Гормссона.",
-    "В 1972 году ученые отправили первую электронную почту. Содержание было 'QWERTYUIOP'.",
-    "Термин 'баг' для обозначения ошибки в программе появился задолго до компьютеров - его использовал еще Томас Эдисон.",
-    "Первое сообщение, отправленное по ARPANET (предшественнику Интернета), было 'LO'. Система дала сбой при попытке ввести 'LOGIN'.",
-    "Большинство современных компьютеров обладают вычислительной мощностью большей, чем у NASA во время первых миссий на Луну.",
-    "Первая компьютерная мышь была деревянной и создана в 1964 году.",
-    "Домен символов '.com' изначально означал 'коммерческий', а не 'компьютер'.",
-    "Примерно 70% всех видеопотоков в интернете составляет порнография.",
-    "Первый коммерчески успешный видеомагнитофон стоил как небольшой автомобиль.",
-    "Первый смайлик :-) был предложен Скоттом Фалманом в 1982 году.",
-    "Компания Nokia изначально занималась производством бумаги.",
-    "Слово 'робот' было придумано чешским писателем Карелом Чапеком и впервые использовано в его пьесе R.U.R.",
-    "Около 90% всех данных в мире было создано за последние несколько лет.",
-    "Первый компьютерный вирус назывался 'Creeper' и появился в начале 1970-х.",
-    "Каждый день в мире отправляется около 300 миллиардов электронных писем.",
-    "Самый продаваемый мобильный телефон в истории — Nokia 1100.",
-    "Первая веб-камера была создана в Кембриджском университете для наблюдения за кофейником.",
-    "Изначально игра Pac-Man называлась Puck-Man."
-]
+
+def _random_text(category):
+    item = content_store.fun_content.random(category=category)
+    return item["text"] if item else None
 
 def get_random_joke():
     """Возвращает случайную шутку из коллекции"""
-    return random.choice(JOKES)
+    return _random_text("joke")
 
 def get_random_fact():
     """Возвращает случайный интересный факт из коллекции"""
-    return random.choice(FACTS)
+    return _random_text("fact")
 
 def get_random_tech_fact():
     """Возвращает случайный технический факт из коллекции"""
-    return random.choice(TECH_FACTS)
+    return _random_text("tech")
 
-def get_random_content(content_type=None):
+async def get_random_content(content_type=None, chat_id=None):
     """
     Возвращает случайный контент заданного типа
     
     Args:
         content_type (str, optional): Тип контента ("joke", "fact", "tech"). 
                                      Если None, выбирается случайный тип.
+        chat_id (int, optional): Чат, для которого выбирается контент; в одном чате
+                                 шутки и факты не повторяются, пока не закончатся.
     
     Returns:
         dict: Словарь с контентом и его типом
@@ -133,28 +44,18 @@ def get_random_content(content_type=None):
     if content_type is None:
         content_type = random.choice(["joke", "fact", "tech"])
         
-    if content_type == "joke":
-        return {
-            "content": get_random_joke(),
-            "type": "joke",
-            "emoji": "😂"
-        }
-    elif content_type == "fact":
-        return {
-            "content": get_random_fact(),
-            "type": "fact",
-            "emoji": "🧠"
-        }
-    elif content_type == "tech":
-        return {
-            "content": get_random_tech_fact(),
-            "type": "tech",
-            "emoji": "💻"
-        }
-    else:
+    if content_type not in CONTENT_EMOJI:
         # По умолчанию возвращаем шутку
-        return {
-            "content": get_random_joke(),
-            "type": "joke",
-            "emoji": "😂"
-        } 
\ No newline at end of file
+        content_type = "joke"
+    
+    if chat_id is None:
+        text = _random_text(content_type)
+    else:
+        item = await shuffle_bag.draw(chat_id, content_store.fun_content, category=content_type)
+        text = item["text"] if item else None
+    
+    return {
+        "content": text,
+        "type": content_type,
+        "emoji": CONTENT_EMOJI[content_type]
+    }
\ No newline at end of file
@@ -1,15 +1,18 @@
-import asyncio
 import logging
 from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.dispatcher import FSMContext
-import aiojobs
-import datetime
-import random
 import handlers
 
-from config import BOT_TOKEN, TOKEN, BOT_USERNAME, ADMIN_ID
-from database import init_db, db
+from config import (BOT_TOKEN, TOKEN, BOT_USERNAME, ADMIN_ID, BOT_MODE, TELEGRAM_API_URL, INACTIVE_CHECK_HOUR, WEEKLY_REPORT_HOUR,
+                    ACTIVE_USER_HOUR, RANDOM_QUESTION_HOURS)
+from database import init_db, close_db, db
+from outbox import OutboxDispatcher
+from scheduler import Scheduler, DailyRandomTime, cron
+from chat_schedule import due_chats, pending_chats, mark_chats_done, last_daily, last_weekly
+from webhook import run_webhook
+from routing import RoutedDispatcher
+from fsm_storage import SQLiteStorage
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,15 +22,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
+if TELEGRAM_API_URL:
+    # Например, локальная заглушка Bot API для тестов
+    bot = Bot(token=TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+else:
+    bot = Bot(token=TOKEN)
+# Состояния FSM (игры, создание событий) хранятся в SQLite и переживают перезапуск
+storage = SQLiteStorage()
+# Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+dp = RoutedDispatcher(bot, storage=storage)
 
 # Импортируем модули после инициализации бота
 # Важно импортировать здесь, чтобы избежать циклических зависимостей
-from games import cmd_emoji_game, cmd_quiz, cmd_end_game, cmd_set_cooldown, GameStates, process_emoji_answer, process_quiz_answer
+from games import cmd_emoji_game, cmd_quiz, cmd_end_game, cmd_set_cooldown, GameStates, process_emoji_answer, process_quiz_answer, game_tracker, GameTimeouts
 from handlers import (cmd_start, cmd_help, cmd_stats, cmd_top, cmd_challenge, cmd_game_stats, 
-                     cmd_chat_info, cmd_admin, cmd_send_to_all, cmd_check_inactive, cmd_send_report, 
+                     cmd_chat_info, cmd_chat_settings, cmd_admin, cmd_send_to_all, cmd_check_inactive, cmd_send_report, 
                      cmd_send_daily_topic, cmd_active_user_of_day, cmd_empty, on_new_chat_member, on_left_chat_member, process_message,
                      cmd_send_random_question, cmd_question_stats, cmd_clean_inactive_users,
                      # Новые команды
@@ -35,7 +44,7 @@ from handlers import (cmd_start, cmd_help, cmd_stats, cmd_top, cmd_challenge, cm
                      cmd_schedule, cmd_create_event, cmd_cancel_event_creation,
                      process_event_title, process_event_description, process_event_date, process_event_time,
                      process_event_confirmation, cmd_view_event, cmd_join_event, cmd_leave_event, cmd_delete_event,
-                     ScheduleStates, send_event_notifications, schedule_event_notifications, cmd_add_points,
+                     ScheduleStates, send_event_notifications, cmd_add_points,
                      cmd_remove_user)
 
 # Устанавливаем экземпляр бота в модуль handlers
@@ -74,142 +83,89 @@ async def remove_bot_commands():
     await bot.delete_my_commands()
     logger.info("Команды бота успешно удалены")
 
-# Глобальный планировщик для регулярных задач
-scheduler = None
-
-# Запуск проверки неактивных пользователей по расписанию
-async def schedule_inactive_reminders():
-    """Планировщик для регулярной проверки неактивных пользователей"""
-    while True:
-        try:
-            # Получаем текущее время
-            now = datetime.datetime.now()
-            # Добавляем смещение для перевода в астанинское время (UTC+6)
-            astana_time = now + datetime.timedelta(hours=6)
-            
-            # Запускаем проверку неактивных пользователей каждый день в 10:00 по Астане
-            if astana_time.hour == 10 and astana_time.minute == 0:
-                logger.info("Запуск проверки неактивных пользователей по расписанию (10:00 по Астане)")
-                await handlers.check_inactive_users(bot)
-            
-            # Ждем 60 секунд до следующей проверки
-            await asyncio.sleep(60)
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике проверки неактивных пользователей: {e}")
-            await asyncio.sleep(60)  # В случае ошибки также ждем 60 секунд
-
-# Запуск еженедельного отчета по расписанию
-async def schedule_weekly_reports():
-    """Планировщик для отправки еженедельного отчета об активности"""
-    while True:
-        try:
-            # Получаем текущее время и день недели
-            now = datetime.datetime.now()
-            # Добавляем смещение для перевода в астанинское время (UTC+6)
-            astana_time = now + datetime.timedelta(hours=6)
-            
-            # Отправляем отчет каждый понедельник в 9:00 по Астане
-            if astana_time.weekday() == 0 and astana_time.hour == 9 and astana_time.minute == 0:
-                logger.info("Запуск отправки еженедельного отчета по расписанию (9:00 понедельник по Астане)")
-                await handlers.send_weekly_report(bot)
-            
-            # Ждем 60 секунд до следующей проверки
-            await asyncio.sleep(60)
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике еженедельных отчетов: {e}")
-            await asyncio.sleep(60)  # В случае ошибки также ждем 60 секунд
-
-# Запуск ежедневной темы для обсуждения по расписанию
-async def schedule_daily_topics():
-    """Планировщик для отправки ежедневной темы для обсуждения"""
-    while True:
-        try:
-            # Получаем текущее время
-            now = datetime.datetime.now()
-            # Добавляем смещение для перевода в астанинское время (UTC+6)
-            astana_time = now + datetime.timedelta(hours=6)
-            
-            # Отправляем тему для обсуждения каждый день в 12:00 по Астане
-            if astana_time.hour == 12 and astana_time.minute == 0:
-                logger.info("Запуск отправки ежедневной темы для обсуждения по расписанию (12:00 по Астане)")
-                await handlers.send_daily_topic(bot)
-            
-            # Ждем 60 секунд до следующей проверки
-            await asyncio.sleep(60)
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике ежедневных тем: {e}")
-            await asyncio.sleep(60)  # В случае ошибки также ждем 60 секунд
-
-# Запуск определения активного пользователя дня по расписанию
-async def schedule_active_user_of_day():
-    """Планировщик для определения и объявления активного пользователя дня"""
-    while True:
-        try:
-            # Получаем текущее время
-            now = datetime.datetime.now()
-            # Добавляем смещение для перевода в астанинское время (UTC+6)
-            astana_time = now + datetime.timedelta(hours=6)
-            
-            # Определяем активного пользователя каждый день в 20:00 по Астане
-            if astana_time.hour == 20 and astana_time.minute == 0:
-                logger.info("Запуск определения активного пользователя дня по расписанию (20:00 по Астане)")
-                await handlers.send_active_user_of_the_day(bot)
-            
-            # Ждем 60 секунд до следующей проверки
-            await asyncio.sleep(60)
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике активного пользователя дня: {e}")
-            await asyncio.sleep(60)  # В случае ошибки также ждем 60 секунд
-
-# Запуск отправки случайных вопросов дня
-async def schedule_random_questions():
-    """Планировщик для отправки случайных вопросов дня в случайное время"""
-    while True:
-        try:
-            # Получаем текущее время
-            now = datetime.datetime.now()
-            # Добавляем смещение для перевода в астанинское время (UTC+6)
-            astana_time = now + datetime.timedelta(hours=6)
-            
-            # Определяем случайные часы для отправки (с 10:00 до 19:00 по Астане)
-            # Это генерируется один раз в день и затем используется весь день
-            # Используем день года как seed для воспроизводимости
-            day_of_year = astana_time.timetuple().tm_yday
-            random.seed(day_of_year)
-            random_hour = random.randint(10, 19)
-            random_minute = random.randint(0, 59)
-            
-            # Сбрасываем seed для других случайных операций
-            random.seed()
-            
-            logger.debug(f"Сегодня случайный вопрос будет отправлен в {random_hour}:{random_minute:02d} по Астане")
-            
-            # Отправляем вопрос в определенное случайное время по Астане
-            if astana_time.hour == random_hour and astana_time.minute == random_minute:
-                logger.info(f"Запуск отправки случайного вопроса дня по расписанию в {astana_time.hour}:{astana_time.minute:02d} по Астане")
-                await handlers.send_random_question(bot)
-            
-            # Ждем 60 секунд до следующей проверки
-            await asyncio.sleep(60)
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике случайных вопросов дня: {e}")
-            await asyncio.sleep(60)  # В случае ошибки также ждем 60 секунд
-
-# Планировщик проверки активности чатов
-async def schedule_chat_activity_check():
-    """Планировщик для проверки активности в чатах и вызова случайных пользователей"""
-    while True:
-        try:
-            logger.debug("Проверка активности в чатах")
-            
-            # Запускаем проверку каждые 15 минут
-            await handlers.invite_random_users_to_chat(bot)
-            
-            # Ждем 15 минут до следующей проверки
-            await asyncio.sleep(15 * 60)  # 15 минут
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике проверки активности чатов: {e}")
-            await asyncio.sleep(60)  # В случае ошибки ждем 1 минуту
+# Диспетчер очереди исходящих сообщений
+outbox_dispatcher = OutboxDispatcher(bot)
+
+# Закрытие раундов игр по истечении GAME_ROUND_TIMEOUT: одна задача на все чаты
+game_timeouts = GameTimeouts(dp)
+
+# Планировщик регулярных задач; последние запуски хранятся в таблице scheduled_jobs.
+# Задачи для чатов запускаются каждый час и отправляют рассылку тем чатам, у которых по их
+# часовому поясу уже наступило время отправки, а текущий период еще не выполнен
+scheduler = Scheduler(store=db)
+
+# Отправка задачи job чатам, у которых наступил и еще не выполнен период: пропущенные
+# из-за перезапуска отправки выполняются при следующем запуске, ровно один раз за период
+async def run_chat_job(job, fire_time, send_time, period_key, send):
+    for run_id, chat_ids in await pending_chats(job, scheduler.now(), send_time, period_key):
+        await send(run_id, chat_ids)
+        await mark_chats_done(job, run_id, chat_ids)
+
+day_key = lambda send_time: send_time.strftime('%Y-%m-%d')
+
+# Проверка неактивных пользователей каждый день в INACTIVE_CHECK_HOUR по времени чата
+async def job_inactive_reminders(fire_time):
+    await run_chat_job(
+        'inactive_reminders', fire_time,
+        lambda chat, local: last_daily(local, INACTIVE_CHECK_HOUR), day_key,
+        lambda run_id, chat_ids: handlers.check_inactive_users(bot, chat_ids=chat_ids)
+    )
+
+# Еженедельный отчет в день недели чата в WEEKLY_REPORT_HOUR
+async def job_weekly_report(fire_time):
+    await run_chat_job(
+        'weekly_report', fire_time,
+        lambda chat, local: last_weekly(local, chat.report_day, WEEKLY_REPORT_HOUR),
+        lambda send_time: send_time.strftime('%G-W%V'),
+        lambda run_id, chat_ids: handlers.send_weekly_report(bot, run_id=run_id, chat_ids=chat_ids)
+    )
+
+# Тема для обсуждения каждый день в час, заданный для чата
+async def job_daily_topic(fire_time):
+    await run_chat_job(
+        'daily_topic', fire_time,
+        lambda chat, local: last_daily(local, chat.daily_topic_hour), day_key,
+        lambda run_id, chat_ids: handlers.send_daily_topic(bot, run_id=run_id, chat_ids=chat_ids)
+    )
+
+# Активный пользователь дня каждый день в ACTIVE_USER_HOUR по времени чата
+async def job_active_user_of_day(fire_time):
+    await run_chat_job(
+        'active_user_of_day', fire_time,
+        lambda chat, local: last_daily(local, ACTIVE_USER_HOUR), day_key,
+        lambda run_id, chat_ids: handlers.send_active_user_of_the_day(bot, run_id=run_id, chat_ids=chat_ids)
+    )
+
+# Вопрос дня в случайное время из RANDOM_QUESTION_HOURS, одно и то же для всего дня в часовом поясе
+def random_question_time(local_time):
+    """Последнее наступившее к local_time время вопроса дня"""
+    return DailyRandomTime(*RANDOM_QUESTION_HOURS, tz=local_time.tzinfo).last_until(local_time)
+
+# Задача запускается каждую минуту и не ждет внутри себя: вопрос получают чаты, у которых
+# по их часовому поясу наступило выбранное на сегодня время
+async def job_random_question(fire_time):
+    await run_chat_job(
+        'random_question', fire_time,
+        lambda chat, local: random_question_time(local), day_key,
+        lambda run_id, chat_ids: handlers.send_random_question(bot, run_id=run_id, chat_ids=chat_ids)
+    )
+
+# Уведомления о предстоящих событиях каждые 30 минут
+async def job_event_notifications(fire_time):
+    await send_event_notifications(bot)
+
+# Проверка активности в чатах и вызов случайных пользователей каждые 15 минут, кроме тихих часов
+async def job_chat_activity_check(fire_time):
+    for local_time, chat_ids in await due_chats(fire_time, lambda chat, local: True):
+        await handlers.invite_random_users_to_chat(bot, chat_ids=chat_ids)
+
+scheduler.add_job('inactive_reminders', cron('0 * * * *'), job_inactive_reminders)
+scheduler.add_job('weekly_report', cron('0 * * * *'), job_weekly_report)
+scheduler.add_job('daily_topic', cron('0 * * * *'), job_daily_topic)
+scheduler.add_job('active_user_of_day', cron('0 * * * *'), job_active_user_of_day)
+scheduler.add_job('random_question', cron('* * * * *'), job_random_question)
+scheduler.add_job('event_notifications', cron('*/30 * * * *'), job_event_notifications)
+scheduler.add_job('chat_activity_check', cron('*/15 * * * *'), job_chat_activity_check, catch_up=False)
 
 # Прямая регистрация игровых обработчиков
 logger.info("Регистрация игровых обработчиков...")
@@ -261,6 +217,7 @@ dp.register_message_handler(cmd_delete_event, regexp=r"^/delete_event_\d+$")
 
 # Административные команды
 dp.register_message_handler(cmd_chat_info, commands=["chat_info"])
+dp.register_message_handler(cmd_chat_settings, commands=["chat_settings"])
 dp.register_message_handler(cmd_admin, commands=["admin"])
 dp.register_message_handler(cmd_send_to_all, commands=["send_to_all"])
 dp.register_message_handler(cmd_remove_user, commands=["remove_user"])
@@ -291,6 +248,18 @@ async def on_startup(dispatcher):
     logger.info("Инициализация базы данных...")
     await init_db()
     
+    # Ограничения на запуск игр, действовавшие до перезапуска
+    await game_tracker.cooldowns.load()
+    
+    # Отправка сообщений, оставшихся в очереди после прошлого запуска, и всех новых рассылок
+    outbox_dispatcher.start()
+    
+    # Обработчики обновлений по чатам
+    dispatcher.router.start()
+    
+    # Закрытие раундов игр, на которые не ответили вовремя
+    game_timeouts.start()
+    
     logger.info("Установка команд бота...")
     await set_bot_commands()
     
@@ -307,17 +276,7 @@ async def on_startup(dispatcher):
         logger.info(f"Зарегистрированная команда: /{cmd.command} - {cmd.description}")
     
     # Запуск планировщика для регулярных задач
-    global scheduler
-    scheduler = await aiojobs.create_scheduler()
-    
-    # Добавляем регулярные задачи в планировщик
-    await scheduler.spawn(schedule_inactive_reminders())
-    await scheduler.spawn(schedule_weekly_reports())
-    await scheduler.spawn(schedule_daily_topics())
-    await scheduler.spawn(schedule_active_user_of_day())
-    await scheduler.spawn(schedule_random_questions())
-    await scheduler.spawn(schedule_event_notifications())
-    await scheduler.spawn(schedule_chat_activity_check())
+    await scheduler.start()
     
     logger.info("Планировщик регулярных задач успешно запущен")
 
@@ -325,16 +284,29 @@ async def on_shutdown(dispatcher):
     """Действия при остановке бота"""
     logger.warning("Завершение работы...")
     
-    # Закрываем планировщик
-    if scheduler:
-        await scheduler.close()
+    # Дорабатываем уже принятые обновления
+    await dispatcher.router.stop()
+    
+    # Останавливаем планировщик и закрытие раундов игр
+    await scheduler.stop()
+    await game_timeouts.stop()
+    
+    # Останавливаем диспетчер очереди, неотправленные сообщения уйдут после перезапуска
+    await outbox_dispatcher.stop()
+    
+    # Записываем несохраненные состояния FSM, пока база открыта
+    await storage.close()
+    
+    # Записываем новые ограничения на запуск игр
+    await game_tracker.cooldowns.close()
+    
+    # Закрываем пул соединений с базой данных
+    await close_db()
     
-    logger.info("Планировщик остановлен")
     logger.info("Бот остановлен")
     
     # Закрываем соединения и сессии
     await bot.close()
-    await storage.close()
 
 # Добавление отладочного обработчика в самом конце, с низким приоритетом
 @dp.message_handler(lambda message: True, content_types=types.ContentTypes.ANY)
@@ -344,9 +316,13 @@ async def debug_all_messages(message: types.Message):
     logger.warning(f"Тип чата: {message.chat.type}, ID чата: {message.chat.id}")
 
 if __name__ == '__main__':
-    executor.start_polling(
-        dp,
-        on_startup=on_startup,
-        on_shutdown=on_shutdown,
-        skip_updates=True
-    ) 
\ No newline at end of file
+    if BOT_MODE == 'webhook':
+        # Обновления принимает веб-сервер; накопившиеся за время простоя не сбрасываются
+        run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(
+            dp,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=True
+        ) 
\ No newline at end of file
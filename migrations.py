@@ -0,0 +1,344 @@
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Пересчет суточной сводки из истории активности; {where} ограничивает пересчитываемые записи
+ACTIVITY_DAILY_BACKFILL = '''
+    INSERT OR REPLACE INTO activity_daily (
+        chat_id, user_id, day, messages, points,
+        text_count, long_text_count, media_count, reply_count,
+        question_count, game_count, other_count
+    )
+    SELECT chat_id, user_id, date(timestamp), COUNT(*), COALESCE(SUM(points), 0),
+           COUNT(CASE WHEN message_type = 'text' THEN 1 END),
+           COUNT(CASE WHEN message_type = 'long_text' THEN 1 END),
+           COUNT(CASE WHEN message_type = 'media' THEN 1 END),
+           COUNT(CASE WHEN message_type = 'reply' THEN 1 END),
+           COUNT(CASE WHEN message_type = 'question_response' THEN 1 END),
+           COUNT(CASE WHEN message_type IN ('emoji_game', 'quiz') THEN 1 END),
+           COUNT(CASE WHEN COALESCE(message_type, '') NOT IN ('text', 'long_text', 'media', 'reply', 'question_response', 'emoji_game', 'quiz') THEN 1 END)
+    FROM activity
+    WHERE {where}
+    GROUP BY chat_id, user_id, date(timestamp)
+'''
+
+# Пронумерованные миграции схемы: (версия, описание, список SQL-выражений).
+# Уже примененные миграции не меняются, изменения схемы добавляются новой версией в конец списка.
+MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        '''
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            message_type TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            points REAL DEFAULT 0,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ranks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            min_points INTEGER,
+            max_points INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            message_id INTEGER,
+            question TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS question_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id INTEGER,
+            user_id INTEGER,
+            points_awarded REAL DEFAULT 0,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (question_id) REFERENCES daily_questions (id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    ]),
+    (2, "Колонка current_rank в таблице users", [
+        'ALTER TABLE users ADD COLUMN current_rank TEXT DEFAULT "🔍 Искатель"',
+    ]),
+    (3, "Таблицы итогов пользователей с заполнением из истории активности", [
+        # Итоги пользователя в чате, обновляются при каждой записи активности
+        '''
+        CREATE TABLE IF NOT EXISTS user_chat_totals (
+            chat_id INTEGER,
+            user_id INTEGER,
+            points REAL DEFAULT 0,
+            messages INTEGER DEFAULT 0,
+            last_active TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        ''',
+        # Глобальные итоги пользователя по всем чатам (для рангов)
+        '''
+        CREATE TABLE IF NOT EXISTS user_totals (
+            user_id INTEGER PRIMARY KEY,
+            points REAL DEFAULT 0,
+            messages INTEGER DEFAULT 0,
+            last_active TIMESTAMP
+        )
+        ''',
+        '''
+        INSERT OR IGNORE INTO user_chat_totals (chat_id, user_id, points, messages, last_active)
+        SELECT chat_id, user_id, COALESCE(SUM(points), 0), COUNT(*), MAX(timestamp)
+        FROM activity
+        GROUP BY chat_id, user_id
+        ''',
+        '''
+        INSERT OR IGNORE INTO user_totals (user_id, points, messages, last_active)
+        SELECT user_id, SUM(points), SUM(messages), MAX(last_active)
+        FROM user_chat_totals
+        GROUP BY user_id
+        ''',
+    ]),
+    (4, "Индексы для запросов по активности и вопросам дня", [
+        # Статистика и удаление пользователя в чате, подсчет активности по типу
+        'CREATE INDEX IF NOT EXISTS idx_activity_chat_user ON activity (chat_id, user_id, message_type)',
+        # Отчеты за период: покрывает COUNT, SUM(points) и группировку по пользователю
+        'CREATE INDEX IF NOT EXISTS idx_activity_chat_time ON activity (chat_id, timestamp, user_id, points)',
+        # Пересчет глобальных итогов пользователя
+        'CREATE INDEX IF NOT EXISTS idx_activity_user ON activity (user_id)',
+        # Поиск вопроса дня по ответному сообщению
+        'CREATE INDEX IF NOT EXISTS idx_daily_questions_chat_message ON daily_questions (chat_id, message_id)',
+        # Проверка повторного ответа и подсчет ответов на вопрос
+        'CREATE INDEX IF NOT EXISTS idx_question_responses_question_user ON question_responses (question_id, user_id)',
+    ]),
+    (5, "Таблица служебных значений", [
+        # Ключ-значение для служебных данных, например хэша списка рангов
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    ]),
+    (6, "Суточная сводка активности с заполнением из истории", [
+        # Одна строка на пользователя в чате за день (UTC), обновляется вместе с записью активности
+        '''
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            chat_id INTEGER,
+            user_id INTEGER,
+            day TEXT,
+            messages INTEGER DEFAULT 0,
+            points REAL DEFAULT 0,
+            text_count INTEGER DEFAULT 0,
+            long_text_count INTEGER DEFAULT 0,
+            media_count INTEGER DEFAULT 0,
+            reply_count INTEGER DEFAULT 0,
+            question_count INTEGER DEFAULT 0,
+            game_count INTEGER DEFAULT 0,
+            other_count INTEGER DEFAULT 0,
+            PRIMARY KEY (chat_id, day, user_id)
+        )
+        ''',
+        ACTIVITY_DAILY_BACKFILL.format(where='1'),
+    ]),
+    (7, "Очередь исходящих сообщений", [
+        # Сообщения рассылок ставятся в очередь и отправляются диспетчером, ключ защищает от повторной постановки
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            kind TEXT,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            message_id INTEGER,
+            last_error TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, not_before, id)',
+    ]),
+    (8, "Состояние регулярных задач планировщика", [
+        # Последний и следующий запуск каждой задачи, чтобы после перезапуска не повторять и не пропускать запуски
+        '''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            last_run TIMESTAMP,
+            next_run TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'idle',
+            last_error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (9, "Настройки расписания чатов", [
+        # Пустое значение означает настройку по умолчанию из config
+        '''
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id INTEGER PRIMARY KEY,
+            timezone TEXT,
+            daily_topic_hour INTEGER,
+            report_day INTEGER,
+            quiet_start INTEGER,
+            quiet_end INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
+        )
+        ''',
+    ]),
+    (10, "Хранилище состояний FSM", [
+        # Состояние, данные и bucket пользователя в чате; данные хранятся в JSON
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            chat_id INTEGER,
+            user_id INTEGER,
+            state TEXT,
+            data TEXT,
+            bucket TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        ''',
+        # Удаление брошенных состояний по времени последнего изменения
+        'CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated_at)',
+    ]),
+    (11, "Ограничения на запуск игр", [
+        # Время последнего запуска игры пользователем в чате; истекшие записи удаляются
+        '''
+        CREATE TABLE IF NOT EXISTS game_cooldowns (
+            chat_id INTEGER,
+            user_id INTEGER,
+            game_type TEXT,
+            started_at TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_game_cooldowns_started ON game_cooldowns (started_at)',
+    ]),
+    (12, "Выборка контента без повторов", [
+        # Курсор по псевдослучайной перестановке набора контента: seed задает перестановку,
+        # position - сколько элементов уже выдано чату, size - размер набора на момент начала круга
+        '''
+        CREATE TABLE IF NOT EXISTS content_cursors (
+            pool TEXT,
+            chat_id INTEGER,
+            seed INTEGER,
+            position INTEGER,
+            size INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (pool, chat_id)
+        )
+        ''',
+    ]),
+    (13, "Выполненные периоды задач по чатам", [
+        # Последний период (день, неделя), за который задача уже выполнена для чата:
+        # после перерыва в работе пропущенные периоды выполняются ровно один раз
+        '''
+        CREATE TABLE IF NOT EXISTS chat_job_runs (
+            job TEXT,
+            chat_id INTEGER,
+            run_id TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job, chat_id)
+        )
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def _is_duplicate_column(error):
+    """Колонка уже добавлена старым кодом до появления миграций"""
+    return 'duplicate column name' in str(error)
+
+
+def _pending(current_version):
+    return [migration for migration in MIGRATIONS if migration[0] > current_version]
+
+
+async def apply_migrations(db):
+    """Применяет недостающие миграции через соединение aiosqlite, возвращает версию схемы"""
+    await db.execute(SCHEMA_VERSION_TABLE)
+    cursor = await db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    current_version = (await cursor.fetchone())[0]
+
+    for version, description, statements in _pending(current_version):
+        # Каждая миграция выполняется в своей транзакции вместе с записью версии
+        await db.execute('BEGIN')
+        try:
+            for statement in statements:
+                try:
+                    await db.execute(statement)
+                except sqlite3.OperationalError as e:
+                    if not _is_duplicate_column(e):
+                        raise
+            await db.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        logger.info(f"Применена миграция {version}: {description}")
+        current_version = version
+
+    return current_version
+
+
+def apply_migrations_sync(conn):
+    """Применяет недостающие миграции через соединение sqlite3, возвращает версию схемы"""
+    conn.execute(SCHEMA_VERSION_TABLE)
+    current_version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+    for version, description, statements in _pending(current_version):
+        conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError as e:
+                    if not _is_duplicate_column(e):
+                        raise
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Применена миграция {version}: {description}")
+        current_version = version
+
+    return current_version
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+
+from broadcast import Broadcaster
+from config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, OUTBOX_RETENTION_DAYS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Обработчики, вызываемые после доставки сообщения определенного вида: kind -> coroutine(item, message)
+_sent_hooks = {}
+
+# Запущенный диспетчер, которого нужно будить при постановке новых сообщений
+_active_dispatcher = None
+
+
+def on_sent(kind):
+    """Декоратор: регистрирует обработчик, который вызывается после доставки сообщения вида kind"""
+    def decorator(handler):
+        _sent_hooks[kind] = handler
+        return handler
+    return decorator
+
+
+def outbox_message(idempotency_key, chat_id, text, parse_mode=None, kind=None, payload=None):
+    """Формирует сообщение для постановки в очередь"""
+    return {
+        'idempotency_key': idempotency_key,
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': parse_mode,
+        'kind': kind,
+        'payload': payload
+    }
+
+
+async def enqueue(messages):
+    """
+    Ставит сообщения в очередь отправки и будит диспетчер
+
+    Повторная постановка сообщения с тем же idempotency_key ничего не делает,
+    поэтому перезапуск задачи после сбоя не приводит к дублям.
+
+    Returns:
+        int: количество новых сообщений в очереди
+    """
+    added = await db.enqueue_outbox(messages)
+    if added and _active_dispatcher is not None:
+        _active_dispatcher.wake()
+    logger.info(f"В очередь отправки добавлено {added} сообщений из {len(messages)}")
+    return added
+
+
+class OutboxDispatcher:
+    """Фоновая отправка сообщений из таблицы outbox пакетами через Broadcaster"""
+
+    def __init__(self, bot, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._task = None
+        self._wakeup = None
+
+    def start(self):
+        """Запускает диспетчер; после перезапуска он продолжает отправку неотправленных сообщений"""
+        global _active_dispatcher
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+            _active_dispatcher = self
+
+    async def stop(self):
+        """Останавливает диспетчер; недоставленные сообщения остаются в очереди до следующего запуска"""
+        global _active_dispatcher
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if _active_dispatcher is self:
+            _active_dispatcher = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_prune = 0
+        while True:
+            try:
+                if loop.time() >= next_prune:
+                    removed = await db.prune_outbox(OUTBOX_RETENTION_DAYS)
+                    if removed:
+                        logger.info(f"Из очереди отправки удалено {removed} старых сообщений")
+                    next_prune = loop.time() + 3600
+
+                # Пока в очереди есть готовые сообщения, отправляем их без пауз
+                while await self.dispatch_batch():
+                    pass
+            except Exception as e:
+                logger.error(f"Ошибка в диспетчере очереди отправки: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def dispatch_batch(self):
+        """Отправляет один пакет сообщений из очереди, возвращает количество обработанных"""
+        items = await db.fetch_outbox_batch(self.batch_size)
+        if not items:
+            return 0
+
+        # Сообщения одного чата отправляются по порядку, разные чаты - параллельно
+        chats = {}
+        for item in items:
+            chats.setdefault(item['chat_id'], []).append(item)
+
+        sent, retry, failed, blocked = [], [], [], []
+
+        async def send_chat(broadcaster, chat_items):
+            for item in chat_items:
+                message = await broadcaster.send_message(
+                    item['chat_id'], item['text'], parse_mode=item['parse_mode']
+                )
+                if message:
+                    sent.append((item['id'], message.message_id))
+                    hook = _sent_hooks.get(item['kind'])
+                    if hook:
+                        try:
+                            await hook(item, message)
+                        except Exception as e:
+                            logger.error(f"Ошибка обработчика после отправки сообщения {item['id']}: {e}")
+                    continue
+
+                if item['chat_id'] in broadcaster.result.blocked_chats:
+                    # В этот чат писать больше нельзя: закрываем все его сообщения из пакета
+                    blocked.extend(rest['id'] for rest in chat_items[chat_items.index(item):])
+                elif item['attempts'] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                    failed.append((item['id'], 'превышено число попыток отправки'))
+                    continue
+                else:
+                    retry.append((item['id'], OUTBOX_RETRY_DELAY * 2 ** item['attempts'], 'ошибка отправки'))
+                # Остальные сообщения чата ждут, чтобы не нарушить порядок
+                return
+
+        result = await Broadcaster(self.bot).run(list(chats.values()), send_chat)
+        await db.complete_outbox_batch(sent, retry, failed, blocked)
+        # Следующие сообщения перенесенных чатов должны уходить сразу по новому ID
+        for old_chat_id, new_chat_id in result.migrated_chats.items():
+            await db.migrate_chat(old_chat_id, new_chat_id)
+        logger.info(f"Обработан пакет очереди отправки: {len(items)} сообщений ({result})")
+        return len(items)
@@ -0,0 +1,132 @@
+import hashlib
+import json
+
+# Единственный источник рангов: (название, min_points, max_points).
+# Используется ботом и restore_db.py, в базу попадает только при изменении списка.
+RANKS = [
+    # Уровень 1: 0-99 очков
+    ('🔍 Искатель', 0, 99),
+    # Уровень 2: 100-249 очков
+    ('👣 Путник', 100, 249),
+    # Уровень 3: 250-499 очков
+    ('📚 Ученик', 250, 499),
+    # Уровень 4: 500-749 очков
+    ('⚔️ Воин чата', 500, 749),
+    # Уровень 5: 750-999 очков
+    ('🧙 Подмастерье', 750, 999),
+    # Уровень 6: 1000-1499 очков
+    ('🏹 Следопыт', 1000, 1499),
+    # Уровень 7: 1500-1999 очков
+    ('🛡️ Защитник', 1500, 1999),
+    # Уровень 8: 2000-2499 очков
+    ('🔮 Мистик', 2000, 2499),
+    # Уровень 9: 2500-2999 очков
+    ('🧠 Мудрец', 2500, 2999),
+    # Уровень 10: 3000-3499 очков
+    ('⚡ Элементалист', 3000, 3499),
+    # Уровень 11: 3500-3999 очков
+    ('🌙 Ночной клинок', 3500, 3999),
+    # Уровень 12: 4000-4499 очков
+    ('🌿 Хранитель рощи', 4000, 4499),
+    # Уровень 13: 4500-4999 очков
+    ('⛏️ Мастер-кузнец', 4500, 4999),
+    # Уровень 14: 5000-5999 очков
+    ('🐉 Укротитель драконов', 5000, 5999),
+    # Уровень 15: 6000-6999 очков
+    ('🧝 Древний эльф', 6000, 6999),
+    # Уровень 16: 7000-7999 очков
+    ('🌋 Повелитель огня', 7000, 7999),
+    # Уровень 17: 8000-8999 очков
+    ('❄️ Хозяин льда', 8000, 8999),
+    # Уровень 18: 9000-9999 очков
+    ('🌪️ Властелин бури', 9000, 9999),
+    # Уровень 19: 10000-11999 очков
+    ('🏰 Командир крепости', 10000, 11999),
+    # Уровень 20: 12000-13999 очков
+    ('👑 Правитель провинции', 12000, 13999),
+    # Уровень 21: 14000-15999 очков
+    ('💎 Собиратель артефактов', 14000, 15999),
+    # Уровень 22: 16000-19999 очков
+    ('🌟 Звездный маг', 16000, 19999),
+    # Уровень 23: 20000-23999 очков
+    ('🔱 Морской владыка', 20000, 23999),
+    # Уровень 24: 24000-27999 очков
+    ('⚜️ Королевский рыцарь', 24000, 27999),
+    # Уровень 25: 28000-31999 очков
+    ('🧿 Хранитель тайн', 28000, 31999),
+    # Уровень 26: 32000-35999 очков
+    ('🌓 Повелитель теней', 32000, 35999),
+    # Уровень 27: 36000-39999 очков
+    ('☀️ Солнечный чемпион', 36000, 39999),
+    # Уровень 28: 40000-44999 очков
+    ('🦅 Небесный страж', 40000, 44999),
+    # Уровень 29: 45000-49999 очков
+    ('🦁 Воин света', 45000, 49999),
+    # Уровень 30: 50000-59999 очков
+    ('🏆 Легендарный герой', 50000, 59999),
+    # Уровень 31: 60000-69999 очков
+    ('👁️ Всевидящий', 60000, 69999),
+    # Уровень 32: 70000-79999 очков
+    ('💫 Космический странник', 70000, 79999),
+    # Уровень 33: 80000-89999 очков
+    ('🌈 Хранитель миров', 80000, 89999),
+    # Уровень 34: 90000-99999 очков
+    ('🧚 Бессмертный архимаг', 90000, 99999),
+    # Уровень 35: 100000-124999 очков
+    ('🔥 Аватар феникса', 100000, 124999),
+    # Уровень 36: 125000-149999 очков
+    ('🌌 Повелитель вселенной', 125000, 149999),
+    # Уровень 37: 150000-199999 очков
+    ('⭐ Астральный владыка', 150000, 199999),
+    # Уровень 38: 200000-249999 очков
+    ('🌠 Пожиратель звезд', 200000, 249999),
+    # Уровень 39: 250000-299999 очков
+    ('⚡ Хранитель вечности', 250000, 299999),
+    # Уровень 40: 300000-399999 очков
+    ('💫 Творец реальности', 300000, 399999),
+    # Уровень 41: 400000-499999 очков
+    ('🌞 Солнцеликий', 400000, 499999),
+    # Уровень 42: 500000-749999 очков
+    ('🌑 Лунный оракул', 500000, 749999),
+    # Уровень 43: 750000-999999 очков
+    ('🌀 Повелитель времени', 750000, 999999),
+    # Уровень 44: 1000000+ очков
+    ('✨ Божественная сущность', 1000000, 1000000000),
+]
+
+# Хэш содержимого списка, по нему определяется, нужно ли перезаписывать таблицу ranks
+RANKS_HASH = hashlib.sha256(json.dumps(RANKS, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+SELECT_RANKS_HASH = "SELECT value FROM meta WHERE key = 'ranks_hash'"
+UPSERT_RANKS_HASH = '''
+    INSERT INTO meta (key, value) VALUES ('ranks_hash', ?)
+    ON CONFLICT (key) DO UPDATE SET value = excluded.value
+'''
+INSERT_RANK = 'INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)'
+
+
+async def seed_ranks(db):
+    """Записывает ранги через соединение aiosqlite, если список изменился. Возвращает True, если таблица обновлена"""
+    cursor = await db.execute(SELECT_RANKS_HASH)
+    row = await cursor.fetchone()
+    if row and row[0] == RANKS_HASH:
+        return False
+
+    await db.execute('DELETE FROM ranks')
+    await db.executemany(INSERT_RANK, RANKS)
+    await db.execute(UPSERT_RANKS_HASH, (RANKS_HASH,))
+    await db.commit()
+    return True
+
+
+def seed_ranks_sync(conn):
+    """Записывает ранги через соединение sqlite3, если список изменился. Возвращает True, если таблица обновлена"""
+    row = conn.execute(SELECT_RANKS_HASH).fetchone()
+    if row and row[0] == RANKS_HASH:
+        return False
+
+    conn.execute('DELETE FROM ranks')
+    conn.executemany(INSERT_RANK, RANKS)
+    conn.execute(UPSERT_RANKS_HASH, (RANKS_HASH,))
+    conn.commit()
+    return True
@@ -1,9 +1,11 @@
-import sqlite3
 import datetime
 import os
 import re
 import logging
 import random
+from migrations import apply_migrations_sync, ACTIVITY_DAILY_BACKFILL
+from ranks import seed_ranks_sync
+import storage
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -13,78 +15,11 @@ DB_PATH = 'activity_bot.db'
 
 def init_db():
     """Инициализирует базу данных, создает необходимые таблицы"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = storage.connect(DB_PATH)
     cursor = conn.cursor()
     
-    # Таблица чатов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS chats (
-        chat_id INTEGER PRIMARY KEY,
-        title TEXT,
-        joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Таблица пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        current_rank TEXT DEFAULT "🔍 Искатель"
-    )
-    ''')
-    
-    # Таблица активности
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS activity (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_id INTEGER,
-        user_id INTEGER,
-        message_type TEXT,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        points REAL DEFAULT 0,
-        FOREIGN KEY (chat_id) REFERENCES chats (chat_id),
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
-    
-    # Таблица рангов
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS ranks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE,
-        min_points INTEGER,
-        max_points INTEGER
-    )
-    ''')
-    
-    # Добавляем новую таблицу для отслеживания вопросов дня
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS daily_questions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_id INTEGER,
-        message_id INTEGER,
-        question TEXT,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
-    )
-    ''')
-    
-    # Добавляем новую таблицу для отслеживания ответов на вопросы
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS question_responses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        question_id INTEGER,
-        user_id INTEGER,
-        points_awarded REAL DEFAULT 0,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (question_id) REFERENCES daily_questions (id),
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
+    # Основные таблицы создаются теми же миграциями, что и в боте
+    apply_migrations_sync(conn)
     
     # Создаем таблицу для хранения событий
     cursor.execute('''
@@ -113,97 +48,8 @@ def init_db():
     )
     ''')
     
-    # Создаем/обновляем ранги
-    cursor.execute('DELETE FROM ranks')
-    
-    # Уровень 1: 0-99 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔍 Искатель', 0, 99))
-    # Уровень 2: 100-249 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('👣 Путник', 100, 249))
-    # Уровень 3: 250-499 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('📚 Ученик', 250, 499))
-    # Уровень 4: 500-749 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚔️ Воин чата', 500, 749))
-    # Уровень 5: 750-999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧙 Подмастерье', 750, 999))
-    # Уровень 6: 1000-1499 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🏹 Следопыт', 1000, 1499))
-    # Уровень 7: 1500-1999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🛡️ Защитник', 1500, 1999))
-    # Уровень 8: 2000-2499 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔮 Мистик', 2000, 2499))
-    # Уровень 9: 2500-2999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧠 Мудрец', 2500, 2999))
-    # Уровень 10: 3000-3499 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚡ Элементалист', 3000, 3499))
-    # Уровень 11: 3500-3999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌙 Ночной клинок', 3500, 3999))
-    # Уровень 12: 4000-4499 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌿 Хранитель рощи', 4000, 4499))
-    # Уровень 13: 4500-4999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⛏️ Мастер-кузнец', 4500, 4999))
-    # Уровень 14: 5000-5999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🐉 Укротитель драконов', 5000, 5999))
-    # Уровень 15: 6000-6999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧝 Древний эльф', 6000, 6999))
-    # Уровень 16: 7000-7999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌋 Повелитель огня', 7000, 7999))
-    # Уровень 17: 8000-8999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('❄️ Хозяин льда', 8000, 8999))
-    # Уровень 18: 9000-9999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌪️ Властелин бури', 9000, 9999))
-    # Уровень 19: 10000-11999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🏰 Командир крепости', 10000, 11999))
-    # Уровень 20: 12000-13999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('👑 Правитель провинции', 12000, 13999))
-    # Уровень 21: 14000-15999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('💎 Собиратель артефактов', 14000, 15999))
-    # Уровень 22: 16000-19999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌟 Звездный маг', 16000, 19999))
-    # Уровень 23: 20000-23999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔱 Морской владыка', 20000, 23999))
-    # Уровень 24: 24000-27999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚜️ Королевский рыцарь', 24000, 27999))
-    # Уровень 25: 28000-31999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧿 Хранитель тайн', 28000, 31999))
-    # Уровень 26: 32000-35999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌓 Повелитель теней', 32000, 35999))
-    # Уровень 27: 36000-39999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('☀️ Солнечный чемпион', 36000, 39999))
-    # Уровень 28: 40000-44999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🦅 Небесный страж', 40000, 44999))
-    # Уровень 29: 45000-49999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🦁 Воин света', 45000, 49999))
-    # Уровень 30: 50000-59999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🏆 Легендарный герой', 50000, 59999))
-    # Уровень 31: 60000-69999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('👁️ Всевидящий', 60000, 69999))
-    # Уровень 32: 70000-79999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('💫 Космический странник', 70000, 79999))
-    # Уровень 33: 80000-89999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌈 Хранитель миров', 80000, 89999))
-    # Уровень 34: 90000-99999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🧚 Бессмертный архимаг', 90000, 99999))
-    # Уровень 35: 100000-124999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🔥 Аватар феникса', 100000, 124999))
-    # Уровень 36: 125000-149999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌌 Повелитель вселенной', 125000, 149999))
-    # Уровень 37: 150000-199999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⭐ Астральный владыка', 150000, 199999))
-    # Уровень 38: 200000-249999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌠 Пожиратель звезд', 200000, 249999))
-    # Уровень 39: 250000-299999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('⚡ Хранитель вечности', 250000, 299999))
-    # Уровень 40: 300000-399999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('💫 Творец реальности', 300000, 399999))
-    # Уровень 41: 400000-499999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌞 Солнцеликий', 400000, 499999))
-    # Уровень 42: 500000-749999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌑 Лунный оракул', 500000, 749999))
-    # Уровень 43: 750000-999999 очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('🌀 Повелитель времени', 750000, 999999))
-    # Уровень 44: 1000000+ очков
-    cursor.execute('INSERT INTO ranks (name, min_points, max_points) VALUES (?, ?, ?)', ('✨ Божественная сущность', 1000000, 1000000000))
+    # Ранги берутся из общего списка и перезаписываются только при его изменении
+    seed_ranks_sync(conn)
     
     conn.commit()
     conn.close()
@@ -212,7 +58,7 @@ def init_db():
 
 def add_chat(chat_id, title):
     """Добавляет чат в базу данных"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = storage.connect(DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute(
@@ -227,7 +73,7 @@ def add_chat(chat_id, title):
 
 def add_user(user_id, username, first_name, current_rank):
     """Добавляет пользователя в базу данных"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = storage.connect(DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute(
@@ -242,7 +88,7 @@ def add_user(user_id, username, first_name, current_rank):
 
 def add_activity(chat_id, user_id, points, message_count):
     """Добавляет активность пользователя в базу данных"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = storage.connect(DB_PATH)
     cursor = conn.cursor()
     
     # Вычисляем среднее количество баллов за одно сообщение
@@ -282,6 +128,23 @@ def add_activity(chat_id, user_id, points, message_count):
             (chat_id, user_id, message_type, message_date, msg_points)
         )
     
+    # Пересчитываем итоги пользователя по записанной активности
+    cursor.execute('''
+        INSERT OR REPLACE INTO user_chat_totals (chat_id, user_id, points, messages, last_active)
+        SELECT chat_id, user_id, SUM(points), COUNT(*), MAX(timestamp)
+        FROM activity
+        WHERE chat_id = ? AND user_id = ?
+        GROUP BY chat_id, user_id
+    ''', (chat_id, user_id))
+    cursor.execute('''
+        INSERT OR REPLACE INTO user_totals (user_id, points, messages, last_active)
+        SELECT user_id, SUM(points), SUM(messages), MAX(last_active)
+        FROM user_chat_totals
+        WHERE user_id = ?
+        GROUP BY user_id
+    ''', (user_id,))
+    cursor.execute(ACTIVITY_DAILY_BACKFILL.format(where='chat_id = ? AND user_id = ?'), (chat_id, user_id))
+    
     conn.commit()
     conn.close()
     
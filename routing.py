@@ -0,0 +1,147 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher, types
+
+from config import UPDATE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# При такой длине очереди одного обработчика в лог пишется предупреждение
+QUEUE_WARNING_SIZE = 1000
+
+# Сколько ждать обработки накопившихся обновлений при остановке (в секундах)
+SHUTDOWN_TIMEOUT = 30
+
+
+def routing_key(update):
+    """Чат, к которому относится обновление; для обновлений без чата - пользователь"""
+    for event in (update.message, update.edited_message, update.channel_post, update.edited_channel_post,
+                  update.my_chat_member, update.chat_member):
+        if event is not None:
+            return event.chat.id
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for event in (update.inline_query, update.chosen_inline_result, update.shipping_query,
+                  update.pre_checkout_query, update.poll_answer):
+        if event is not None:
+            user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+            if user is not None:
+                return user.id
+    return update.update_id
+
+
+class UpdateRouter:
+    """
+    Распределяет обновления между workers обработчиками по ID чата.
+
+    Обновления разных чатов обрабатываются параллельно, а обновления одного чата -
+    строго по очереди одним обработчиком, поэтому порядок сообщений и шаги FSM
+    (игры, создание событий) не перемешиваются, а медленная команда в одном чате
+    не задерживает остальные.
+
+    Через submit_call() в ту же очередь ставятся и собственные действия бота с чатом
+    (например, завершение игры по времени), чтобы они не пересекались с обновлениями.
+
+    Обработчики запускаются явно через start() (в on_startup). После stop() новые
+    обновления не принимаются: aiogram вызывает on_shutdown раньше остановки polling,
+    и поздние обновления не должны обрабатываться, когда база уже закрыта.
+    """
+
+    def __init__(self, dispatcher, workers=UPDATE_WORKERS):
+        self.dispatcher = dispatcher
+        self.workers = max(1, workers)
+        self._queues = []
+        self._tasks = []
+        self._stopped = False
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopped = False
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.ensure_future(self._worker(queue)) for queue in self._queues]
+        logger.info(f"Запущено обработчиков обновлений: {self.workers}")
+
+    def submit(self, update):
+        """
+        Ставит обновление в очередь обработчика его чата; порядок вызовов сохраняется
+
+        Returns:
+            bool: False, если обработчики не запущены или уже остановлены и обновление отброшено
+        """
+        if not self._enqueue(routing_key(update), update):
+            logger.warning(f"Обработчики обновлений не запущены, обновление {update.update_id} отброшено")
+            return False
+        return True
+
+    def submit_call(self, chat_id, callback):
+        """
+        Ставит вызов корутины callback() в очередь обработчика чата после уже принятых обновлений
+
+        Returns:
+            bool: False, если обработчики не запущены или уже остановлены и вызов отброшен
+        """
+        if not self._enqueue(chat_id, callback):
+            logger.warning(f"Обработчики обновлений не запущены, действие для чата {chat_id} отброшено")
+            return False
+        return True
+
+    def _enqueue(self, key, item):
+        if self._stopped or not self._tasks:
+            return False
+        # Ключ - целое число (ID чата или пользователя); hash() здесь не подходит, у -1 и -2 он одинаковый
+        queue = self._queues[key % self.workers]
+        queue.put_nowait(item)
+        if queue.qsize() == QUEUE_WARNING_SIZE:
+            logger.warning(f"В очереди обработчика накопилось {QUEUE_WARNING_SIZE} обновлений")
+        return True
+
+    async def _worker(self, queue):
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        while True:
+            item = await queue.get()
+            try:
+                if isinstance(item, types.Update):
+                    await self.dispatcher.process_update(item)
+                else:
+                    await item()
+            except Exception as e:
+                if isinstance(item, types.Update):
+                    logger.error(f"Ошибка при обработке обновления {item.update_id}: {e}")
+                else:
+                    logger.error(f"Ошибка при выполнении действия из очереди обработчика: {e}")
+            finally:
+                queue.task_done()
+
+    async def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Дожидается обработки уже принятых обновлений и останавливает обработчики"""
+        if not self._tasks:
+            return
+        # Новые обновления больше не принимаются, уже принятые дорабатываются
+        self._stopped = True
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не все обновления успели обработаться до остановки")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+
+class RoutedDispatcher(Dispatcher):
+    """Диспетчер, который обрабатывает обновления из polling и webhook через UpdateRouter"""
+
+    def __init__(self, *args, workers=UPDATE_WORKERS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = UpdateRouter(self, workers)
+
+    async def _process_polling_updates(self, updates, fast=True):
+        # Без await между вызовами: пачки из getUpdates не перемешиваются между собой
+        for update in updates:
+            self.router.submit(update)
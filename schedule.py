@@ -2,6 +2,7 @@ import sqlite3
 import datetime
 from typing import List, Dict, Optional, Tuple
 import asyncio
+import storage
 
 class ScheduleManager:
     def __init__(self, db_path: str):
@@ -16,7 +17,7 @@ class ScheduleManager:
     
     def _init_db(self):
         """Инициализирует таблицу для расписания если её нет"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         cursor = conn.cursor()
         
         # Создаем таблицу для хранения событий
@@ -71,7 +72,7 @@ class ScheduleManager:
     def _add_event_sync(self, chat_id: int, creator_id: int, title: str, 
                        description: Optional[str], event_time: datetime.datetime) -> int:
         """Синхронная версия метода add_event"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -101,7 +102,7 @@ class ScheduleManager:
     
     def _delete_event_sync(self, event_id: int) -> bool:
         """Синхронная версия метода delete_event"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         cursor = conn.cursor()
         
         # Проверяем существует ли событие
@@ -131,7 +132,7 @@ class ScheduleManager:
     
     def _get_event_sync(self, event_id: int) -> Optional[Dict]:
         """Синхронная версия метода get_event"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -181,7 +182,7 @@ class ScheduleManager:
     
     def _get_chat_events_sync(self, chat_id: int, include_past: bool = False) -> List[Dict]:
         """Синхронная версия метода get_chat_events"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -234,7 +235,7 @@ class ScheduleManager:
     
     def _add_participant_sync(self, event_id: int, user_id: int, username: Optional[str] = None) -> bool:
         """Синхронная версия метода add_participant"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         cursor = conn.cursor()
         
         try:
@@ -273,7 +274,7 @@ class ScheduleManager:
     
     def _remove_participant_sync(self, event_id: int, user_id: int) -> bool:
         """Синхронная версия метода remove_participant"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -303,7 +304,7 @@ class ScheduleManager:
     
     def _get_upcoming_events_sync(self, within_hours: int = 24) -> List[Dict]:
         """Синхронная версия метода get_upcoming_events"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -337,7 +338,7 @@ class ScheduleManager:
     
     def _get_participants_sync(self, event_id: int) -> List[Dict]:
         """Синхронная версия метода get_participants"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -364,7 +365,7 @@ class ScheduleManager:
     
     def _mark_notification_sent_sync(self, event_id: int) -> None:
         """Синхронная версия метода mark_notification_sent"""
-        conn = sqlite3.connect(self.db_path)
+        conn = storage.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -0,0 +1,304 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+
+from config import SCHEDULER_UTC_OFFSET_HOURS, SCHEDULER_MISFIRE_GRACE
+
+logger = logging.getLogger(__name__)
+
+# Часовой пояс, в котором заданы расписания задач
+SCHEDULE_TZ = datetime.timezone(datetime.timedelta(hours=SCHEDULER_UTC_OFFSET_HOURS))
+
+# Дольше этого планировщик не спит, чтобы пережить перевод системных часов
+MAX_SLEEP_SECONDS = 3600
+
+
+def _parse_field(field, low, high):
+    """Разбирает одно поле cron-выражения: *, числа, диапазоны a-b, списки через запятую и шаг /n"""
+    values = set()
+    for part in field.split(','):
+        part, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Недопустимое значение поля расписания: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """
+    Расписание в формате cron: "минута час день месяц день_недели".
+
+    День недели: 0-6, где 0 (или 7) - воскресенье. Если заданы и день месяца, и день недели,
+    задача выполняется при совпадении любого из них, как в cron.
+    """
+
+    def __init__(self, expression, tz=SCHEDULE_TZ):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Расписание должно состоять из 5 полей: {expression}")
+        self.expression = expression
+        self.tz = tz
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in _parse_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        # isoweekday: 1 - понедельник ... 7 - воскресенье
+        weekday_ok = moment.isoweekday() % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """Первое время срабатывания строго после moment"""
+        moment = moment.astimezone(self.tz).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Перебор с пропуском целых месяцев, дней и часов; за 5 лет совпадение находится всегда
+        limit = moment + datetime.timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = (moment + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + datetime.timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Расписание никогда не срабатывает: {self.expression}")
+
+    def __repr__(self):
+        return f"cron({self.expression!r})"
+
+
+class DailyRandomTime:
+    """Раз в день в случайное время между start_hour и end_hour, одинаковое для всего дня"""
+
+    def __init__(self, start_hour, end_hour, tz=SCHEDULE_TZ):
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.tz = tz
+
+    def time_for(self, date):
+        # День года как seed: время воспроизводимо и не меняется после перезапуска
+        rng = random.Random(date.timetuple().tm_yday)
+        hour = rng.randint(self.start_hour, self.end_hour)
+        minute = rng.randint(0, 59)
+        return datetime.datetime(date.year, date.month, date.day, hour, minute, tzinfo=self.tz)
+
+    def next_after(self, moment):
+        moment = moment.astimezone(self.tz)
+        fire_time = self.time_for(moment.date())
+        if fire_time <= moment:
+            fire_time = self.time_for(moment.date() + datetime.timedelta(days=1))
+        return fire_time
+
+    def last_until(self, moment):
+        """Последнее время срабатывания не позже moment"""
+        moment = moment.astimezone(self.tz)
+        fire_time = self.time_for(moment.date())
+        if fire_time > moment:
+            fire_time = self.time_for(moment.date() - datetime.timedelta(days=1))
+        return fire_time
+
+    def __repr__(self):
+        return f"daily_random({self.start_hour}-{self.end_hour})"
+
+
+def cron(expression):
+    return CronSpec(expression)
+
+
+class Job:
+    """Регулярная задача: корутина func(fire_time) и расписание spec с методом next_after"""
+
+    def __init__(self, name, spec, func, catch_up=True):
+        self.name = name
+        self.spec = spec
+        self.func = func
+        self.catch_up = catch_up
+        self.next_run = None
+        self.running = None
+
+
+class Scheduler:
+    """
+    Планировщик регулярных задач на одной корутине.
+
+    Времена следующих запусков хранятся в куче; планировщик спит ровно до ближайшего
+    и запускает задачу отдельной корутиной, поэтому долгая задача не задерживает остальные.
+    Следующий запуск считается от запланированного времени, а не от текущего, так что
+    задачи не смещаются и не срабатывают дважды.
+
+    Если задан store (база данных с таблицей scheduled_jobs), время последнего запуска каждой
+    задачи сохраняется: после перезапуска пропущенный период выполняется один раз, а уже
+    выполненный не повторяется.
+    """
+
+    def __init__(self, store=None, misfire_grace=SCHEDULER_MISFIRE_GRACE):
+        self.store = store
+        self.misfire_grace = datetime.timedelta(seconds=misfire_grace)
+        self.jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._task = None
+        self._wakeup = None
+
+    @staticmethod
+    def now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def add_job(self, name, spec, func, catch_up=True):
+        """
+        Регистрирует задачу
+
+        Args:
+            name: уникальное имя задачи
+            spec: расписание (cron(...) или DailyRandomTime)
+            func: корутина, получающая запланированное время запуска
+            catch_up: выполнить запуск, пропущенный до старта планировщика (не раньше misfire_grace назад)
+        """
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        job = Job(name, spec, func, catch_up)
+        self.jobs[name] = job
+        if self._task is not None:
+            self._schedule(job, self._first_run(job, None))
+        return job
+
+    def _first_run(self, job, state):
+        """Время первого запуска задачи после старта с учетом сохраненного состояния"""
+        now = self.now()
+        last_run = state['last_run'] if state else None
+
+        if last_run is not None and state['status'] == 'running':
+            # Прошлый процесс упал посреди запуска: повторяем его
+            logger.warning(f"Задача {job.name}: запуск {last_run.isoformat()} был прерван, повторяем")
+            return last_run
+
+        if job.catch_up:
+            # Без истории догоняем только запуски в окне misfire_grace, с историей - любой пропущенный период
+            since = last_run if last_run is not None else now - self.misfire_grace
+            missed = None
+            fire_time = job.spec.next_after(since)
+            while fire_time <= now:
+                missed = fire_time
+                fire_time = job.spec.next_after(fire_time)
+            if missed is not None:
+                logger.info(f"Задача {job.name}: выполняем пропущенный запуск {missed.isoformat()}")
+                return missed
+        return job.spec.next_after(now)
+
+    def _schedule(self, job, fire_time):
+        job.next_run = fire_time
+        heapq.heappush(self._heap, (fire_time, next(self._counter), job))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        states = await self.store.get_scheduled_jobs() if self.store else {}
+        self._wakeup = asyncio.Event()
+        for job in self.jobs.values():
+            self._schedule(job, self._first_run(job, states.get(job.name)))
+        if self.store:
+            await self.store.save_job_schedule([(job.name, job.next_run) for job in self.jobs.values()])
+        self._task = asyncio.ensure_future(self._run())
+        logger.info(f"Планировщик запущен, задач: {len(self.jobs)}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._heap.clear()
+
+        running = [job.running for job in self.jobs.values() if job.running is not None]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        logger.info("Планировщик остановлен")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            fire_time, _, job = self._heap[0]
+            delay = (fire_time - self.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, MAX_SLEEP_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            self._fire(job, fire_time)
+
+            next_run = job.spec.next_after(fire_time)
+            if next_run <= self.now():
+                # Планировщик отстал (например, система спала): пропущенные запуски не накапливаем
+                logger.warning(f"Задача {job.name}: пропущены запуски до {self.now().isoformat()}")
+                next_run = job.spec.next_after(self.now())
+            self._schedule(job, next_run)
+
+    def _fire(self, job, fire_time):
+        if job.running is not None:
+            logger.warning(f"Задача {job.name} еще выполняется, запуск {fire_time.isoformat()} пропущен")
+            return
+        job.running = asyncio.ensure_future(self._execute(job, fire_time))
+
+    async def _execute(self, job, fire_time):
+        # job.running сбрасывается при любом исходе, иначе следующие запуски будут считаться пересекающимися
+        try:
+            try:
+                if self.store and not await self.store.start_job_run(job.name, fire_time):
+                    logger.info(f"Задача {job.name}: запуск {fire_time.isoformat()} уже выполнен, пропускаем")
+                    return
+            except Exception as e:
+                logger.error(f"Не удалось отметить запуск задачи {job.name}, запуск пропущен: {e}")
+                return
+
+            logger.info(f"Запуск задачи {job.name} ({fire_time.isoformat()})")
+            error = None
+            try:
+                await job.func(fire_time)
+            except asyncio.CancelledError:
+                # Остановка бота: запись остается в статусе running и запуск повторится после старта
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                logger.error(f"Ошибка при выполнении задачи {job.name}: {e}")
+
+            if self.store:
+                try:
+                    await self.store.finish_job_run(job.name, job.next_run, error)
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить результат задачи {job.name}: {e}")
+        finally:
+            job.running = None
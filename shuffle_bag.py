@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import random
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Число раундов сети Фейстеля; четырех достаточно, чтобы порядок выглядел случайным
+FEISTEL_ROUNDS = 4
+
+
+def _round_function(seed, round_number, value, bits):
+    digest = hashlib.blake2b(f'{seed}:{round_number}:{value}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & ((1 << bits) - 1)
+
+
+def permutation_index(seed, position, size):
+    """
+    Элемент на позиции position в псевдослучайной перестановке чисел 0..size-1, заданной seed
+
+    Перестановка не хранится: сеть Фейстеля биективно перемешивает числа в диапазоне
+    степени двойки, а значения за пределами size пропускаются повторным применением.
+    Поэтому для любого seed позиции 0..size-1 дают каждое число ровно один раз.
+    """
+    if size <= 1:
+        return 0
+    half = ((size - 1).bit_length() + 1) // 2
+    mask = (1 << half) - 1
+    value = position
+    while True:
+        left, right = value >> half, value & mask
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ _round_function(seed, round_number, right, half)
+        value = (left << half) | right
+        # Диапазон меньше 4 * size, так что в среднем хватает нескольких шагов
+        if value < size:
+            return value
+
+
+def _seed_chooser(size):
+    """seed нового круга, который не начинается с последнего элемента прошлого круга"""
+    def choose(previous):
+        seed = random.getrandbits(62)
+        if previous is not None and size > 1:
+            last = permutation_index(previous, size - 1, size)
+            while permutation_index(seed, 0, size) == last:
+                seed = random.getrandbits(62)
+        return seed
+    return choose
+
+
+def pool_name(pack, category=None, difficulty=None):
+    """Имя набора для курсора: у каждой категории и сложности своя очередь без повторов"""
+    return f"{pack.name}:{'*' if category is None else category}:{'*' if difficulty is None else difficulty}"
+
+
+async def draw_many(chat_ids, pack, category=None, difficulty=None):
+    """
+    Выбирает для каждого чата следующий элемент набора без повторов
+
+    Пока чат не получил все элементы набора (с учетом категории и сложности), элементы
+    не повторяются; затем начинается новый круг в другом порядке. Для чата хранится
+    только seed перестановки и позиция в ней. Если курсоры недоступны, элемент
+    выбирается просто случайно.
+
+    Returns:
+        dict: {chat_id: элемент}; пустой, если подходящих элементов нет
+    """
+    # Представление фиксирует текущую загрузку набора на время запроса к базе
+    view = pack.view(category, difficulty)
+    size = len(view)
+    if not size or not chat_ids:
+        return {}
+
+    try:
+        positions = await db.take_content_positions(
+            pool_name(pack, category, difficulty), chat_ids, size, new_seed=_seed_chooser(size)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выборе контента без повторов из {pack.name}: {e}")
+        return {chat_id: pack.random(category, difficulty) for chat_id in chat_ids}
+
+    return {
+        chat_id: view[permutation_index(seed, position, size)]
+        for chat_id, (seed, position) in positions.items()
+    }
+
+
+async def draw(chat_id, pack, category=None, difficulty=None):
+    """Следующий элемент набора без повторов для одного чата или None"""
+    return (await draw_many([chat_id], pack, category, difficulty)).get(chat_id)
@@ -0,0 +1,21 @@
+import sqlite3
+from config import SQLITE_PRAGMAS
+
+
+def pragma_statements():
+    """PRAGMA-выражения для настроек хранилища из config.py"""
+    return [f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items()]
+
+
+def connect(db_path):
+    """Открывает соединение sqlite3 с настройками хранилища"""
+    conn = sqlite3.connect(db_path)
+    for statement in pragma_statements():
+        conn.execute(statement)
+    return conn
+
+
+async def apply_pragmas(db):
+    """Применяет настройки хранилища к соединению aiosqlite"""
+    for statement in pragma_statements():
+        await db.execute(statement)
@@ -0,0 +1,146 @@
+import asyncio
+import hmac
+import logging
+import ssl
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot import api
+from aiogram.utils.payload import prepare_file
+
+from config import (WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_SSL_CERT, WEBHOOK_SSL_KEY,
+                    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_MAX_CONNECTIONS)
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает секрет, указанный при установке webhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Сколько ждать обработки уже принятых обновлений при остановке (в секундах)
+SHUTDOWN_TIMEOUT = 30
+
+
+class WebhookServer:
+    """
+    Прием обновлений от Telegram через webhook.
+
+    На каждый запрос сразу отвечает 200, а обновление обрабатывается диспетчером в фоне,
+    поэтому долгие обработчики не задерживают Telegram и не вызывают повторную доставку.
+    """
+
+    def __init__(self, dispatcher, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.dispatcher = dispatcher
+        self.bot = dispatcher.bot
+        self.path = path
+        self.secret = secret
+        self._tasks = set()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request):
+        if self.secret:
+            token = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.secret):
+                logger.warning(f"Отклонен запрос к webhook с неверным секретом от {request.remote}")
+                return web.Response(status=403)
+
+        try:
+            update = types.Update(**await request.json())
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в запросе к webhook: {e}")
+            return web.Response(status=400)
+
+        router = getattr(self.dispatcher, 'router', None)
+        if router is not None:
+            # RoutedDispatcher: обновление обработает обработчик его чата, по порядку.
+            # Во время остановки бота Telegram получит ошибку и повторит доставку позже
+            if not router.submit(update):
+                return web.Response(status=503)
+            return web.Response(status=200)
+
+        # Контекст бота и диспетчера копируется в фоновую задачу
+        Bot.set_current(self.bot)
+        Dispatcher.set_current(self.dispatcher)
+        task = asyncio.ensure_future(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update):
+        try:
+            await self.dispatcher.process_update(update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+
+    async def set_webhook(self, url, certificate=None):
+        """Регистрирует webhook в Telegram; накопившиеся обновления не сбрасываются"""
+        # aiogram 2 не передает secret_token в setWebhook, поэтому запрос формируется вручную
+        payload = {
+            'url': url,
+            'max_connections': WEBHOOK_MAX_CONNECTIONS
+        }
+        if self.secret:
+            payload['secret_token'] = self.secret
+        files = {}
+        if certificate:
+            prepare_file(payload, files, 'certificate', types.InputFile(certificate))
+        await self.bot.request(api.Methods.SET_WEBHOOK, payload, files)
+        logger.info(f"Webhook установлен: {url}")
+
+    async def drain(self, timeout=SHUTDOWN_TIMEOUT):
+        """Ждет завершения обработки уже принятых обновлений"""
+        if not self._tasks:
+            return
+        logger.info(f"Ожидание обработки {len(self._tasks)} обновлений")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+
+def ssl_context(cert_path=WEBHOOK_SSL_CERT, key_path=WEBHOOK_SSL_KEY):
+    """SSL-контекст для собственного HTTPS (например, с самоподписанным сертификатом) или None"""
+    if not cert_path or not key_path:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+def run_webhook(dispatcher, on_startup=None, on_shutdown=None):
+    """
+    Запускает бота в режиме webhook
+
+    on_startup и on_shutdown получают диспетчер, как в executor.start_polling.
+    Если заданы WEBHOOK_SSL_CERT и WEBHOOK_SSL_KEY, сервер сам принимает HTTPS,
+    а сертификат загружается в Telegram (нужно для самоподписанного сертификата).
+    """
+    if not WEBHOOK_HOST:
+        raise RuntimeError("Для режима webhook нужно указать WEBHOOK_HOST")
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET не задан: запросы к webhook не проверяются")
+
+    server = WebhookServer(dispatcher)
+    app = server.create_app()
+    context = ssl_context()
+
+    async def startup(app):
+        if on_startup:
+            await on_startup(dispatcher)
+        await server.set_webhook(
+            WEBHOOK_HOST.rstrip('/') + WEBHOOK_PATH,
+            certificate=WEBHOOK_SSL_CERT if context else None
+        )
+
+    async def shutdown(app):
+        # Webhook не удаляется: пока бот перезапускается, Telegram копит обновления
+        await server.drain()
+        if on_shutdown:
+            await on_shutdown(dispatcher)
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    # Тот же цикл событий, к которому уже привязаны бот и диспетчер
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, ssl_context=context, loop=asyncio.get_event_loop())